@@ -0,0 +1,181 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Synchronize networks and subnets with BCF once.
+
+    # dry run of the whole fabric
+    $ bcf-sync-l3
+    # repair one project
+    $ bcf-sync-l3 -p project_example -x
+    # review a plan, then apply exactly that plan
+    $ bcf-sync-l3 --save-plan plan.json
+    $ bcf-sync-l3 --load-plan plan.json -x
+    # let neutron-server synchronize now
+    $ bcf-sync-l3 --trigger
+"""
+
+from __future__ import print_function
+
+import argparse
+import eventlet
+import logging
+import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib.event import EventNotifier
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+from networking_bigswitch_l3_pe.lib.synchronizer import Synchronizer
+from neutron.common import config
+from oslo_config import cfg
+import sys
+
+LOG = logging.getLogger('networking_bigswitch_l3_pe.lib.synchronizer')
+
+DEFAULT_CONFIG_FILES = ['/etc/neutron/neutron.conf',
+                        '/etc/neutron/plugins/ml2/ml2_conf.ini']
+
+
+def enable_stdout_log(logger, level=logging.DEBUG):
+    logger.setLevel(level)
+    ch = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def setup_config(config_files):
+    try:
+        import networking_bigswitch.plugins.bigswitch.config as \
+            bigswitch_config
+    except ImportError:
+        import bsnstacklib.plugins.bigswitch.config as bigswitch_config
+    # registers the options of keystone_authtoken
+    import keystonemiddleware.auth_token  # noqa
+
+    bigswitch_config.register_config()
+    networking_bigswitch_l3_pe.lib.config.register_config()
+    config.init(['--config-file=%s' % f for f in config_files])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='synchronize l3 config with BCF')
+    parser.add_argument('-x', '--execute', action='store_true', default=False,
+                        help='apply changes to BCF. '
+                             'Without this, nothing is written.')
+    parser.add_argument('-p', '--project', action='append', default=[],
+                        help='synchronize only this project (name or id). '
+                             'Can be given more than once.')
+    parser.add_argument('-t', '--tenant', action='append', default=[],
+                        help='synchronize only this BCF tenant (name), e.g. '
+                             'of a deleted project. '
+                             'Can be given more than once.')
+    parser.add_argument('-s', '--segment', action='append', default=[],
+                        help='synchronize only this network (name). '
+                             'Can be given more than once.')
+    parser.add_argument('--save-plan', metavar='FILE', default=None,
+                        help='write the plan to FILE as JSON')
+    parser.add_argument('--load-plan', metavar='FILE', default=None,
+                        help='apply a plan saved by --save-plan instead of '
+                             'comparing OpenStack with BCF')
+    parser.add_argument('--trigger', action='store_true', default=False,
+                        help='ask neutron-server to synchronize now '
+                             'instead of synchronizing here')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='neutron config files (default: %s)' %
+                             ', '.join(DEFAULT_CONFIG_FILES))
+    parser.add_argument('-q', '--quiet', action='store_true', default=False,
+                        help='log only warnings and errors')
+    args = parser.parse_args(argv)
+    if args.load_plan and (args.project or args.tenant or args.segment or
+                           args.save_plan):
+        parser.error('--load-plan cannot be used with '
+                     '--project, --tenant, --segment or --save-plan')
+    if args.trigger and (args.execute or args.project or args.tenant or
+                         args.segment or args.save_plan or args.load_plan):
+        parser.error('--trigger cannot be used with other options '
+                     'except --config-file and --quiet')
+    return args
+
+
+def print_statistics(metrics, out=None):
+    out = out or sys.stdout
+    print('phase seconds:', file=out)
+    for name, value in sorted(metrics.phases.items()):
+        print('  %-14s %9.3f' % (name, value), file=out)
+
+    print('objects:', file=out)
+    for (kind, stage), value in sorted(metrics.objects.items()):
+        print('  %-8s %-14s %7d' % (kind, stage, value), file=out)
+
+    print('rest calls:           count   mean(s)  total(s)', file=out)
+    for (verb, path), h in sorted(metrics.rest_latency.items()):
+        print('  %-6s %-60s %7d %9.3f %9.3f' % (
+            verb, path, h.count, h.sum / h.count if h.count else 0, h.sum),
+            file=out)
+    for (verb, path, code), value in sorted(metrics.rest_errors.items()):
+        print('  %-6s %-60s error(%s): %d' % (verb, path, code, value),
+              file=out)
+
+
+def run(args):
+    if args.trigger:
+        EventNotifier().request_sync()
+        LOG.info("Requested a synchronization to neutron-server")
+        return None
+
+    api_url = cfg.CONF.networking_bigswitch_l3_pe.api_url
+    username, password = cfg.CONF.RESTPROXY.server_auth.split(':')
+    neutron_id = cfg.CONF.RESTPROXY.neutron_id
+    exclude_physical_networks = \
+        cfg.CONF.networking_bigswitch_l3_pe.exclude_physical_networks
+    sync = Synchronizer(api_url, username, password, neutron_id,
+                        exclude_physical_networks, dry_run=(not args.execute))
+    # Don't overwrite the metrics exported by neutron-server, nor its
+    # checkpoint.
+    sync.metrics.sink = None
+    sync.checkpoint = None
+
+    sync.metrics.start_cycle()
+    with sync.metrics.phase('total'):
+        if args.load_plan:
+            with open(args.load_plan) as f:
+                plan = SyncPlan.from_json(f.read())
+        else:
+            plan = sync.plan(projects=args.project, segments=args.segment,
+                             tenants=args.tenant)
+        if args.save_plan:
+            with open(args.save_plan, 'w') as f:
+                f.write(plan.to_json(indent=2, sort_keys=True))
+        ret = sync.apply_plan(plan)
+
+    LOG.info("Finished synchronization%(dry_run)s: "
+             "%(count)d operations, synchronized resources: %(resource)s.",
+             {'count': len(plan), 'resource': ret,
+              'dry_run': '(dry run mode)' if sync.dry_run else ''})
+    print_statistics(sync.metrics)
+    return ret
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Applying changes to BCF uses green threads.
+    eventlet.monkey_patch()
+    enable_stdout_log(LOG, logging.WARNING if args.quiet else logging.DEBUG)
+    setup_config(args.config_file or DEFAULT_CONFIG_FILES)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
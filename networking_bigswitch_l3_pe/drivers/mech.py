@@ -17,13 +17,26 @@ try:
 except ImportError:
     import bsnstacklib.plugins.bigswitch.config as bigswitch_config
 import eventlet
+import functools
 import logging
 import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib.coordination import get_lock_backend
+from networking_bigswitch_l3_pe.lib.coordination import LeaderElector
+from networking_bigswitch_l3_pe.lib.coordination import LocalLockBackend
+from networking_bigswitch_l3_pe.lib.event import DELETE_EVENTS
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_CREATE
 from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_DELETE
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_UPDATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_CREATE
 from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_DELETE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_UPDATE
+from networking_bigswitch_l3_pe.lib.event import INCREMENTAL_EVENTS
 from networking_bigswitch_l3_pe.lib.event import EventNotifier
 from networking_bigswitch_l3_pe.lib.event import EventWatcher
+from networking_bigswitch_l3_pe.lib.event_journal import EventJournal
 from networking_bigswitch_l3_pe.lib.keystone_client import KeystoneClient
+from networking_bigswitch_l3_pe.lib.keystone_client import ProjectNameCache
+from networking_bigswitch_l3_pe.lib.scheduler import SyncScheduler
 from networking_bigswitch_l3_pe.lib.synchronizer import Synchronizer
 from neutron import context as ncontext
 from neutron.db import db_base_plugin_v2
@@ -33,6 +46,22 @@ from oslo_config import cfg
 LOG = logging.getLogger(__name__)
 
 
+def _log_errors(func):
+    """Log an error of a postcommit hook instead of failing the API call.
+
+    ML2 would undo the change, while the full synchronization repairs
+    an event which wasn't sent.
+    """
+    @functools.wraps(func)
+    def wrapper(self, context):
+        try:
+            return func(self, context)
+        except Exception as e:
+            LOG.exception("Exception in %(func)s: %(e)s",
+                          {'func': func.__name__, 'e': e})
+    return wrapper
+
+
 class BCFPhysicalEditionMechanismDriver(MechanismDriver):
 
     def __init__(self):
@@ -42,31 +71,176 @@ class BCFPhysicalEditionMechanismDriver(MechanismDriver):
         api_url = cfg.CONF.networking_bigswitch_l3_pe.api_url
         username, password = cfg.CONF.RESTPROXY.server_auth.split(':')
         self.neutron_id = cfg.CONF.RESTPROXY.neutron_id
-        exclude_physical_networks = \
+        self.exclude_physical_networks = \
             cfg.CONF.networking_bigswitch_l3_pe.exclude_physical_networks
+        self.project_cache = ProjectNameCache(
+            KeystoneClient(),
+            ttl=cfg.CONF.networking_bigswitch_l3_pe.project_cache_ttl,
+            max_size=cfg.CONF.networking_bigswitch_l3_pe.project_cache_size)
         self.sync = Synchronizer(api_url, username, password, self.neutron_id,
-                                 exclude_physical_networks)
+                                 self.exclude_physical_networks,
+                                 project_cache=self.project_cache)
         self.notifier = EventNotifier()
-        self.watcher = EventWatcher()
-        self.keystone_client = KeystoneClient()
+        # Only the leader keeps events and synchronizes with BCF. The
+        # others forward events to it.
+        self.watcher = EventWatcher(
+            capacity=cfg.CONF.networking_bigswitch_l3_pe.event_queue_size,
+            overflow=cfg.CONF.networking_bigswitch_l3_pe.event_queue_overflow,
+            notifier=self.notifier)
+        self.elector = LeaderElector(
+            get_lock_backend(cfg.CONF.networking_bigswitch_l3_pe),
+            ttl=cfg.CONF.networking_bigswitch_l3_pe.leader_lease_ttl)
+        if isinstance(self.elector.backend, LocalLockBackend) and \
+                self.sync.checkpoint:
+            # Every process leads, and they would overwrite the progress
+            # of each other.
+            LOG.warning("The progress of a synchronization isn't recorded "
+                        "because every process synchronizes by itself")
+            self.sync.checkpoint = None
+        self.scheduler = SyncScheduler(
+            min_interval=cfg.CONF.networking_bigswitch_l3_pe.sync_interval,
+            max_interval=cfg.CONF.networking_bigswitch_l3_pe.sync_max_interval,
+            debounce=cfg.CONF.networking_bigswitch_l3_pe.sync_debounce,
+            jitter=cfg.CONF.networking_bigswitch_l3_pe.sync_jitter)
+        self.watcher.on_sync_request = self.scheduler.trigger
         self.db_plugin = db_base_plugin_v2.NeutronDbPluginV2()
 
         eventlet.spawn(self.watcher.watch)
-        eventlet.spawn(self._bcf_sync,
-                       cfg.CONF.networking_bigswitch_l3_pe.sync_interval)
+        eventlet.spawn(self._bcf_lead, self.elector.ttl / 3.0)
+        eventlet.spawn(self._bcf_sync)
+        eventlet.spawn(self._bcf_apply_events,
+                       cfg.CONF.networking_bigswitch_l3_pe.event_interval)
 
-    def _bcf_sync(self, polling_interval=600):
+    def _open_journal(self):
+        conf = cfg.CONF.networking_bigswitch_l3_pe
+        if not conf.event_journal:
+            return None
+        try:
+            return EventJournal(
+                conf.event_journal,
+                sync_interval=conf.event_journal_sync_interval,
+                max_size=conf.event_journal_max_size)
+        except (IOError, OSError) as e:
+            LOG.warning("Received events are not journaled because "
+                        "%(path)s can't be opened: %(e)s",
+                        {'path': conf.event_journal, 'e': e})
+            return None
+
+    def _bcf_lead(self, polling_interval=10):
+        replayed = False
         while True:
             try:
-                eventlet.sleep(polling_interval)
-                events = self.watcher.pop_events()
-                self.sync.synchronize(events=events)
+                leader = self.elector.heartbeat()
+                if leader and not self.watcher.leading:
+                    self.watcher.start_leading(journal=self._open_journal())
+                    # The previous leader may have stopped halfway.
+                    self.scheduler.notify()
+                elif not leader and self.watcher.leading:
+                    self.watcher.stop_leading()
+                elif not leader and not replayed:
+                    # This process may have been the leader before a crash.
+                    # The journal is locked if another one is the leader.
+                    journal = self._open_journal()
+                    if journal:
+                        self.watcher.forward_journal(journal)
+                replayed = True
+            except Exception as e:
+                LOG.exception("Excpetion in _bcf_lead: %(e)s", {'e': e})
+            eventlet.sleep(polling_interval)
+
+    def _bcf_sync(self):
+        while True:
+            # Without changes, the interval grows up to sync_max_interval.
+            changed = True
+            try:
+                self.scheduler.wait()
+                if not self.elector.is_leader:
+                    continue
+                # The last one was interrupted after changing BCF. If it
+                # can't be resumed, a full one is run instead.
+                if self.sync.has_checkpoint() and \
+                        self.sync.resume() is not None:
+                    continue
+                events = self.watcher.pop_events(event_types=DELETE_EVENTS)
+                try:
+                    changed = bool(self.sync.synchronize(events=events))
+                except Exception:
+                    self.watcher.requeue(events)
+                    raise
+                self.watcher.ack(events)
             except Exception as e:
                 LOG.exception("Excpetion in _bcf_sync: %(e)s", {'e': e})
+            finally:
+                self.scheduler.done(changed)
+
+    def _bcf_apply_events(self, polling_interval=5):
+        while True:
+            try:
+                eventlet.sleep(polling_interval)
+                if not self.elector.is_leader:
+                    continue
+                self.watcher.flush()
+                events = self.watcher.pop_events(
+                    event_types=INCREMENTAL_EVENTS)
+                if events:
+                    try:
+                        self.sync.apply_events(events)
+                    except Exception:
+                        # The full synchronization adds them.
+                        self.scheduler.notify()
+                        raise
+                    finally:
+                        self.watcher.ack(events)
+
+                # Deletions are applied by synchronizing only the tenants
+                # of the events.
+                events = self.watcher.pop_events(event_types=DELETE_EVENTS)
+                if events:
+                    try:
+                        self.sync.synchronize_events(events)
+                    except Exception:
+                        # leave them to the next full synchronization
+                        self.watcher.requeue(events)
+                        self.scheduler.notify()
+                        raise
+                    self.watcher.ack(events)
+            except Exception as e:
+                LOG.exception("Excpetion in _bcf_apply_events: %(e)s",
+                              {'e': e})
 
     def initialize(self):
         pass
 
+    @_log_errors
+    def create_network_postcommit(self, context):
+        if self._is_excluded(context.network_segments):
+            return
+        self.notifier.notify(context.current, EVENT_NETWORK_CREATE, {
+            'project_name': self._get_project_name(
+                context.current['tenant_id']),
+            'segment_name': context.current['name'],
+        })
+
+    @_log_errors
+    def update_network_postcommit(self, context):
+        if self._is_excluded(context.network_segments):
+            return
+        original_name = context.original['name']
+        if original_name == context.current['name']:
+            return
+        # The segment of the old name is deleted unless another network
+        # still has it.
+        self.notifier.notify(context.original, EVENT_NETWORK_DELETE, {
+            'project_name': self._get_project_name(
+                context.original['tenant_id']),
+            'segment_name': original_name,
+        })
+        self.notifier.notify(context.current, EVENT_NETWORK_UPDATE, {
+            'project_name': self._get_project_name(
+                context.current['tenant_id']),
+            'segment_name': context.current['name'],
+        })
+
     def delete_network_postcommit(self, context):
         project_name = self._get_project_name(context.current['tenant_id'])
         segment_name = context.current['name']
@@ -85,9 +259,58 @@ class BCFPhysicalEditionMechanismDriver(MechanismDriver):
             'current_gateway_ip': gateway_ip,
         })
 
+    @_log_errors
+    def create_subnet_postcommit(self, context):
+        if self._is_excluded(context.network.network_segments):
+            return
+        gateway_ip = self._get_gateway_ip(context.current)
+        if not gateway_ip:
+            return
+        self.notifier.notify(context.current, EVENT_SUBNET_CREATE, {
+            'project_name': self._get_project_name(
+                context.current['tenant_id']),
+            'segment_name': context.network.current['name'],
+            'current_gateway_ip': gateway_ip,
+        })
+
+    @_log_errors
+    def update_subnet_postcommit(self, context):
+        if self._is_excluded(context.network.network_segments):
+            return
+        original_gateway_ip = self._get_gateway_ip(context.original)
+        gateway_ip = self._get_gateway_ip(context.current)
+        if original_gateway_ip == gateway_ip:
+            return
+
+        project_name = self._get_project_name(context.current['tenant_id'])
+        segment_name = context.network.current['name']
+        if not gateway_ip:
+            # The gateway was removed. The full synchronization deletes it.
+            self.notifier.notify(context.current, EVENT_SUBNET_DELETE, {
+                'project_name': project_name,
+                'segment_name': segment_name,
+                'current_gateway_ip': original_gateway_ip,
+            })
+            return
+
+        event = {
+            'project_name': project_name,
+            'segment_name': segment_name,
+            'current_gateway_ip': gateway_ip,
+        }
+        if original_gateway_ip:
+            event['original_gateway_ip'] = original_gateway_ip
+        self.notifier.notify(context.current, EVENT_SUBNET_UPDATE, event)
+
+    def _is_excluded(self, segments):
+        return any(s.get('physical_network') in self.exclude_physical_networks
+                   for s in segments or [])
+
     def _get_project_name(self, tenant_id):
-        projects = self.keystone_client.get_projects()
-        return projects[tenant_id] + "." + self.neutron_id
+        name = self.project_cache.get_name(tenant_id)
+        if not name:
+            raise KeyError(tenant_id)
+        return name + "." + self.neutron_id
 
     def _get_segment_name(self, network_id):
         ctx = ncontext.get_admin_context()
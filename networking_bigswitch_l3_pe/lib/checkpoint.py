@@ -0,0 +1,100 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+from networking_bigswitch_l3_pe.lib.exceptions import InvalidSyncPlan
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+import os
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """Progress of applying a SyncPlan, kept in a file until it's finished.
+
+    The first line of the file is the plan, and each following line is the
+    id of an applied operation. Only the plan is fsynced, since a lost id
+    is just validated and applied again when resuming.
+    """
+
+    def __init__(self, path, max_age=86400):
+        self.path = path
+        self.max_age = max_age
+        self._file = None
+
+    def begin(self, plan):
+        self.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'created_at': time.time(),
+                                'plan': plan.to_dict()}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+
+    def applied(self, operation):
+        self._file.write(json.dumps({'applied': operation['id']}) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def finish(self):
+        """Forget the plan because it's done."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        """Return the plan and the ids of its applied operations.
+
+        None is returned if there's no plan, or it's broken or too old.
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except IOError:
+            return None
+
+        try:
+            header = json.loads(lines[0])
+            if time.time() - header['created_at'] > self.max_age:
+                LOG.warning("Discarded the checkpoint %(path)s because it's "
+                            "too old", {'path': self.path})
+                return None
+            plan = SyncPlan.from_dict(header['plan'])
+        except (IndexError, KeyError, TypeError, ValueError,
+                InvalidSyncPlan) as e:
+            LOG.warning("Discarded the broken checkpoint %(path)s: %(e)s",
+                        {'path': self.path, 'e': e})
+            return None
+
+        applied = set()
+        for line in lines[1:]:
+            try:
+                applied.add(json.loads(line)['applied'])
+            except (KeyError, TypeError, ValueError):
+                # a line partially written before a crash
+                break
+        return plan, applied
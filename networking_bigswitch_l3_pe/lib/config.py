@@ -20,9 +20,130 @@ bcf_pe_opts = [
                     "of the form (i.e. https://controller:8443/api/v1)"),
     cfg.IntOpt('sync_interval', default=600,
                help="Time between synchronization to BCF Controller "),
+    cfg.IntOpt('sync_max_interval', default=3600,
+               help="Time between synchronization to BCF Controller grows "
+                    "up to this while nothing is changed by them"),
+    cfg.IntOpt('sync_debounce', default=10,
+               help="Seconds after a failure to apply events until a "
+                    "synchronization to BCF Controller. Failures in the "
+                    "meantime are repaired by the same synchronization"),
+    cfg.FloatOpt('sync_jitter', default=0.1,
+                 help="Up to this fraction of the interval is added to "
+                      "the time between synchronization at random"),
+    cfg.IntOpt('event_interval', default=5,
+               help="Time between applying created or updated networks "
+                    "and subnets to BCF Controller"),
     cfg.ListOpt('exclude_physical_networks', default=[],
                 help="A comma separated list of physical networks which "
                      "should not be synchronized with BCF"),
+    cfg.IntOpt('rest_pool_size', default=4,
+               help="Maximum number of idle keep-alive connections to "
+                    "BCF Controller"),
+    cfg.IntOpt('rest_idle_timeout', default=60,
+               help="Seconds after which an idle connection to "
+                    "BCF Controller is closed"),
+    cfg.FloatOpt('rest_rate', default=2.0,
+                 help="Initial number of write operations per second "
+                      "sent to BCF Controller during synchronization"),
+    cfg.FloatOpt('rest_min_rate', default=0.5,
+                 help="Lower limit of write operations per second"),
+    cfg.FloatOpt('rest_max_rate', default=20.0,
+                 help="Upper limit of write operations per second"),
+    cfg.IntOpt('rest_burst', default=5,
+               help="Number of write operations which can be sent "
+                    "without waiting"),
+    cfg.FloatOpt('rest_latency_target', default=1.0,
+                 help="Seconds of a write operation above which the "
+                      "write rate is decreased"),
+    cfg.IntOpt('rest_retries', default=3,
+               help="Number of retries of a write operation to BCF "
+                    "Controller which failed with a transient error"),
+    cfg.FloatOpt('rest_retry_delay', default=1.0,
+                 help="Maximum seconds before the first retry. It's "
+                      "doubled for each retry"),
+    cfg.FloatOpt('rest_retry_max_delay', default=30.0,
+                 help="Upper limit of seconds before a retry"),
+    cfg.IntOpt('rest_breaker_threshold', default=5,
+               help="Number of transient errors in a row after which "
+                    "writes to BCF Controller are paused"),
+    cfg.IntOpt('rest_breaker_timeout', default=60,
+               help="Seconds for which writes to BCF Controller are "
+                    "paused"),
+    cfg.BoolOpt('rest_bulk_provisioning', default=False,
+                help="Write the objects of a new network and its subnets "
+                     "into the logical router of a tenant with one PATCH. "
+                     "Each object is PUT if the controller rejects it"),
+    cfg.StrOpt('sync_checkpoint',
+               default='/var/lib/neutron/networking_bigswitch_l3_pe.ckpt',
+               help="File which records the progress of a full "
+                    "synchronization, so that an interrupted one is "
+                    "resumed. Empty disables it, and so does the local "
+                    "coordination backend"),
+    cfg.IntOpt('sync_checkpoint_max_age', default=3600,
+               help="Seconds after which an interrupted synchronization "
+                    "is not resumed"),
+    cfg.BoolOpt('sync_fingerprints', default=True,
+                help="Fetch from BCF Controller and compare only tenants "
+                     "whose networks or subnets in OpenStack changed since "
+                     "the last synchronization, and skip the "
+                     "synchronization if none changed"),
+    cfg.IntOpt('sync_full_interval', default=21600,
+               help="Seconds after which every tenant is fetched from BCF "
+                    "Controller and compared again, to repair changes "
+                    "made on BCF Controller"),
+    cfg.IntOpt('sync_workers', default=4,
+               help="Number of tenants which are synchronized with "
+                    "BCF Controller concurrently"),
+    cfg.IntOpt('project_cache_ttl', default=300,
+               help="Seconds for which project names from Keystone "
+                    "are cached"),
+    cfg.IntOpt('project_cache_size', default=10000,
+               help="Maximum number of cached project names"),
+    cfg.IntOpt('event_queue_size', default=10000,
+               help="Maximum number of received events which are not "
+                    "applied yet. 0 means unlimited"),
+    cfg.StrOpt('event_queue_overflow', default='drop_oldest',
+               choices=['drop_oldest', 'drop_newest'],
+               help="Which event is dropped when event_queue_size events "
+                    "are queued"),
+    cfg.StrOpt('event_journal',
+               default='/var/lib/neutron/networking_bigswitch_l3_pe.journal',
+               help="File which keeps received events until they are "
+                    "applied, so that they are applied after a restart. "
+                    "Empty disables it"),
+    cfg.FloatOpt('event_journal_sync_interval', default=1.0,
+                 help="Maximum seconds until a received event is fsynced "
+                      "to the event journal"),
+    cfg.IntOpt('event_journal_max_size', default=16 * 1024 * 1024,
+               help="Bytes of the event journal above which it's "
+                    "compacted"),
+    cfg.StrOpt('coordination_backend', default='file',
+               choices=['file', 'local'],
+               help="How neutron-server processes elect the one which "
+                    "synchronizes with BCF Controller. file elects one "
+                    "among the processes sharing coordination_lock_file, "
+                    "and local makes every process the leader"),
+    cfg.StrOpt('coordination_lock_file',
+               default='/var/lib/neutron/networking_bigswitch_l3_pe.leader',
+               help="Lease file of the file coordination backend. Put it "
+                    "on a shared file system to elect one process across "
+                    "hosts. If it can't be locked, every process "
+                    "synchronizes by itself"),
+    cfg.IntOpt('leader_lease_ttl', default=30,
+               help="Seconds after which the leader is replaced if it "
+                    "doesn't renew its lease"),
+    cfg.StrOpt('metrics_sink', default='none',
+               choices=['none', 'prometheus', 'statsd'],
+               help="Where timings of synchronization and REST calls "
+                    "are exported"),
+    cfg.StrOpt('metrics_textfile',
+               default='/var/lib/neutron/networking_bigswitch_l3_pe.prom',
+               help="File written in the Prometheus text format when "
+                    "metrics_sink is prometheus"),
+    cfg.StrOpt('metrics_statsd_host', default='127.0.0.1',
+               help="statsd host when metrics_sink is statsd"),
+    cfg.PortOpt('metrics_statsd_port', default=8125,
+                help="statsd port when metrics_sink is statsd"),
 ]
 
 
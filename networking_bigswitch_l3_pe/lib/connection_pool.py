@@ -0,0 +1,121 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import logging
+from six.moves import http_client
+from six.moves.urllib import parse
+import socket
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """Keep-alive HTTP(S) connections to a single BCF controller.
+
+    Idle connections are reused in LIFO order and closed once they have
+    been idle for longer than idle_timeout seconds.
+    """
+
+    def __init__(self, api_url, pool_size=4, idle_timeout=60):
+        url = parse.urlparse(api_url)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return http_client.HTTPSConnection(self.host, self.port)
+        return http_client.HTTPConnection(self.host, self.port)
+
+    def _get_connection(self):
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used <= self.idle_timeout:
+                    return conn, True
+                # older entries are always staler, so evict them all
+                self._idle.appendleft((conn, last_used))
+                stale = list(self._idle)
+                self._idle.clear()
+                for c, _ in stale:
+                    c.close()
+        return self._new_connection(), False
+
+    def _put_connection(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _path(self, url):
+        url = parse.urlparse(url)
+        if url.query:
+            return url.path + '?' + url.query
+        return url.path
+
+    def request(self, verb, url, data, headers, reader=None):
+        """Send a request and return (status, body).
+
+        If reader is given, it's called with the response of a successful
+        request to consume the body incrementally, and its return value is
+        returned instead of the body.
+        """
+        path = self._path(url)
+        while True:
+            conn, reused = self._get_connection()
+            try:
+                conn.request(verb, path, data, headers)
+                response = conn.getresponse()
+            except (socket.error, http_client.HTTPException) as e:
+                conn.close()
+                if not reused:
+                    raise
+                # The controller may have closed a keep-alive connection
+                # while it was idle. Retry on a fresh one.
+                LOG.debug("retry on a new connection: %(e)s", {'e': e})
+                continue
+
+            try:
+                if reader and 200 <= response.status < 300:
+                    result = reader(response)
+                    # Drain what the reader left, or the next request on
+                    # this connection would read it as its response
+                    response.read()
+                else:
+                    result = response.read()
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close or not response.isclosed():
+                conn.close()
+            else:
+                self._put_connection(conn)
+            return response.status, result
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            conn.close()
@@ -0,0 +1,173 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class LocalLockBackend(object):
+    """Leases shared by the backends of the same name in a process."""
+
+    _leases = {}
+    _lock = threading.Lock()
+
+    def __init__(self, name='default'):
+        self.name = name
+
+    def acquire(self, owner, ttl):
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(self.name)
+            if lease and lease['owner'] != owner and \
+                    lease['expires_at'] > now:
+                return False
+            self._leases[self.name] = {'owner': owner,
+                                       'expires_at': now + ttl}
+            return True
+
+    def release(self, owner):
+        with self._lock:
+            lease = self._leases.get(self.name)
+            if lease and lease['owner'] == owner:
+                del self._leases[self.name]
+
+
+class FileLockBackend(object):
+    """Leases written in a file, which is locked while it's updated.
+
+    All processes which share the file (on a host, or on a shared file
+    system with synchronized clocks) compete for the same lease.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def check(self):
+        """Raise IOError or OSError if the file can't be locked."""
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _update(self, func):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                data = f.read()
+                try:
+                    lease = json.loads(data) if data else {}
+                except ValueError:
+                    lease = {}
+                ret, new_lease = func(lease)
+                if new_lease is not lease:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(new_lease))
+                    f.flush()
+                    os.fsync(f.fileno())
+                return ret
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, owner, ttl):
+        now = time.time()
+
+        def _acquire(lease):
+            if lease.get('owner') not in (None, owner) and \
+                    lease.get('expires_at', 0) > now:
+                return False, lease
+            return True, {'owner': owner, 'expires_at': now + ttl}
+        return self._update(_acquire)
+
+    def release(self, owner):
+        def _release(lease):
+            if lease.get('owner') == owner:
+                return True, {}
+            return False, lease
+        return self._update(_release)
+
+
+def get_lock_backend(conf):
+    """Return the lock backend configured in conf.
+
+    If the lock file can't be used, the local backend is returned, so that
+    this process synchronizes with BCF by itself rather than waiting for a
+    leader which may never be elected.
+    """
+    if conf.coordination_backend == 'local':
+        return LocalLockBackend()
+    backend = FileLockBackend(conf.coordination_lock_file)
+    try:
+        backend.check()
+    except (IOError, OSError) as e:
+        LOG.error("Every process synchronizes with BCF Controller by itself "
+                  "because %(path)s can't be locked: %(e)s",
+                  {'path': conf.coordination_lock_file, 'e': e})
+        return LocalLockBackend()
+    return backend
+
+
+class LeaderElector(object):
+    """Hold a lease of the backend to be the only leader.
+
+    heartbeat() has to be called more often than ttl seconds. The leader
+    considers itself the leader until its lease expires even if the backend
+    can't be reached, and the lease can't be acquired by others until then.
+    """
+
+    def __init__(self, backend, owner=None, ttl=30):
+        self.backend = backend
+        self.owner = owner or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.ttl = ttl
+        self.expires_at = 0
+
+    @property
+    def is_leader(self):
+        return time.time() < self.expires_at
+
+    def heartbeat(self):
+        """Acquire or renew the lease. Return whether this is the leader."""
+        was_leader = self.is_leader
+        now = time.time()
+        try:
+            acquired = self.backend.acquire(self.owner, self.ttl)
+        except Exception as e:
+            LOG.warning("Failed to renew the lease of %(owner)s: %(e)s",
+                        {'owner': self.owner, 'e': e})
+            acquired = False
+        else:
+            if not acquired:
+                # another process acquired it after ours expired
+                self.expires_at = 0
+        if acquired:
+            self.expires_at = now + self.ttl
+
+        if self.is_leader and not was_leader:
+            LOG.info("%(owner)s became the leader of the synchronization",
+                     {'owner': self.owner})
+        elif was_leader and not self.is_leader:
+            LOG.warning("%(owner)s is no longer the leader of the "
+                        "synchronization", {'owner': self.owner})
+        return self.is_leader
+
+    def release(self):
+        self.expires_at = 0
+        self.backend.release(self.owner)
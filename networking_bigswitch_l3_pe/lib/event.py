@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import itertools
 import logging
 from oslo_config import cfg
 import oslo_messaging
@@ -19,9 +21,118 @@ import oslo_messaging
 LOG = logging.getLogger(__name__)
 
 OSLO_TOPIC = 'networking_bigswitch_l3_pe'
+# events forwarded to the leader of the synchronization
+OSLO_LEADER_TOPIC = 'networking_bigswitch_l3_pe_leader'
 OSLO_NAMESPACE = 'networking_bigswitch_l3_pe'
+EVENT_NETWORK_CREATE = 'create_network'
+EVENT_NETWORK_UPDATE = 'update_network'
 EVENT_NETWORK_DELETE = 'delete_network'
+EVENT_SUBNET_CREATE = 'create_subnet'
+EVENT_SUBNET_UPDATE = 'update_subnet'
 EVENT_SUBNET_DELETE = 'delete_subnet'
+# events which are applied to BCF without a full synchronization
+INCREMENTAL_EVENTS = (EVENT_NETWORK_CREATE, EVENT_NETWORK_UPDATE,
+                      EVENT_SUBNET_CREATE, EVENT_SUBNET_UPDATE)
+DELETE_EVENTS = (EVENT_NETWORK_DELETE, EVENT_SUBNET_DELETE)
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+def payload_key(payload):
+    """Return a hashable key of a network or subnet.
+
+    Payloads of events and resources of the synchronization have the same
+    key when they are the same dicts.
+    """
+    return (payload.get('project_name'), payload.get('segment_name'),
+            payload.get('current_gateway_ip'),
+            payload.get('original_gateway_ip'))
+
+
+def event_key(event):
+    return (event['event_type'], payload_key(event['payload']))
+
+
+class EventQueue(object):
+    """Events received but not applied yet.
+
+    Duplicated events are stored once, and at most capacity events are
+    stored. When it's full, the oldest event is dropped (drop_oldest) or the
+    new event is dropped (drop_newest). Events are indexed by their types,
+    so popping some types doesn't scan the others.
+    """
+
+    def __init__(self, capacity=10000, overflow=OVERFLOW_DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+        self.capacity = capacity
+        self.overflow = overflow
+        self.dropped = 0
+        self.coalesced = 0
+        # event_type -> OrderedDict of event_key -> (seq, event)
+        self._events = collections.defaultdict(collections.OrderedDict)
+        self._seq = itertools.count()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return iter(self._sorted(self._events.keys()))
+
+    def append(self, event):
+        """Store an event. Return False if it was dropped or coalesced."""
+        key = event_key(event)
+        events = self._events[event['event_type']]
+        if key in events:
+            self.coalesced += 1
+            return False
+        if self.capacity and self._len >= self.capacity:
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                self._drop(event)
+                return False
+            self._drop(self._pop_oldest())
+        events[key] = (next(self._seq), event)
+        self._len += 1
+        return True
+
+    def extend(self, events):
+        for e in events:
+            self.append(e)
+
+    def pop(self, event_types=None):
+        """Remove and return events of event_types in the received order."""
+        if event_types is None:
+            event_types = list(self._events.keys())
+        ret = self._sorted(event_types)
+        for t in event_types:
+            self._events.pop(t, None)
+        self._len -= len(ret)
+        return ret
+
+    def _sorted(self, event_types):
+        entries = []
+        for t in event_types:
+            entries.extend(self._events.get(t, {}).values())
+        entries.sort(key=lambda entry: entry[0])
+        return [e for seq, e in entries]
+
+    def _pop_oldest(self):
+        # the oldest event is the first one of an event type
+        heads = [(next(iter(events.values()))[0], t)
+                 for t, events in self._events.items() if events]
+        seq, event_type = min(heads)
+        key, (seq, event) = self._events[event_type].popitem(last=False)
+        self._len -= 1
+        return event
+
+    def _drop(self, event):
+        self.dropped += 1
+        LOG.warning("Dropped an event because %(capacity)d events are "
+                    "queued. The full synchronization adds it, but "
+                    "deletions need to be done manually: %(event)s",
+                    {'capacity': self.capacity, 'event': event})
 
 
 class EventWatcherEndpoint(object):
@@ -35,41 +146,209 @@ class EventWatcherEndpoint(object):
             'event_type': event_type,
             'payload': payload,
         }
-        self.watcher.events.append(event)
+        self.watcher.receive(event)
         LOG.debug('recieved event: event_type=%(event_type)s, '
                   'payload=%(payload)s, ctxt=%(ctxt)s',
                   {'event_type': event_type,
                    'payload': payload,
                    'ctxt': ctxt})
 
+    def sync(self, ctxt):
+        self.watcher.request_sync()
+        LOG.debug('recieved a request of synchronization: ctxt=%(ctxt)s',
+                  {'ctxt': ctxt})
+
 
 class EventWatcher(object):
-    def __init__(self):
-        self.events = []
+    """Receive events from all neutron-servers.
 
-        transport = oslo_messaging.get_transport(cfg.CONF)
-        target = oslo_messaging.Target(topic=OSLO_TOPIC, server=cfg.CONF.host)
+    If a journal is given, received events are kept in it until they are
+    acked, and the events in it are queued again on startup.
+
+    If a notifier is given, events are kept only while this process is the
+    leader (between start_leading() and stop_leading()). Otherwise they are
+    forwarded to the leader.
+    """
+
+    def __init__(self, capacity=10000, overflow=OVERFLOW_DROP_OLDEST,
+                 journal=None, notifier=None):
+        self.events = EventQueue(capacity, overflow)
+        self.journal = None
+        self.notifier = notifier
+        # called when a synchronization is requested over RPC
+        self.on_sync_request = None
+        self.leading = notifier is None
+        # event_key -> journal record id of a queued event
+        self._queued = {}
+        # journal record id -> event popped but not acked yet
+        self._unacked = collections.OrderedDict()
+        if journal:
+            self._open_journal(journal)
+
+        self.transport = oslo_messaging.get_transport(cfg.CONF)
+        self.server = self._get_rpc_server(OSLO_TOPIC)
+        self.leader_server = None
+
+    def _get_rpc_server(self, topic):
+        target = oslo_messaging.Target(topic=topic, server=cfg.CONF.host)
         endpoints = [EventWatcherEndpoint(self)]
-        self.server = oslo_messaging.get_rpc_server(transport,
-                                                    target,
-                                                    endpoints)
+        return oslo_messaging.get_rpc_server(self.transport,
+                                             target,
+                                             endpoints)
+
+    def _open_journal(self, journal):
+        self.journal = journal
+        for record_id, e in self.journal.replay():
+            self._queue(e, record_id)
+        if len(self.events) > 0:
+            LOG.info("Replayed %(count)d events from %(path)s",
+                     {'count': len(self.events),
+                      'path': self.journal.path})
+        self._compact()
+
+    def _queue(self, event, record_id=None):
+        """Queue an event, and remember the id of its journal record."""
+        if not self.events.append(event):
+            return False
+        if self.journal:
+            if record_id is None:
+                record_id = self.journal.append(event)
+            self._queued[event_key(event)] = record_id
+        return True
 
     def watch(self):
         LOG.debug('start EventWatcher.watch()')
         self.server.start()
         self.server.wait()
 
-    def pop_events(self):
-        ret = self.events
-        self.events = []
+    def start_leading(self, journal=None):
+        """Keep events, including the ones forwarded by the others."""
+        if journal:
+            self._open_journal(journal)
+        self.leading = True
+        self.leader_server = self._get_rpc_server(OSLO_LEADER_TOPIC)
+        self.leader_server.start()
+
+    def forward_journal(self, journal):
+        """Forward the events left in a journal to the leader.
+
+        They were received by this process while it was the leader, which
+        crashed or was stopped before applying or forwarding them.
+        """
+        events = [e for record_id, e in journal.replay()]
+        for e in events:
+            self.notifier.forward(e)
+        if events:
+            LOG.info("Forwarded %(count)d events from %(path)s to the leader",
+                     {'count': len(events), 'path': journal.path})
+        journal.compact([])
+        journal.close()
+
+    def stop_leading(self):
+        """Forward events which are not applied yet to the next leader."""
+        self.leading = False
+        if self.leader_server:
+            self.leader_server.stop()
+            self.leader_server.wait()
+            self.leader_server = None
+
+        events = list(self._unacked.values()) + self.events.pop()
+        self._unacked.clear()
+        self._queued.clear()
+        for e in events:
+            self.notifier.forward(e)
+        if self.journal:
+            self.journal.compact([])
+            self.journal.close()
+            self.journal = None
+
+    def receive(self, event):
+        if not self.leading:
+            self.notifier.forward(event)
+            return
+        if self._queue(event) and self.journal and \
+                self.journal.needs_compaction():
+            self._compact()
+
+    def request_sync(self):
+        if not self.leading:
+            self.notifier.request_sync()
+        elif self.on_sync_request:
+            self.on_sync_request()
+
+    def pop_events(self, event_types=None):
+        """Pop events, which remain in the journal until they are acked."""
+        ret = self.events.pop(event_types)
+        if self.journal:
+            for e in ret:
+                record_id = self._queued.pop(event_key(e), None)
+                if record_id is not None:
+                    self._unacked[record_id] = e
         return ret
 
+    def _pop_unacked(self, events):
+        """Return the journal record id of each popped event, or None.
+
+        An event may be popped again while the earlier one isn't acked, and
+        the earlier record is returned first.
+        """
+        index = collections.defaultdict(collections.deque)
+        for record_id, e in self._unacked.items():
+            index[event_key(e)].append(record_id)
+        ret = []
+        for e in events:
+            record_ids = index.get(event_key(e))
+            record_id = record_ids.popleft() if record_ids else None
+            if record_id is not None:
+                del self._unacked[record_id]
+            ret.append(record_id)
+        return ret
+
+    def ack(self, events):
+        """Remove events which were applied from the journal."""
+        if not (self.journal and events):
+            return
+        record_ids = [r for r in self._pop_unacked(events) if r is not None]
+        if len(self._unacked) == 0 and len(self.events) == 0:
+            # cheap because nothing is written
+            self._compact()
+        elif record_ids:
+            self.journal.ack(record_ids)
+            if self.journal.needs_compaction():
+                self._compact()
+
+    def requeue(self, events):
+        """Queue events which failed to be applied again."""
+        if not self.journal:
+            self.events.extend(events)
+            return
+        record_ids = self._pop_unacked(events)
+        acked = []
+        for record_id, e in zip(record_ids, events):
+            if not self._queue(e, record_id) and record_id is not None:
+                # The same event was received again in the meantime.
+                acked.append(record_id)
+        if acked:
+            self.journal.ack(acked)
+
+    def flush(self):
+        if self.journal:
+            self.journal.sync()
+
+    def _compact(self):
+        records = list(self._unacked.items())
+        records.extend((self._queued[event_key(e)], e) for e in self.events
+                       if event_key(e) in self._queued)
+        self.journal.compact(records)
+
 
 class EventNotifier(object):
     def __init__(self):
         transport = oslo_messaging.get_transport(cfg.CONF)
         target = oslo_messaging.Target(topic=OSLO_TOPIC)
         self.client = oslo_messaging.RPCClient(transport, target)
+        target = oslo_messaging.Target(topic=OSLO_LEADER_TOPIC)
+        self.leader_client = oslo_messaging.RPCClient(transport, target)
 
     def notify(self, context, event_type, event):
         cctxt = self.client.prepare(namespace=OSLO_NAMESPACE)
@@ -77,3 +356,16 @@ class EventNotifier(object):
         LOG.debug('notified event: event_type=%(event_type)s, event=%(event)s',
                   {'event_type': event_type,
                    'event': event})
+
+    def forward(self, event):
+        """Send a received event to the leader."""
+        cctxt = self.leader_client.prepare(namespace=OSLO_NAMESPACE)
+        cctxt.cast({}, 'info', event_type=event['event_type'],
+                   payload=event['payload'])
+        LOG.debug('forwarded event: %(event)s', {'event': event})
+
+    def request_sync(self):
+        """Ask the leader to synchronize now."""
+        cctxt = self.leader_client.prepare(namespace=OSLO_NAMESPACE)
+        cctxt.cast({}, 'sync')
+        LOG.debug('requested a synchronization')
@@ -0,0 +1,153 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import fcntl
+import json
+import logging
+import os
+import threading
+
+LOG = logging.getLogger(__name__)
+
+
+class EventJournal(object):
+    """Append-only file of received events which are not applied yet.
+
+    Each event is written as a JSON line with a record id, and so are the
+    ids of records which were applied, as a dict of acked. An ack removes
+    only its records, not newer records of the same event. A write is
+    fsynced by a timer within sync_interval seconds, so a crash loses at
+    most the events received in that interval. compact() rewrites the file
+    with the given records, which is done when it grows beyond max_size
+    bytes (or twice the size of the last compaction if it's larger).
+    """
+
+    def __init__(self, path, sync_interval=1.0, max_size=16 * 1024 * 1024):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.max_size = max_size
+        self.size = 0
+        self.compacted_size = 0
+        self._dirty = False
+        self._file = None
+        self._timer = None
+        self._lock = threading.RLock()
+        self._open()
+        self._last_id = self._read()[1]
+
+    def _open(self):
+        self._file = open(self.path, 'a')
+        try:
+            # Two processes must not compact each other's events.
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self._file.close()
+            self._file = None
+            raise
+        self.size = os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self.sync()
+                self._file.close()
+                self._file = None
+
+    def _read(self):
+        records = collections.OrderedDict()
+        last_id = 0
+        with open(self.path) as f:
+            for i, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                    if 'acked' in record:
+                        for record_id in record['acked']:
+                            records.pop(record_id, None)
+                    else:
+                        records[record['id']] = record['event']
+                        last_id = max(last_id, record['id'])
+                except (ValueError, KeyError, TypeError):
+                    # a line partially written before a crash
+                    LOG.warning("Skipped a broken line %(line)d of the event "
+                                "journal %(path)s: %(data)s",
+                                {'line': i + 1, 'path': self.path,
+                                 'data': line})
+        return records, last_id
+
+    def replay(self):
+        """Return (record id, event) of the records which are not acked."""
+        with self._lock:
+            if self._file:
+                self._file.flush()
+            records = self._read()[0]
+        return list(records.items())
+
+    def append(self, event):
+        """Write an event and return the id of its record."""
+        with self._lock:
+            self._last_id += 1
+            self._write({'id': self._last_id, 'event': event})
+            return self._last_id
+
+    def ack(self, record_ids):
+        with self._lock:
+            self._write({'acked': list(record_ids)})
+
+    def _write(self, record):
+        line = json.dumps(record) + '\n'
+        self._file.write(line)
+        self.size += len(line)
+        if not self._dirty:
+            self._dirty = True
+            self._timer = threading.Timer(self.sync_interval, self.sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def sync(self):
+        """Write appended events to the disk."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if self._dirty and self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def needs_compaction(self):
+        return self.size > max(self.max_size, 2 * self.compacted_size)
+
+    def compact(self, records):
+        """Replace the file with the records of (record id, event)."""
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for record_id, event in records:
+                    f.write(json.dumps({'id': record_id, 'event': event}) +
+                            '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            # The lock is held on the old file until the new one is locked.
+            old_file = self._file
+            os.rename(tmp_path, self.path)
+            self._open()
+            old_file.close()
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            self._dirty = False
+            self.compacted_size = self.size
+        LOG.debug("compacted the event journal %(path)s: %(count)d events",
+                  {'path': self.path, 'count': len(records)})
@@ -30,3 +30,11 @@ class BCFRestError(exceptions.NeutronException):
 
 class UpdateNetworkNameError(exceptions.NeutronException):
     message = "Updating network name is not allowed."
+
+
+class InvalidSyncPlan(exceptions.NeutronException):
+    message = "Invalid sync plan: %(reason)s"
+
+
+class CircuitOpen(exceptions.NeutronException):
+    message = "Writes to BCF Controller are paused until %(until)s"
@@ -12,10 +12,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from keystoneclient import exceptions as ks_exceptions
 from keystoneclient.v2_0 import client as clientv2
 import logging
 from oslo_config import cfg
 from six.moves.urllib import parse
+import time
 LOG = logging.getLogger(__name__)
 
 
@@ -53,3 +56,75 @@ class KeystoneClient(object):
         elif self.version == 'v3':
             raise cfg.Error('keystone api v3 is not supported yet')
         return {p.id: p.name for p in projects}
+
+    def get_project_name(self, project_id):
+        if self.version == 'v2':
+            try:
+                project = self.keystone_client.tenants.get(project_id)
+            except ks_exceptions.NotFound:
+                return None
+        elif self.version == 'v3':
+            raise cfg.Error('keystone api v3 is not supported yet')
+        return project.name
+
+
+class ProjectNameCache(object):
+    """Cache of project names with TTL and bounded size.
+
+    get_projects() returns the whole listing and reuses it until the TTL
+    expires. get_name() looks up a single project and only asks Keystone
+    about that project on a miss.
+    """
+
+    def __init__(self, keystone_client, ttl=300, max_size=10000):
+        self.keystone_client = keystone_client
+        self.ttl = ttl
+        self.max_size = max_size
+        # project_id -> (name, expires_at), in LRU order
+        self.names = collections.OrderedDict()
+        self.listed_at = None
+
+    def _put(self, project_id, name, now):
+        self.names.pop(project_id, None)
+        self.names[project_id] = (name, now + self.ttl)
+        while len(self.names) > self.max_size:
+            self.names.popitem(last=False)
+            # the cache doesn't hold the whole listing anymore
+            self.listed_at = None
+
+    def invalidate(self, project_id=None):
+        if project_id is None:
+            self.names.clear()
+        else:
+            self.names.pop(project_id, None)
+        self.listed_at = None
+
+    def get_projects(self):
+        now = time.time()
+        if self.listed_at is not None and now - self.listed_at <= self.ttl:
+            return {k: v[0] for k, v in self.names.items()}
+
+        projects = self.keystone_client.get_projects()
+        self.names.clear()
+        for project_id, name in projects.items():
+            self._put(project_id, name, now)
+        if len(projects) <= self.max_size:
+            self.listed_at = now
+        return projects
+
+    def get_name(self, project_id):
+        now = time.time()
+        entry = self.names.get(project_id)
+        if entry and entry[1] >= now:
+            self.names.pop(project_id)
+            self.names[project_id] = entry
+            return entry[0]
+
+        name = self.keystone_client.get_project_name(project_id)
+        if not name:
+            LOG.debug("project(%(project_id)s) is not found",
+                      {'project_id': project_id})
+            self.invalidate(project_id)
+            return None
+        self._put(project_id, name, now)
+        return name
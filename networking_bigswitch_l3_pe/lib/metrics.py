@@ -0,0 +1,288 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+REST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                10.0)
+PATH_VALUE = re.compile(r'\[([\w-]+)="[^"]*"\]')
+
+
+def path_template(path):
+    """Strip key values from a BCF path.
+
+    e.g. /tenant[name="t1"]/logical-router -> /tenant[name]/logical-router
+    """
+    return PATH_VALUE.sub(r'[\1]', path)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """Timings and counters of the synchronization.
+
+    phases and objects hold the values of the cycle in progress in the
+    current thread, so that concurrent cycles don't mix. finish_cycle()
+    keeps them as the values of the last cycle of its kind, which are
+    exported along with the time of the last success of each kind. REST
+    latencies and errors are cumulative since the process started. flush()
+    passes everything to the sink.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        # kind of cycle -> {'phases': ..., 'objects': ...} of the last one
+        self.cycles = {}
+        self.rest_latency = {}
+        self.rest_errors = {}
+        self.syncs = {}
+        # kind of cycle -> time of the last successful one
+        self.last_success = {}
+        self._local = threading.local()
+
+    def _cycle(self):
+        if not hasattr(self._local, 'cycle'):
+            self._local.cycle = {'phases': {}, 'objects': {}}
+        return self._local.cycle
+
+    @property
+    def phases(self):
+        return self._cycle()['phases']
+
+    @property
+    def objects(self):
+        return self._cycle()['objects']
+
+    def start_cycle(self):
+        self._local.cycle = {'phases': {}, 'objects': {}}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = \
+                self.phases.get(name, 0) + time.time() - start
+
+    def count(self, kind, stage, value):
+        key = (kind, stage)
+        self.objects[key] = self.objects.get(key, 0) + value
+
+    def observe_rest(self, verb, path, code, seconds):
+        key = (verb, path_template(path))
+        if key not in self.rest_latency:
+            self.rest_latency[key] = Histogram(REST_BUCKETS)
+        self.rest_latency[key].observe(seconds)
+        if code is None or not 200 <= code < 300:
+            error_key = key + (str(code) if code else 'none',)
+            self.rest_errors[error_key] = \
+                self.rest_errors.get(error_key, 0) + 1
+
+    def finish_cycle(self, kind, success):
+        key = (kind, 'success' if success else 'failure')
+        self.syncs[key] = self.syncs.get(key, 0) + 1
+        self.cycles[kind] = self._cycle()
+        if success:
+            self.last_success[kind] = time.time()
+        self.flush()
+
+    def flush(self):
+        if not self.sink:
+            return
+        try:
+            self.sink.emit(self)
+        except Exception as e:
+            LOG.warning("Failed to emit metrics: %(e)s", {'e': e})
+
+
+def _labels(**kwargs):
+    def _escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace(
+            '\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                             for k, v in sorted(kwargs.items()))
+
+
+class PrometheusTextfileSink(object):
+    """Writes metrics in the Prometheus text format.
+
+    The file is replaced atomically, so it can be read by the textfile
+    collector of node_exporter.
+    """
+
+    def __init__(self, path, prefix='bcf_l3_pe'):
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, metrics):
+        p = self.prefix
+        cycles = sorted(metrics.cycles.items())
+        lines = ['# TYPE %s_sync_phase_seconds gauge' % p]
+        for kind, cycle in cycles:
+            for name, value in sorted(cycle['phases'].items()):
+                lines.append('%s_sync_phase_seconds%s %f' %
+                             (p, _labels(kind=kind, phase=name), value))
+
+        lines.append('# TYPE %s_sync_objects gauge' % p)
+        for kind, cycle in cycles:
+            for (obj, stage), value in sorted(cycle['objects'].items()):
+                lines.append('%s_sync_objects%s %d' % (
+                    p, _labels(kind=kind, object=obj, stage=stage), value))
+
+        lines.append('# TYPE %s_sync_total counter' % p)
+        for (kind, result), value in sorted(metrics.syncs.items()):
+            lines.append('%s_sync_total%s %d' %
+                         (p, _labels(kind=kind, result=result), value))
+        lines.append('# TYPE %s_sync_last_success_timestamp_seconds '
+                     'gauge' % p)
+        for kind, value in sorted(metrics.last_success.items()):
+            lines.append('%s_sync_last_success_timestamp_seconds%s %f' %
+                         (p, _labels(kind=kind), value))
+
+        lines.append('# TYPE %s_rest_request_seconds histogram' % p)
+        for (verb, path), h in sorted(metrics.rest_latency.items()):
+            for bound, count in zip(h.buckets, h.counts):
+                lines.append('%s_rest_request_seconds_bucket%s %d' % (
+                    p, _labels(verb=verb, path=path, le=bound), count))
+            lines.append('%s_rest_request_seconds_bucket%s %d' % (
+                p, _labels(verb=verb, path=path, le='+Inf'), h.count))
+            lines.append('%s_rest_request_seconds_sum%s %f' %
+                         (p, _labels(verb=verb, path=path), h.sum))
+            lines.append('%s_rest_request_seconds_count%s %d' %
+                         (p, _labels(verb=verb, path=path), h.count))
+
+        lines.append('# TYPE %s_rest_errors_total counter' % p)
+        for (verb, path, code), value in sorted(metrics.rest_errors.items()):
+            lines.append('%s_rest_errors_total%s %d' % (
+                p, _labels(verb=verb, path=path, code=code), value))
+        return '\n'.join(lines) + '\n'
+
+    def emit(self, metrics):
+        data = self.render(metrics)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+class StatsdSink(object):
+    """Sends metrics to statsd over UDP.
+
+    Nothing fails when no statsd is listening. REST requests and errors
+    are sent as counters of what happened since the previous flush, and
+    the phases and objects of a cycle are sent once after it finished.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='bcf_l3_pe'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sent_requests = {}
+        self.sent_seconds = {}
+        self.sent_errors = {}
+        self.sent_syncs = {}
+        self.sent_cycles = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, *parts):
+        return '.'.join([self.prefix] + [
+            re.sub(r'[^\w-]+', '_', str(part)).strip('_') for part in parts])
+
+    def _deltas(self, current, sent):
+        for key, value in current.items():
+            delta = value - sent.get(key, 0)
+            sent[key] = value
+            if delta:
+                yield key, delta
+
+    def render(self, metrics):
+        lines = []
+        for kind, cycle in sorted(metrics.cycles.items()):
+            # Timings are sent once per cycle.
+            if self.sent_cycles.get(kind) is cycle:
+                continue
+            self.sent_cycles[kind] = cycle
+            for name, value in sorted(cycle['phases'].items()):
+                lines.append('%s:%d|ms' % (
+                    self._name('sync', kind, 'phase', name), value * 1000))
+            for (obj, stage), value in sorted(cycle['objects'].items()):
+                lines.append('%s:%d|g' % (
+                    self._name('sync', kind, 'objects', obj, stage), value))
+        for key, delta in self._deltas(metrics.syncs, self.sent_syncs):
+            lines.append('%s:%d|c' % (self._name('sync', *key), delta))
+
+        requests = dict((k, h.count)
+                        for k, h in metrics.rest_latency.items())
+        seconds = dict(self._deltas(
+            dict((k, h.sum) for k, h in metrics.rest_latency.items()),
+            self.sent_seconds))
+        for (verb, path), delta in self._deltas(requests,
+                                                self.sent_requests):
+            lines.append('%s:%d|c' % (self._name('rest', verb, path,
+                                                 'requests'), delta))
+            # the mean latency of the requests since the previous flush
+            lines.append('%s:%d|ms' % (
+                self._name('rest', verb, path, 'latency'),
+                seconds.get((verb, path), 0) * 1000 / delta))
+        for (verb, path, code), delta in self._deltas(metrics.rest_errors,
+                                                      self.sent_errors):
+            lines.append('%s:%d|c' % (self._name('rest', verb, path,
+                                                 'errors', code), delta))
+        return lines
+
+    def emit(self, metrics):
+        for line in self.render(metrics):
+            try:
+                self.sock.sendto(line, self.address)
+            except socket.error as e:
+                LOG.debug("Failed to send metrics to statsd: %(e)s",
+                          {'e': e})
+                return
+
+
+def get_sink(conf):
+    if conf.metrics_sink == 'prometheus':
+        return PrometheusTextfileSink(conf.metrics_textfile)
+    elif conf.metrics_sink == 'statsd':
+        return StatsdSink(conf.metrics_statsd_host, conf.metrics_statsd_port)
+    return None
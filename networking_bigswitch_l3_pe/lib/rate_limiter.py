@@ -0,0 +1,77 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+RATE_INCREASE = 1.1
+RATE_DECREASE_SLOW = 0.8
+RATE_DECREASE_ERROR = 0.5
+
+
+class RateLimiter(object):
+    """Adaptive token bucket for write requests to BCF Controller.
+
+    The bucket is refilled at `rate` tokens per second and holds up to
+    `burst` tokens. The rate grows while the controller answers faster
+    than `latency_target` seconds, and shrinks when it answers slowly or
+    returns errors.
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.5, max_rate=20.0, burst=5,
+                 latency_target=1.0):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.latency_target = latency_target
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(now - self.updated_at, 0)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        with self._lock:
+            self._refill(time.time())
+            # Reserve a token even if it's not available yet, so that
+            # concurrent callers wait in turn instead of all at once.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def _set_rate(self, rate):
+        with self._lock:
+            self._refill(time.time())
+            old_rate = self.rate
+            self.rate = min(self.max_rate, max(self.min_rate, rate))
+        if self.rate != old_rate:
+            LOG.debug("rate of REST writes: %(old)s -> %(new)s",
+                      {'old': old_rate, 'new': self.rate})
+
+    def success(self, latency):
+        if latency > self.latency_target:
+            self._set_rate(self.rate * RATE_DECREASE_SLOW)
+        else:
+            self._set_rate(self.rate * RATE_INCREASE)
+
+    def failure(self):
+        self._set_rate(self.rate * RATE_DECREASE_ERROR)
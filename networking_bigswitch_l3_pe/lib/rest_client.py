@@ -14,10 +14,12 @@
 
 import json
 import logging
+from networking_bigswitch_l3_pe.lib.connection_pool import ConnectionPool
 from networking_bigswitch_l3_pe.lib.exceptions import BCFRestError
 from neutron.common import exceptions
+import six
+import time
 import urllib
-import urllib2
 LOG = logging.getLogger(__name__)
 
 BASE_PATH = '/data/controller/applications/bcf'
@@ -46,24 +48,124 @@ AAA_SESSION_PATH =\
 TENANTS_PATH =\
     BASE_PATH +\
     '/tenant[origination="{neutron_id}"]'
+TENANT_PATH =\
+    BASE_PATH +\
+    '/tenant[name="{tenant}"]'
+LOGICAL_ROUTER_PATH =\
+    TENANT_PATH + '/logical-router'
 SYSTEM_TENANT_IFS_PATH =\
     BASE_PATH +\
     '/tenant[name="system"]/logical-router/tenant-interface'
+# tenant-level objects which create_net() makes for a tenant
+SYSTEM_TENANT_IF = 'system-tenant-interface'
+TENANT_IF = 'tenant-interface'
+STATIC_ROUTE = 'static-route'
+TENANT_OBJECTS = frozenset([SYSTEM_TENANT_IF, TENANT_IF, STATIC_ROUTE])
+DEFAULT_ROUTE = '0.0.0.0/0'
 LOG_STRING_LEN = 512
+SESSION_EXPIRED_CODES = (401, 403)
+# codes with which a controller rejects a PATCH of a logical router
+BULK_REJECTED_CODES = (400, 404, 405, 415, 501)
+READ_CHUNK_SIZE = 65536
+
+
+def iter_json_array(fp, chunk_size=READ_CHUNK_SIZE):
+    """Yield the elements of a JSON array read from fp one at a time.
+
+    Only the current element and the unparsed part of the body are kept
+    in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = fp.read(chunk_size)
+    pos = 0
+    eof = not buf
+    started = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            if buf[pos] == ',' and not started:
+                raise ValueError("Expecting '[' at %d" % pos)
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expecting '[' at %d" % pos)
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # An element at the end of the buffer may be incomplete.
+            if end is not None and (end < len(buf) or eof):
+                yield obj
+                pos = end
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Read at least as much as buffered, so that re-parsing a large
+        # element stays linear in its size.
+        chunk = fp.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def compact_tenant(tenant):
+    """Reduce a BCF tenant to the attributes the synchronization uses."""
+    ret = {'name': tenant.get('name')}
+    if 'logical-router' not in tenant:
+        return ret
+
+    router = tenant['logical-router']
+    compact = {}
+    if 'tenant-interface' in router:
+        compact['tenant-interface'] = [
+            {'remote-tenant': i['remote-tenant']}
+            for i in router['tenant-interface'] if 'remote-tenant' in i]
+    if 'static-route' in router:
+        compact['static-route'] = [
+            {'dst-ip-subnet': r['dst-ip-subnet']}
+            for r in router['static-route'] if 'dst-ip-subnet' in r]
+    if 'segment-interface' in router:
+        compact['segment-interface'] = []
+        for si in router['segment-interface']:
+            interface = {'segment': si.get('segment')}
+            if 'ip-subnet' in si:
+                interface['ip-subnet'] = [
+                    {'ip-cidr': i['ip-cidr']}
+                    for i in si['ip-subnet'] if 'ip-cidr' in i]
+            compact['segment-interface'].append(interface)
+    ret['logical-router'] = compact
+    return ret
 
 
 class RestClient(object):
-    def __init__(self, api_url, username, password):
+    def __init__(self, api_url, username, password,
+                 pool_size=4, idle_timeout=60, metrics=None, bulk=False):
         self.api_url = api_url
         self.username = username
         self.password = password
+        self.metrics = metrics
+        # whether create_net() writes a logical router in one request.
+        # It's turned off when the controller rejects it.
+        self.bulk = bulk
+        self.pool = ConnectionPool(api_url, pool_size=pool_size,
+                                   idle_timeout=idle_timeout)
         self.session_cookie = None
         self.renew_session()
 
     def renew_session(self):
         if self.session_cookie:
             self._destruct_session(self.session_cookie)
+        self._login()
 
+    def _login(self):
         urlLogin = self.api_url + '/auth/login'
         data1 = {"password": str(self.password), "user": str(self.username)}
         code, output = self._rest_request(str(urlLogin), json.dumps(data1),
@@ -74,17 +176,34 @@ class RestClient(object):
     def _destruct_session(self, session_cookie):
         path = AAA_SESSION_PATH.format(session=session_cookie)
         try:
-            code, output = self.rest_call(path, json.dumps({}), verb='DELETE')
-        except urllib2.HTTPError as e:
-            LOG.debug("Ignore HTTPError: %(e)s", {'e': e})
+            code, output = self._rest_request(self._build_url(path, None),
+                                              json.dumps({}), session_cookie,
+                                              'DELETE')
+        except BCFRestError as e:
+            LOG.debug("Ignore BCFRestError: %(e)s", {'e': e})
         finally:
             self.session_cookie = None
 
-    def rest_call(self, path, data, verb='GET', param=None):
+    def rest_call(self, path, data, verb='GET', param=None, reader=None):
         url = self._build_url(path, param)
-        return self._rest_request(url, data, self.session_cookie, verb)
+        if not self.session_cookie:
+            self._login()
+        try:
+            return self._rest_request(url, data, self.session_cookie, verb,
+                                      reader=reader)
+        except BCFRestError as e:
+            if e.code not in SESSION_EXPIRED_CODES:
+                raise
+            # The session was expired or removed on the controller.
+            # Authenticate again and retry only once.
+            LOG.info("BCF session was rejected(code=%(code)s). "
+                     "Renew the session.", {'code': e.code})
+            self.session_cookie = None
+            self._login()
+            return self._rest_request(url, data, self.session_cookie, verb,
+                                      reader=reader)
 
-    def _rest_request(self, url, data, session, verb):
+    def _rest_request(self, url, data, session, verb, reader=None):
         headers = {'Content-type': 'application/json'}
         if session:
             headers["Cookie"] = "session_cookie=%s" % session
@@ -92,14 +211,23 @@ class RestClient(object):
                   "headers:%(headers)s data:%(data)s", {
                       'verb': verb, 'url': url,
                       'headers': headers, 'data': data})
-        request = urllib2.Request(url, data, headers)
-        request.get_method = lambda: verb
-        response = urllib2.urlopen(request)
-        code = response.code
-        result = response.read()
-        log_result = result
-        if len(result) > LOG_STRING_LEN:
-            log_result = result.replace("\n", "")[:LOG_STRING_LEN] + " ..."
+        start = time.time()
+        code = None
+        try:
+            code, result = self.pool.request(verb, url, data, headers,
+                                             reader=reader)
+        finally:
+            if self.metrics:
+                path = urllib.unquote(url[len(self.api_url):].split('?')[0])
+                self.metrics.observe_rest(verb, path, code,
+                                          time.time() - start)
+        if isinstance(result, six.string_types):
+            log_result = result
+            if len(result) > LOG_STRING_LEN:
+                log_result = \
+                    result.replace("\n", "")[:LOG_STRING_LEN] + " ..."
+        else:
+            log_result = "(%d objects)" % len(result)
         LOG.debug("code:%(code)s result:%(result)s",
                   {'code': code, 'result': log_result})
         if code not in range(200, 300):
@@ -113,7 +241,19 @@ class RestClient(object):
             ret += '?' + param
         return ret
 
-    def create_net(self, tenant_name, segment_name):
+    def create_net(self, tenant_name, segment_name, existing=(),
+                   ip_cidrs=()):
+        """Create a segment interface and the tenant-level objects for it.
+
+        existing is a collection of TENANT_OBJECTS which are known to exist
+        already. They aren't PUT again. ip_cidrs are created as subnets of
+        the segment interface.
+
+        In bulk mode, everything in the tenant is merged into its logical
+        router by a PATCH, so only the system tenant-interface needs
+        another request. If the controller rejects it, each object is PUT
+        instead from then on.
+        """
         if not (tenant_name and segment_name):
             emsg = "Invalid parameter for create_net: "\
                    "tenant_name=%(tenant_name)s, "\
@@ -124,25 +264,61 @@ class RestClient(object):
             raise exceptions.InvalidInput(error_message=emsg)
 
         # create tenant-interface
-        path = TENANT_IF_PATH.format(tenant='system',
-                                     remote=tenant_name)
-        self.rest_call(path, json.dumps({"remote-tenant": tenant_name}),
-                       verb='PUT')
-
-        path = TENANT_IF_PATH.format(tenant=tenant_name,
-                                     remote='system')
-        self.rest_call(
-            path, json.dumps({"remote-tenant": "system"}), verb='PUT')
+        if SYSTEM_TENANT_IF not in existing:
+            path = TENANT_IF_PATH.format(tenant='system',
+                                         remote=tenant_name)
+            self.rest_call(path, json.dumps({"remote-tenant": tenant_name}),
+                           verb='PUT')
+
+        if self.bulk:
+            try:
+                return self._patch_logical_router(tenant_name, segment_name,
+                                                  existing, ip_cidrs)
+            except BCFRestError as e:
+                if e.code not in BULK_REJECTED_CODES:
+                    raise
+                LOG.warning("BCF Controller rejected a PATCH of a logical "
+                            "router(code=%(code)s). Each object is PUT "
+                            "instead.", {'code': e.code})
+                self.bulk = False
+
+        if TENANT_IF not in existing:
+            path = TENANT_IF_PATH.format(tenant=tenant_name,
+                                         remote='system')
+            self.rest_call(
+                path, json.dumps({"remote-tenant": "system"}), verb='PUT')
 
         # add static route
-        path = STATIC_ROUTE_PATH.format(tenant=tenant_name)
-        self.rest_call(path, json.dumps({"next-hop": {"tenant": "system"},
-                       "dst-ip-subnet": "0.0.0.0/0"}), verb='PUT')
+        if STATIC_ROUTE not in existing:
+            path = STATIC_ROUTE_PATH.format(tenant=tenant_name)
+            self.rest_call(path, json.dumps({
+                "next-hop": {"tenant": "system"},
+                "dst-ip-subnet": DEFAULT_ROUTE}), verb='PUT')
 
         # create segment interface
         path = SEGMENT_IF_PATH.format(tenant=tenant_name, segment=segment_name)
         self.rest_call(path, json.dumps({"segment": segment_name}), verb='PUT')
 
+        for ip_cidr in ip_cidrs:
+            self.create_subnet(tenant_name, segment_name, ip_cidr)
+
+        return True
+
+    def _patch_logical_router(self, tenant_name, segment_name, existing,
+                              ip_cidrs):
+        segment_interface = {"segment": segment_name}
+        if ip_cidrs:
+            segment_interface["ip-subnet"] = [{"ip-cidr": c}
+                                              for c in ip_cidrs]
+        router = {"segment-interface": [segment_interface]}
+        if TENANT_IF not in existing:
+            router["tenant-interface"] = [{"remote-tenant": "system"}]
+        if STATIC_ROUTE not in existing:
+            router["static-route"] = [{
+                "next-hop": {"tenant": "system"},
+                "dst-ip-subnet": DEFAULT_ROUTE}]
+        path = LOGICAL_ROUTER_PATH.format(tenant=tenant_name)
+        self.rest_call(path, json.dumps(router), verb='PATCH')
         return True
 
     def create_subnet(self, tenant_name, segment_name, ip_cidr):
@@ -177,7 +353,13 @@ class RestClient(object):
         code, result = self.rest_call(path, json.dumps({}), verb='GET')
         return json.loads(result)
 
-    def delete_net(self, tenant_name, segment_name):
+    def delete_net(self, tenant_name, segment_name, teardown=None):
+        """Delete a segment interface.
+
+        teardown tells whether the tenant-level objects are deleted as
+        well. If it's None, they are deleted when no segment interface
+        remains in the tenant, which costs a GET of all of them.
+        """
         if not (tenant_name and segment_name):
             emsg = "Invalid parameter for delete_net: "\
                    "tenant_name=%(tenant_name)s, "\
@@ -191,26 +373,44 @@ class RestClient(object):
         path = SEGMENT_IF_PATH.format(tenant=tenant_name, segment=segment_name)
         self.rest_call(path, json.dumps({}), verb='DELETE')
 
-        # check if other nets remain
-        interfaces = self._get_segment_interface(tenant_name)
-        if len(interfaces) > 0:
+        if teardown is None:
+            # check if other nets remain
+            teardown = len(self._get_segment_interface(tenant_name)) == 0
+        if not teardown:
             LOG.debug("skip to delete a static route and tenant interfaces"
                       " in tenant(%(tenant_name)s)",
                       {'tenant_name': tenant_name})
             return True
 
+        return self.delete_tenant_objects(tenant_name)
+
+    def delete_tenant_objects(self, tenant_name, existing=TENANT_OBJECTS):
+        """Delete the tenant-level objects made by create_net().
+
+        Only the TENANT_OBJECTS in existing are deleted.
+        """
+        if not tenant_name:
+            emsg = "Invalid parameter for delete_tenant_objects: "\
+                   "tenant_name=%(tenant_name)s" % {
+                       'tenant_name': tenant_name}
+            LOG.debug(emsg)
+            raise exceptions.InvalidInput(error_message=emsg)
+
         # delete static route
-        path = STATIC_ROUTE_PATH.format(tenant=tenant_name)
-        self.rest_call(path, json.dumps({}), verb='DELETE')
+        if STATIC_ROUTE in existing:
+            path = STATIC_ROUTE_PATH.format(tenant=tenant_name)
+            self.rest_call(path, json.dumps({}), verb='DELETE')
 
         # delete tenant-interface
-        path = TENANT_IF_PATH.format(tenant='system',
-                                     remote=tenant_name)
-        self.rest_call(path, json.dumps({}), verb='DELETE')
+        if SYSTEM_TENANT_IF in existing:
+            path = TENANT_IF_PATH.format(tenant='system',
+                                         remote=tenant_name)
+            self.rest_call(path, json.dumps({}), verb='DELETE')
 
-        path = TENANT_IF_PATH.format(tenant=tenant_name,
-                                     remote='system')
-        self.rest_call(path, json.dumps({}), verb='DELETE')
+        if TENANT_IF in existing:
+            path = TENANT_IF_PATH.format(tenant=tenant_name,
+                                         remote='system')
+            self.rest_call(path, json.dumps({}), verb='DELETE')
 
         return True
 
@@ -249,18 +449,34 @@ class RestClient(object):
 
         return True
 
-    def get_tenants(self, neutron_id):
-        path = TENANTS_PATH.format(neutron_id=neutron_id)
-        code, output = self.rest_call(path, json.dumps({}), verb='GET')
-        ret = json.loads(output)
+    def get_tenants(self, neutron_id, tenant_names=None):
+        """Return the tenants created by neutron_id.
+
+        If tenant_names is given, only those tenants are fetched, by one
+        request each.
+        """
+        if tenant_names is None:
+            path = TENANTS_PATH.format(neutron_id=neutron_id)
+            code, ret = self.rest_call(
+                path, json.dumps({}), verb='GET',
+                reader=lambda r: [compact_tenant(t)
+                                  for t in iter_json_array(r)])
+            return ret
+
+        ret = []
+        for tenant_name in sorted(tenant_names):
+            path = TENANT_PATH.format(tenant=tenant_name)
+            code, tenants = self.rest_call(
+                path, json.dumps({}), verb='GET',
+                reader=lambda r: [compact_tenant(t)
+                                  for t in iter_json_array(r)
+                                  if t.get('origination') == neutron_id])
+            ret.extend(tenants)
         return ret
 
-    def get_system_tenant_interfaces(self, neutron_id):
-        code, output = self.rest_call(SYSTEM_TENANT_IFS_PATH,
-                                      json.dumps({}), verb='GET')
-        ret = json.loads(output)
+    def _read_system_tenant_interfaces(self, response, neutron_id):
         interfaces = []
-        for i in ret:
+        for i in iter_json_array(response):
             if 'remote-tenant' not in i:
                 continue
             elems = i['remote-tenant'].rsplit('.', 1)
@@ -269,3 +485,26 @@ class RestClient(object):
             if elems[1] == neutron_id:
                 interfaces.append(i)
         return interfaces
+
+    def get_system_tenant_interfaces(self, neutron_id, tenant_names=None):
+        """Return the interfaces of the system tenant to neutron_id tenants.
+
+        If tenant_names is given, only the interfaces to those tenants are
+        fetched, by one request each.
+        """
+        if tenant_names is None:
+            code, interfaces = self.rest_call(
+                SYSTEM_TENANT_IFS_PATH, json.dumps({}), verb='GET',
+                reader=lambda r: self._read_system_tenant_interfaces(
+                    r, neutron_id))
+            return interfaces
+
+        interfaces = []
+        for tenant_name in sorted(tenant_names):
+            path = TENANT_IF_PATH.format(tenant='system', remote=tenant_name)
+            code, ret = self.rest_call(
+                path, json.dumps({}), verb='GET',
+                reader=lambda r: self._read_system_tenant_interfaces(
+                    r, neutron_id))
+            interfaces.extend(ret)
+        return interfaces
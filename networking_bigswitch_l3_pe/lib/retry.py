@@ -0,0 +1,116 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+from networking_bigswitch_l3_pe.lib.exceptions import BCFRestError
+from networking_bigswitch_l3_pe.lib.exceptions import CircuitOpen
+import random
+from six.moves import http_client
+import socket
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+# codes which may succeed if the same request is sent later
+TRANSIENT_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def is_transient(e):
+    """Return whether an error of a REST call is worth retrying."""
+    if isinstance(e, BCFRestError):
+        return e.code is None or e.code in TRANSIENT_CODES
+    return isinstance(e, (CircuitOpen, socket.error,
+                          http_client.HTTPException))
+
+
+class RetryPolicy(object):
+    """Retry a function on transient errors with exponential backoff.
+
+    The n-th retry waits a random time up to base_delay * 2 ** n seconds,
+    but not longer than max_delay.
+    """
+
+    def __init__(self, retries=3, base_delay=1.0, max_delay=30.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def call(self, func, *args):
+        for i in range(self.retries + 1):
+            try:
+                return func(*args)
+            except CircuitOpen:
+                # Retrying doesn't help until the circuit is closed.
+                raise
+            except Exception as e:
+                if i == self.retries or not is_transient(e):
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2 ** i))
+                LOG.info("Retry in %(delay).2f seconds: %(e)s",
+                         {'delay': delay, 'e': e})
+                time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """Pause writes to BCF Controller while it's unhealthy.
+
+    After `threshold` transient errors in a row, the circuit is opened and
+    calls fail with CircuitOpen for `reset_timeout` seconds. Then one call
+    is let through, and the circuit is closed if it succeeds.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before(self):
+        """Raise CircuitOpen if a call mustn't be made now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            until = self.opened_at + self.reset_timeout
+            if time.time() < until or self._trial:
+                raise CircuitOpen(until=time.ctime(until))
+            # half open
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                LOG.info("Resumed writes to BCF Controller")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and
+                               self.failures >= self.threshold):
+                self.opened_at = time.time()
+                self._trial = False
+                LOG.warning("Paused writes to BCF Controller for "
+                            "%(timeout)s seconds after %(failures)d errors",
+                            {'timeout': self.reset_timeout,
+                             'failures': self.failures})
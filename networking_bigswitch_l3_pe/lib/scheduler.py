@@ -0,0 +1,88 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+from eventlet import event
+import logging
+import random
+import time
+
+LOG = logging.getLogger(__name__)
+
+BACKOFF = 2.0
+
+
+class SyncScheduler(object):
+    """Decide when the next full synchronization runs.
+
+    The interval starts at min_interval and is doubled up to max_interval
+    after each synchronization which changed nothing. notify() brings the
+    next synchronization forward to debounce seconds later, so that a burst
+    of events results in one synchronization, and trigger() brings it
+    forward to now. Both wake up wait() right away. Up to jitter * interval
+    seconds are added at random.
+    """
+
+    def __init__(self, min_interval=600, max_interval=3600, debounce=10,
+                 jitter=0.1):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.debounce = debounce
+        self.jitter = jitter
+        self.interval = min_interval
+        self.deadline = time.time() + self._jittered(self.interval)
+        self._wakeup = event.Event()
+
+    def _jittered(self, interval):
+        return interval + random.uniform(0, self.jitter * interval)
+
+    def _wake(self):
+        if not self._wakeup.ready():
+            self._wakeup.send()
+
+    def notify(self):
+        """Synchronize soon because something may have to be repaired."""
+        self.deadline = min(self.deadline, time.time() + self.debounce)
+        self._wake()
+
+    def trigger(self):
+        """Synchronize now."""
+        LOG.info("A synchronization was requested")
+        self.deadline = time.time()
+        self._wake()
+
+    def wait(self):
+        """Sleep until the next synchronization."""
+        while True:
+            # renewed before the deadline is read, so that a wake-up in
+            # between isn't missed
+            self._wakeup = event.Event()
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                return
+            self._sleep(self._wakeup, remaining)
+
+    def _sleep(self, wakeup, seconds):
+        with eventlet.Timeout(seconds, False):
+            wakeup.wait()
+
+    def done(self, changed):
+        """Schedule the next synchronization after one finished."""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        self.deadline = time.time() + self._jittered(self.interval)
+        LOG.debug("next synchronization in %(interval)s seconds",
+                  {'interval': self.deadline - time.time()})
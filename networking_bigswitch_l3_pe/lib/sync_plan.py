@@ -0,0 +1,261 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import eventlet
+import json
+import logging
+from networking_bigswitch_l3_pe.lib.exceptions import InvalidSyncPlan
+import six
+import sys
+
+LOG = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+OP_CREATE_NETWORK = 'create_network'
+OP_CREATE_SUBNET = 'create_subnet'
+OP_UPDATE_SUBNET = 'update_subnet'
+OP_DELETE_SUBNET = 'delete_subnet'
+OP_DELETE_NETWORK = 'delete_network'
+# deletes the tenant-level objects after the last network of a tenant
+OP_DELETE_TENANT = 'delete_tenant'
+OPERATIONS = (OP_CREATE_NETWORK, OP_CREATE_SUBNET, OP_UPDATE_SUBNET,
+              OP_DELETE_SUBNET, OP_DELETE_NETWORK, OP_DELETE_TENANT)
+ADD_OPERATIONS = (OP_CREATE_NETWORK, OP_CREATE_SUBNET, OP_UPDATE_SUBNET)
+DELETE_OPERATIONS = (OP_DELETE_SUBNET, OP_DELETE_NETWORK, OP_DELETE_TENANT)
+
+
+class SyncPlan(object):
+    """Operations to make BCF consistent with OpenStack.
+
+    Each operation is a dict of id, op, resource and depends_on, where
+    resource is a network or subnet in the same format as the payload of
+    events (a tenant is a dict of project_name), and depends_on holds the
+    ids of operations which must be applied before it. Operations are kept
+    in the order they were planned, which always satisfies the
+    dependencies.
+    """
+
+    def __init__(self):
+        self.operations = []
+        # Set by Synchronizer and not saved: tenant name -> fingerprint
+        # which is recorded once the plan is applied, and whether the plan
+        # covers all tenants.
+        self.fingerprints = None
+        self.full = False
+        self._networks = {}
+        self._subnets = {}
+        self._deleted_networks = {}
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _add(self, op, resource, depends_on=()):
+        operation = {
+            'id': len(self.operations),
+            'op': op,
+            'resource': resource,
+            'depends_on': list(depends_on),
+        }
+        self.operations.append(operation)
+        return operation
+
+    def _segment(self, resource):
+        return (resource['project_name'], resource['segment_name'])
+
+    def create_network(self, network):
+        operation = self._add(OP_CREATE_NETWORK, network)
+        self._networks[self._segment(network)] = operation['id']
+        return operation
+
+    def add_subnet(self, subnet):
+        """Plan create_subnet, or update_subnet if it replaces an ip-cidr."""
+        op = OP_CREATE_SUBNET
+        if 'original_gateway_ip' in subnet:
+            op = OP_UPDATE_SUBNET
+        network = self._networks.get(self._segment(subnet))
+        return self._add(op, subnet,
+                         [network] if network is not None else [])
+
+    def delete_subnet(self, subnet):
+        operation = self._add(OP_DELETE_SUBNET, subnet)
+        self._subnets.setdefault(self._segment(subnet), []).append(
+            operation['id'])
+        return operation
+
+    def delete_network(self, network):
+        operation = self._add(OP_DELETE_NETWORK, network,
+                              self._subnets.get(self._segment(network), []))
+        self._deleted_networks.setdefault(network['project_name'], []).append(
+            operation['id'])
+        return operation
+
+    def delete_tenant(self, tenant):
+        """Plan the teardown of a tenant after its networks are deleted.
+
+        tenant is a dict of project_name.
+        """
+        return self._add(OP_DELETE_TENANT, tenant,
+                         self._deleted_networks.get(tenant['project_name'],
+                                                    []))
+
+    def resources(self, ops, operations=None):
+        """Return the resources of the operations of the given ops."""
+        if operations is None:
+            operations = self.operations
+        return [o['resource'] for o in operations if o['op'] in ops]
+
+    def result(self, operations=None):
+        """Summarize operations in the format of synchronize()."""
+        added = {}
+        networks = self.resources((OP_CREATE_NETWORK,), operations)
+        if networks:
+            added['network'] = networks
+        subnets = self.resources((OP_CREATE_SUBNET, OP_UPDATE_SUBNET),
+                                 operations)
+        if subnets:
+            added['subnet'] = subnets
+
+        deleted = {}
+        subnets = self.resources((OP_DELETE_SUBNET,), operations)
+        if subnets:
+            deleted['subnets'] = subnets
+        networks = self.resources((OP_DELETE_NETWORK,), operations)
+        if networks:
+            deleted['networks'] = networks
+
+        ret = {}
+        if added:
+            ret['added'] = added
+        if deleted:
+            ret['deleted'] = deleted
+        return ret
+
+    def to_dict(self):
+        return {'version': PLAN_VERSION, 'operations': self.operations}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != PLAN_VERSION:
+            raise InvalidSyncPlan(
+                reason="unsupported version %s" % data.get('version'))
+
+        plan = cls()
+        for i, o in enumerate(data.get('operations', [])):
+            if o.get('op') not in OPERATIONS:
+                raise InvalidSyncPlan(reason="unknown operation %s" %
+                                      o.get('op'))
+            if o.get('id') != i:
+                raise InvalidSyncPlan(reason="operation %s is out of order" %
+                                      o.get('id'))
+            if any(not 0 <= d < i for d in o.get('depends_on', [])):
+                raise InvalidSyncPlan(
+                    reason="operation %d depends on a later one" % i)
+            plan.operations.append({
+                'id': i,
+                'op': o['op'],
+                'resource': o['resource'],
+                'depends_on': list(o.get('depends_on', [])),
+            })
+        return plan
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_dict(json.loads(data))
+
+
+class PlanExecutor(object):
+    """Apply a SyncPlan to BCF.
+
+    handlers maps each op to a function which takes the resource and
+    returns True when it's applied. Operations are grouped by tenant.
+    Tenants are independent of each other, so they are applied
+    concurrently by up to `workers` green threads, while the operations
+    of a tenant are applied one by one in the planned order. An operation
+    is skipped if one of its dependencies wasn't applied.
+
+    is_retriable tells whether an error is worth applying the plan again
+    soon. By default every error is. is_fatal tells whether an error would
+    be raised by every remaining operation as well, e.g. while writes are
+    paused. Then the rest of the plan is aborted. By default no error is.
+    """
+
+    def __init__(self, handlers, workers=4, is_retriable=None, is_fatal=None):
+        self.handlers = handlers
+        self.workers = workers
+        self.is_retriable = is_retriable or (lambda e: True)
+        self.is_fatal = is_fatal or (lambda e: False)
+        # (operation, exception) of the last execute()
+        self.failures = []
+
+    def execute(self, plan, on_applied=None):
+        """Return the applied operations in the planned order.
+
+        on_applied is called with each operation once it's applied.
+
+        If an operation raises, it's reported in failures and the others
+        are applied unless they depend on it. Then the first retriable
+        error is re-raised. A fatal error stops every tenant, and it's
+        re-raised first.
+        """
+        tenants = collections.OrderedDict()
+        for o in plan.operations:
+            tenants.setdefault(o['resource']['project_name'], []).append(o)
+
+        applied = set()
+        errors = []
+        fatal = []
+        self.failures = []
+
+        def _apply_tenant(operations):
+            for o in operations:
+                if fatal:
+                    return
+                if not all(d in applied for d in o['depends_on']):
+                    LOG.warning("Skip %(op)s because its dependencies "
+                                "weren't applied: %(resource)s",
+                                {'op': o['op'], 'resource': o['resource']})
+                    continue
+                try:
+                    if self.handlers[o['op']](o['resource']):
+                        applied.add(o['id'])
+                        if on_applied:
+                            on_applied(o)
+                except Exception as e:
+                    LOG.error("Failed to %(op)s: %(resource)s: %(e)s",
+                              {'op': o['op'], 'resource': o['resource'],
+                               'e': e})
+                    self.failures.append((o, e))
+                    if self.is_fatal(e):
+                        fatal.append(sys.exc_info())
+                    elif self.is_retriable(e):
+                        errors.append(sys.exc_info())
+
+        pool = eventlet.GreenPool(self.workers)
+        for operations in tenants.values():
+            pool.spawn_n(_apply_tenant, operations)
+        pool.waitall()
+
+        if fatal:
+            LOG.error("Aborted the plan: %(count)d of %(total)d operations "
+                      "were applied",
+                      {'count': len(applied), 'total': len(plan)})
+            six.reraise(*fatal[0])
+        if errors:
+            six.reraise(*errors[0])
+
+        return [o for o in plan.operations if o['id'] in applied]
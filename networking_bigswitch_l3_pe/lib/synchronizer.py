@@ -12,72 +12,234 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import hashlib
+import json
 import logging
+from networking_bigswitch_l3_pe.lib.checkpoint import Checkpoint
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_CREATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_UPDATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_CREATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_UPDATE
+from networking_bigswitch_l3_pe.lib.event import payload_key
+from networking_bigswitch_l3_pe.lib.exceptions import CircuitOpen
 from networking_bigswitch_l3_pe.lib.keystone_client import KeystoneClient
+from networking_bigswitch_l3_pe.lib.keystone_client import ProjectNameCache
+from networking_bigswitch_l3_pe.lib.metrics import get_sink
+from networking_bigswitch_l3_pe.lib.metrics import Metrics
+from networking_bigswitch_l3_pe.lib.rate_limiter import RateLimiter
+from networking_bigswitch_l3_pe.lib import rest_client
+from networking_bigswitch_l3_pe.lib import retry
 from networking_bigswitch_l3_pe.lib.rest_client import RestClient
+from networking_bigswitch_l3_pe.lib import sync_plan
+from networking_bigswitch_l3_pe.lib.sync_plan import PlanExecutor
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
 from neutron.common import exceptions
 from neutron import context as ncontext
-from neutron.db import db_base_plugin_v2
+from neutron.db import models_v2
 from neutron.plugins.ml2 import models
+from oslo_config import cfg
+import threading
 import time
 
 LOG = logging.getLogger(__name__)
 
 
+def _fingerprint(segments):
+    """Return a digest of a dict of segment name -> set of gateway cidrs."""
+    data = json.dumps(sorted((name, sorted(cidrs))
+                             for name, cidrs in segments.items()))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
 class Synchronizer(object):
     def __init__(self, api_url, username, password, neutron_id,
-                 exclude_physical_networks, dry_run=False):
-        self.rest_client = RestClient(api_url, username, password)
-        self.keystone_client = KeystoneClient()
-        self.db_plugin = db_base_plugin_v2.NeutronDbPluginV2()
+                 exclude_physical_networks, dry_run=False,
+                 project_cache=None):
+        conf = cfg.CONF.networking_bigswitch_l3_pe
+        self.metrics = Metrics(get_sink(conf))
+        self.rest_client = RestClient(api_url, username, password,
+                                      pool_size=conf.rest_pool_size,
+                                      idle_timeout=conf.rest_idle_timeout,
+                                      metrics=self.metrics,
+                                      bulk=conf.rest_bulk_provisioning)
+        if project_cache is None:
+            project_cache = ProjectNameCache(
+                KeystoneClient(), ttl=conf.project_cache_ttl,
+                max_size=conf.project_cache_size)
+        self.project_cache = project_cache
         self.neutron_id = neutron_id
         self.exclude_physical_networks = exclude_physical_networks
         self.dry_run = dry_run
         if self.dry_run:
             LOG.info("This is dry run mode.")
-        self.rest_sleep = 0.5
+        self.rate_limiter = RateLimiter(
+            rate=conf.rest_rate, min_rate=conf.rest_min_rate,
+            max_rate=conf.rest_max_rate, burst=conf.rest_burst,
+            latency_target=conf.rest_latency_target)
+        self.retry = retry.RetryPolicy(retries=conf.rest_retries,
+                                       base_delay=conf.rest_retry_delay,
+                                       max_delay=conf.rest_retry_max_delay)
+        self.breaker = retry.CircuitBreaker(
+            threshold=conf.rest_breaker_threshold,
+            reset_timeout=conf.rest_breaker_timeout)
+        self.sync_workers = conf.sync_workers
+        self.bulk_provisioning = conf.rest_bulk_provisioning
+        # tenant name -> fingerprint of OpenStack at the last reconciliation.
+        # None disables the change detection.
+        self.fingerprints = {} if conf.sync_fingerprints else None
+        self.full_interval = conf.sync_full_interval
+        self.reconciled_at = 0
+        self.checkpoint = None
+        if conf.sync_checkpoint:
+            self.checkpoint = Checkpoint(
+                conf.sync_checkpoint, max_age=conf.sync_checkpoint_max_age)
+        # tenant name -> rest_client.TENANT_OBJECTS known to exist in BCF
+        self.tenant_objects = {}
+        # Cycles which write to BCF run one at a time, since they share
+        # tenant_objects and fingerprints.
+        self._lock = threading.RLock()
 
     def _get_os_projects(self):
-        return self.keystone_client.get_projects()
-
-    def _get_exclude_networks(self):
+        return self.project_cache.get_projects()
+
+    def _filter_exclude_networks(self, session, query, network_id):
+        if not self.exclude_physical_networks:
+            return query
+        exclude_networks = (
+            session.query(models.NetworkSegment.network_id).
+            filter(models.NetworkSegment.physical_network.in_(
+                self.exclude_physical_networks)))
+        return query.filter(~network_id.in_(exclude_networks.subquery()))
+
+    def _get_os_networks(self, tenant_ids=None):
+        ctx = ncontext.get_admin_context()
+        with ctx.session.begin(subtransactions=True):
+            query = ctx.session.query(models_v2.Network.id,
+                                      models_v2.Network.name,
+                                      models_v2.Network.tenant_id)
+            query = self._filter_exclude_networks(ctx.session, query,
+                                                  models_v2.Network.id)
+            if tenant_ids is not None:
+                query = query.filter(
+                    models_v2.Network.tenant_id.in_(tenant_ids))
+            return [{'id': r.id, 'name': r.name, 'tenant_id': r.tenant_id}
+                    for r in query]
+
+    def _get_os_subnets(self, tenant_ids=None):
         ctx = ncontext.get_admin_context()
         with ctx.session.begin(subtransactions=True):
-            query = (ctx.session.query(models.NetworkSegment).
-                     order_by(models.NetworkSegment.segment_index))
-            records = query.all()
+            query = ctx.session.query(models_v2.Subnet.id,
+                                      models_v2.Subnet.network_id,
+                                      models_v2.Subnet.tenant_id,
+                                      models_v2.Subnet.cidr,
+                                      models_v2.Subnet.gateway_ip)
+            query = self._filter_exclude_networks(ctx.session, query,
+                                                  models_v2.Subnet.network_id)
+            if tenant_ids is not None:
+                query = query.filter(
+                    models_v2.Subnet.tenant_id.in_(tenant_ids))
+            return [{'id': r.id, 'network_id': r.network_id,
+                     'tenant_id': r.tenant_id, 'cidr': r.cidr,
+                     'gateway_ip': r.gateway_ip}
+                    for r in query]
+
+    def _has_logical_router(self, tenant):
+        return ('logical-router' in tenant and
+                'tenant-interface' in tenant['logical-router'] and
+                'segment-interface' in tenant['logical-router'])
+
+    def _build_os_index(self, os):
+        networks = {}
+        network_names = set()
+        for n in os['networks']:
+            networks[n['id']] = n
+            network_names.add(n['name'])
 
-            return [r.network_id for r in records
-                    if r.physical_network in self.exclude_physical_networks]
+        gateway_ips = {}
+        subnet_gateways = {}
+        for s in os['subnets']:
+            gateway_ip = self._get_gateway_ip(s)
+            gateway_ips[s['id']] = gateway_ip
+            key = (s['tenant_id'], s['network_id'], gateway_ip)
+            subnet_gateways.setdefault(key, []).append(s['id'])
 
-    def _get_os_networks(self):
-        ctx = ncontext.get_admin_context()
-        ret = self.db_plugin.get_networks(ctx)
-        return ret
+        return {
+            'networks': networks,
+            'network_names': network_names,
+            'gateway_ips': gateway_ips,
+            'gateway_ip_set': set(gateway_ips.values()),
+            'subnet_gateways': subnet_gateways,
+        }
 
-    def _get_os_subnets(self):
-        ctx = ncontext.get_admin_context()
-        return self.db_plugin.get_subnets(ctx)
+    def _build_bcf_index(self, bcf):
+        segments = {}
+        ip_cidrs = {}
+        for t in bcf['tenants']:
+            if not self._has_logical_router(t):
+                continue
 
-    def _exist_subnet(self, os, subnet, ip_cidr):
+            names = segments.setdefault(t['name'], set())
+            for si in t['logical-router']['segment-interface']:
+                names.add(si['segment'])
+                if 'ip-subnet' not in si:
+                    continue
+                cidrs = ip_cidrs.setdefault((t['name'], si['segment']), [])
+                cidrs.extend(i['ip-cidr'] for i in si['ip-subnet']
+                             if 'ip-cidr' in i)
+
+        return {
+            'segments': segments,
+            'ip_cidrs': ip_cidrs,
+        }
+
+    def _get_os_fingerprints(self, os):
+        """Return tenant name -> fingerprint of an OpenStack snapshot."""
+        index = self._get_os_index(os)
+        tenants = {}
+        for n in os['networks']:
+            segments = tenants.setdefault(
+                self._get_tenant_name(os, n['tenant_id']), {})
+            segments.setdefault(n['name'], set())
         for s in os['subnets']:
-            gateway_ip = self._get_gateway_ip(s)
-            if s['id'] != subnet['id'] and \
-               s['tenant_id'] == subnet['tenant_id'] and \
-               s['network_id'] == subnet['network_id'] and \
-               gateway_ip == ip_cidr:
-                return s
-        return None
+            segments = tenants.setdefault(
+                self._get_tenant_name(os, s['tenant_id']), {})
+            network = self._get_network(os, s['network_id'])
+            segments.setdefault(network['name'], set()).add(
+                index['gateway_ips'][s['id']])
+        return dict((t, _fingerprint(segments))
+                    for t, segments in tenants.items())
+
+    def _get_bcf_fingerprints(self, bcf):
+        """Return tenant name -> fingerprint of a BCF snapshot."""
+        index = self._get_bcf_index(bcf)
+        return dict(
+            (t, _fingerprint(dict(
+                (name, set(index['ip_cidrs'].get((t, name), [])))
+                for name in names)))
+            for t, names in index['segments'].items())
+
+    def _get_os_index(self, os):
+        # indexes are built once per snapshot, i.e. once per sync cycle
+        if 'index' not in os:
+            os['index'] = self._build_os_index(os)
+        return os['index']
+
+    def _get_bcf_index(self, bcf):
+        if 'index' not in bcf:
+            bcf['index'] = self._build_bcf_index(bcf)
+        return bcf['index']
+
+    def _exist_subnet(self, os, subnet, ip_cidr):
+        index = self._get_os_index(os)
+        key = (subnet['tenant_id'], subnet['network_id'], ip_cidr)
+        return any(subnet_id != subnet['id']
+                   for subnet_id in index['subnet_gateways'].get(key, []))
 
     def _check_network_in_bcf(self, bcf, tenant_name, network_name):
-        matches = [t for t in bcf['tenants'] if t['name'] == tenant_name]
-        for m in matches:
-            if 'logical-router' in m and \
-               'tenant-interface' in m['logical-router'] and \
-               'segment-interface' in m['logical-router']:
-                for si in m['logical-router']['segment-interface']:
-                    if si['segment'] == network_name:
-                        return None
+        index = self._get_bcf_index(bcf)
+        if network_name in index['segments'].get(tenant_name, ()):
+            return None
         return {
             'project_name': tenant_name,
             'segment_name': network_name,
@@ -85,35 +247,20 @@ class Synchronizer(object):
 
     def _check_subnet_in_bcf(self, bcf, os,
                              tenant_name, network_name, subnet):
-        gateway_ip = self._get_gateway_ip(subnet)
-        matches = [t for t in bcf['tenants'] if t['name'] == tenant_name]
-        for m in matches:
-            if not ('logical-router' in m and
-                    'tenant-interface' in m['logical-router'] and
-                    'segment-interface' in m['logical-router']):
-                continue
-
-            for si in m['logical-router']['segment-interface']:
-                if not (si['segment'] == network_name and
-                        'ip-subnet' in si):
-                    continue
-
-                for i in si['ip-subnet']:
-                    if 'ip-cidr' not in i:
-                        continue
-                    if i['ip-cidr'] == gateway_ip:
-                        # no change
-                        return None
-                    else:
-                        if not self._exist_subnet(os, subnet,
-                                                  i['ip-cidr']):
-                            # update subnet
-                            return {
-                                'project_name': tenant_name,
-                                'segment_name': network_name,
-                                'original_gateway_ip': i['ip-cidr'],
-                                'current_gateway_ip': gateway_ip,
-                            }
+        gateway_ip = self._get_os_index(os)['gateway_ips'][subnet['id']]
+        index = self._get_bcf_index(bcf)
+        for ip_cidr in index['ip_cidrs'].get((tenant_name, network_name), []):
+            if ip_cidr == gateway_ip:
+                # no change
+                return None
+            if not self._exist_subnet(os, subnet, ip_cidr):
+                # update subnet
+                return {
+                    'project_name': tenant_name,
+                    'segment_name': network_name,
+                    'original_gateway_ip': ip_cidr,
+                    'current_gateway_ip': gateway_ip,
+                }
         # add subnet
         return {
             'project_name': tenant_name,
@@ -121,77 +268,153 @@ class Synchronizer(object):
             'current_gateway_ip': gateway_ip,
         }
 
-    def _add_networks_to_bcf(self, networks):
-        if len(networks) > 0:
-            LOG.info("Adding networks: %(networks)s",
-                     {'networks': networks})
-        if self.dry_run:
-            return networks
-
-        ret = []
-        for n in networks:
-            if self.rest_client.create_net(n['project_name'],
-                                           n['segment_name']):
-                ret.append(n)
-            time.sleep(self.rest_sleep)
-
-        return ret
-
-    def _add_subnets_to_bcf(self, subnets):
-        if len(subnets) > 0:
-            LOG.info("Adding subnets: %(subnets)s",
-                     {'subnets': subnets})
-        if self.dry_run:
-            return subnets
-
-        ret = []
-        for s in subnets:
-            if ('original_gateway_ip' in s):
-                if self.rest_client.update_subnet(s['project_name'],
-                                                  s['segment_name'],
-                                                  s['original_gateway_ip'],
-                                                  s['current_gateway_ip']):
-                    ret.append(s)
+    def _rest_write(self, func, *args):
+        return self.retry.call(self._rest_write_once, func, *args)
+
+    def _rest_write_once(self, func, *args):
+        self.breaker.before()
+        self.rate_limiter.acquire()
+        start = time.time()
+        try:
+            ret = func(*args)
+        except Exception as e:
+            if retry.is_transient(e):
+                self.rate_limiter.failure()
+                self.breaker.failure()
             else:
-                if self.rest_client.create_subnet(s['project_name'],
-                                                  s['segment_name'],
-                                                  s['current_gateway_ip']):
-                    ret.append(s)
-            time.sleep(self.rest_sleep)
+                # The controller answered, so it's healthy enough.
+                self.rate_limiter.success(time.time() - start)
+                self.breaker.success()
+            raise
+        self.rate_limiter.success(time.time() - start)
+        self.breaker.success()
         return ret
 
-    def _delete_subnets_in_bcf(self, subnets):
-        if len(subnets) > 0:
-            LOG.info("Deleting subnets: %(subnets)s",
-                     {'subnets': subnets})
-        if self.dry_run:
-            return subnets
+    def _learn_tenant_objects(self, bcf, tenant_names=None):
+        """Remember the tenant-level objects in a BCF snapshot.
 
-        ret = []
-        for s in subnets:
-            if self.rest_client.delete_subnet(s['project_name'],
-                                              s['segment_name'],
-                                              s['current_gateway_ip']):
-                ret.append(s)
-            time.sleep(self.rest_sleep)
-        return ret
-
-    def _delete_networks_in_bcf(self, networks):
-        if len(networks) > 0:
-            LOG.info("Deleting networks: %(networks)s",
-                     {'networks': networks})
-        if self.dry_run:
-            return networks
+        A snapshot of all tenants replaces everything known so far, and a
+        scoped one replaces only its tenants.
+        """
+        if tenant_names is None:
+            tenant_objects = {}
+        else:
+            tenant_objects = dict(
+                (name, objects) for name, objects in
+                self.tenant_objects.items() if name not in tenant_names)
 
-        ret = []
-        for n in networks:
-            if self.rest_client.delete_net(n['project_name'],
-                                           n['segment_name']):
-                ret.append(n)
-            time.sleep(self.rest_sleep)
+        for i in bcf['system_tenant_interfaces']:
+            tenant_objects.setdefault(i['remote-tenant'], set()).add(
+                rest_client.SYSTEM_TENANT_IF)
+        for t in bcf['tenants']:
+            objects = tenant_objects.setdefault(t['name'], set())
+            router = t.get('logical-router', {})
+            if any(i.get('remote-tenant') == 'system'
+                   for i in router.get('tenant-interface', [])):
+                objects.add(rest_client.TENANT_IF)
+            if any(r.get('dst-ip-subnet') == rest_client.DEFAULT_ROUTE
+                   for r in router.get('static-route', [])):
+                objects.add(rest_client.STATIC_ROUTE)
+        self.tenant_objects = tenant_objects
+
+    def _add_network_to_bcf(self, n, ip_cidrs=()):
+        tenant_name = n['project_name']
+        existing = frozenset(self.tenant_objects.get(tenant_name, ()))
+        try:
+            ret = self._rest_write(self.rest_client.create_net,
+                                   tenant_name, n['segment_name'], existing,
+                                   ip_cidrs)
+        except Exception:
+            # Some of them may have been made, or removed behind us.
+            self.tenant_objects.pop(tenant_name, None)
+            raise
+        if ret:
+            self.tenant_objects[tenant_name] = \
+                set(rest_client.TENANT_OBJECTS)
+        return ret
 
+    def _add_subnet_to_bcf(self, s):
+        if ('original_gateway_ip' in s):
+            return self._rest_write(self.rest_client.update_subnet,
+                                    s['project_name'],
+                                    s['segment_name'],
+                                    s['original_gateway_ip'],
+                                    s['current_gateway_ip'])
+        return self._rest_write(self.rest_client.create_subnet,
+                                s['project_name'],
+                                s['segment_name'],
+                                s['current_gateway_ip'])
+
+    def _delete_subnet_in_bcf(self, s):
+        return self._rest_write(self.rest_client.delete_subnet,
+                                s['project_name'],
+                                s['segment_name'],
+                                s['current_gateway_ip'])
+
+    def _delete_network_in_bcf(self, n):
+        # The tenant-level objects are deleted by _delete_tenant_in_bcf,
+        # or may be torn down behind us once no network remains.
+        self.tenant_objects.pop(n['project_name'], None)
+        return self._rest_write(self.rest_client.delete_net,
+                                n['project_name'], n['segment_name'], False)
+
+    def _delete_tenant_in_bcf(self, t):
+        tenant_name = t['project_name']
+        existing = self.tenant_objects.get(tenant_name,
+                                           rest_client.TENANT_OBJECTS)
+        try:
+            return self._rest_write(self.rest_client.delete_tenant_objects,
+                                    tenant_name, frozenset(existing))
+        finally:
+            self.tenant_objects.pop(tenant_name, None)
+
+    def _new_subnets(self, plan):
+        """Group the subnets created in the new networks of a plan."""
+        networks = set(o['id'] for o in plan.operations
+                       if o['op'] == sync_plan.OP_CREATE_NETWORK)
+        ret = collections.defaultdict(list)
+        for o in plan.operations:
+            if o['op'] == sync_plan.OP_CREATE_SUBNET and \
+                    networks.intersection(o['depends_on']):
+                s = o['resource']
+                ret[(s['project_name'], s['segment_name'])].append(s)
         return ret
 
+    def _get_executor(self, plan=None):
+        handlers = {
+            sync_plan.OP_CREATE_NETWORK: self._add_network_to_bcf,
+            sync_plan.OP_CREATE_SUBNET: self._add_subnet_to_bcf,
+            sync_plan.OP_UPDATE_SUBNET: self._add_subnet_to_bcf,
+            sync_plan.OP_DELETE_SUBNET: self._delete_subnet_in_bcf,
+            sync_plan.OP_DELETE_NETWORK: self._delete_network_in_bcf,
+            sync_plan.OP_DELETE_TENANT: self._delete_tenant_in_bcf,
+        }
+        if plan is not None and self.bulk_provisioning:
+            # New subnets are written with their network, and their own
+            # operations only have to succeed.
+            new_subnets = self._new_subnets(plan)
+            written = set()
+
+            def _add_network(n):
+                subnets = new_subnets.pop(
+                    (n['project_name'], n['segment_name']), [])
+                ret = self._add_network_to_bcf(
+                    n, [s['current_gateway_ip'] for s in subnets])
+                if ret:
+                    written.update(payload_key(s) for s in subnets)
+                return ret
+
+            def _add_subnet(s):
+                if payload_key(s) in written:
+                    return True
+                return self._add_subnet_to_bcf(s)
+
+            handlers[sync_plan.OP_CREATE_NETWORK] = _add_network
+            handlers[sync_plan.OP_CREATE_SUBNET] = _add_subnet
+        return PlanExecutor(handlers, workers=self.sync_workers,
+                            is_retriable=retry.is_transient,
+                            is_fatal=lambda e: isinstance(e, CircuitOpen))
+
     def _delete_system_tenant_interfaces(self, interfaces):
         if len(interfaces) > 0:
             LOG.info("Deleting system tenant interfaces: %(interfaces)s",
@@ -201,9 +424,9 @@ class Synchronizer(object):
 
         ret = []
         for i in interfaces:
-            if self.rest_client.delete_system_tenant_interface(i):
+            if self._rest_write(
+                    self.rest_client.delete_system_tenant_interface, i):
                 ret.append(i)
-            time.sleep(self.rest_sleep)
         return ret
 
     def _find_project_in_os(self, os, tenant_name):
@@ -212,10 +435,10 @@ class Synchronizer(object):
                      tenant_name), None)
 
     def _find_subnets_in_os(self, os, ip_cidr):
-        return [s for s in os['subnets'] if self._get_gateway_ip(s) == ip_cidr]
+        return ip_cidr in self._get_os_index(os)['gateway_ip_set']
 
     def _find_networks_in_os(self, os, segment_name):
-        return [n for n in os['networks'] if n['name'] == segment_name]
+        return segment_name in self._get_os_index(os)['network_names']
 
     def _check_subnet_in_os(self, os, tenant):
         ret = []
@@ -306,8 +529,7 @@ class Synchronizer(object):
         return os['projects'][tenant_id] + '.' + self.neutron_id
 
     def _get_network(self, os, network_id):
-        network = next((n for n in os['networks']
-                        if n['id'] == network_id), None)
+        network = self._get_os_index(os)['networks'].get(network_id)
         if network:
             return network
         else:
@@ -316,32 +538,41 @@ class Synchronizer(object):
             LOG.debug(emsg)
             raise exceptions.Invalid(message=emsg)
 
-    def _add_resources(self, os, bcf):
-        networks = []
-        for n in os['networks']:
-            tenant_name = self._get_tenant_name(os, n['tenant_id'])
-            ret = self._check_network_in_bcf(bcf, tenant_name, n['name'])
-            if ret:
-                networks.append(ret)
-
-        subnets = []
-        for s in os['subnets']:
-            tenant_name = self._get_tenant_name(os, s['tenant_id'])
-            network = self._get_network(os, s['network_id'])
-            ret = self._check_subnet_in_bcf(bcf, os, tenant_name,
-                                            network['name'], s)
-            if ret:
-                subnets.append(ret)
-
-        networks = self._add_networks_to_bcf(networks)
-        subnets = self._add_subnets_to_bcf(subnets)
+    def _plan_add_resources(self, os, bcf, plan):
+        with self.metrics.phase('diff_add'):
+            networks = []
+            for n in os['networks']:
+                tenant_name = self._get_tenant_name(os, n['tenant_id'])
+                ret = self._check_network_in_bcf(bcf, tenant_name, n['name'])
+                if ret:
+                    networks.append(ret)
+
+            subnets = []
+            for s in os['subnets']:
+                tenant_name = self._get_tenant_name(os, s['tenant_id'])
+                network = self._get_network(os, s['network_id'])
+                ret = self._check_subnet_in_bcf(bcf, os, tenant_name,
+                                                network['name'], s)
+                if ret:
+                    subnets.append(ret)
+        self.metrics.count('network', 'add_diffed', len(networks))
+        self.metrics.count('subnet', 'add_diffed', len(subnets))
 
-        ret = {}
         if len(networks) > 0:
-            ret['network'] = networks
+            LOG.info("Adding networks: %(networks)s",
+                     {'networks': networks})
         if len(subnets) > 0:
-            ret['subnet'] = subnets
-        return ret
+            LOG.info("Adding subnets: %(subnets)s",
+                     {'subnets': subnets})
+        for n in networks:
+            plan.create_network(n)
+        for s in subnets:
+            plan.add_subnet(s)
+
+    def _add_resources(self, os, bcf):
+        plan = SyncPlan()
+        self._plan_add_resources(os, bcf, plan)
+        return self.apply_plan(plan).get('added', {})
 
     def _check_project_in_os(self, os, bcf, tenant_name):
         project = self._find_project_in_os(os, tenant_name)
@@ -360,9 +591,10 @@ class Synchronizer(object):
         return tenant_name
 
     def _filter_by_events(self, events, resources):
+        keys = set(payload_key(e['payload']) for e in events)
         ret = []
         for r in resources:
-            if next((e for e in events if e['payload'] == r), None):
+            if payload_key(r) in keys:
                 ret.append(r)
             else:
                 LOG.warn("There were no operations to delete it. "
@@ -370,59 +602,99 @@ class Synchronizer(object):
                          {'resource': r})
         return ret
 
-    def _delete_resources(self, bcf, os, events):
-        subnets = []
-        networks = []
-        for t in bcf['tenants']:
-            if not ('logical-router' in t and
-                    'tenant-interface' in t['logical-router'] and
-                    'segment-interface' in t['logical-router']):
-                continue
-
-            ret = self._check_subnet_in_os(os, t)
-            if ret:
-                subnets.extend(ret)
+    def _plan_delete_resources(self, bcf, os, events, plan):
+        with self.metrics.phase('diff_delete'):
+            subnets = []
+            networks = []
+            for t in bcf['tenants']:
+                if not self._has_logical_router(t):
+                    continue
 
-            ret = self._check_network_in_os(os, t)
-            if ret:
-                networks.extend(ret)
+                ret = self._check_subnet_in_os(os, t)
+                if ret:
+                    subnets.extend(ret)
 
-        if not (events is None):
-            # Delete only networks/subnets which were deleted by users.
-            subnets = self._filter_by_events(events, subnets)
-            networks = self._filter_by_events(events, networks)
+                ret = self._check_network_in_os(os, t)
+                if ret:
+                    networks.extend(ret)
 
-        subnets = self._delete_subnets_in_bcf(subnets)
-        networks = self._delete_networks_in_bcf(networks)
+            if not (events is None):
+                # Delete only networks/subnets which were deleted by users.
+                subnets = self._filter_by_events(events, subnets)
+                networks = self._filter_by_events(events, networks)
+        self.metrics.count('subnet', 'delete_diffed', len(subnets))
+        self.metrics.count('network', 'delete_diffed', len(networks))
 
-        ret = {}
         if len(subnets) > 0:
-            ret['subnets'] = subnets
+            LOG.info("Deleting subnets: %(subnets)s",
+                     {'subnets': subnets})
         if len(networks) > 0:
-            ret['networks'] = networks
-        return ret
+            LOG.info("Deleting networks: %(networks)s",
+                     {'networks': networks})
+        for s in subnets:
+            plan.delete_subnet(s)
+        for n in networks:
+            plan.delete_network(n)
+
+        tenants = self._find_empty_tenants(bcf, plan, networks)
+        if len(tenants) > 0:
+            LOG.info("Deleting tenant-level objects of tenants: "
+                     "%(tenants)s", {'tenants': tenants})
+        for t in tenants:
+            plan.delete_tenant({'project_name': t})
+
+    def _find_empty_tenants(self, bcf, plan, networks):
+        """Return tenants which have no segment left after the plan."""
+        # segments out of the scope of the snapshot remain, too
+        segments = bcf.get('all_segments') or \
+            self._get_bcf_index(bcf)['segments']
+        deleted = collections.OrderedDict()
+        for n in networks:
+            deleted.setdefault(n['project_name'], set()).add(
+                n['segment_name'])
+        created = set(n['project_name'] for n in plan.resources(
+            (sync_plan.OP_CREATE_NETWORK,)))
+        return [t for t, names in deleted.items()
+                if t not in created and not segments.get(t, set()) - names]
 
-    def _get_bcf_resources(self):
-        tenants = self.rest_client.get_tenants(self.neutron_id)
-        system_tenant_interfaces =\
-            self.rest_client.get_system_tenant_interfaces(self.neutron_id)
+    def _delete_resources(self, bcf, os, events):
+        plan = SyncPlan()
+        self._plan_delete_resources(bcf, os, events, plan)
+        return self.apply_plan(plan).get('deleted', {})
+
+    def _get_bcf_resources(self, tenant_names=None):
+        with self.metrics.phase('bcf_fetch'):
+            tenants = self.rest_client.get_tenants(
+                self.neutron_id, tenant_names=tenant_names)
+            system_tenant_interfaces =\
+                self.rest_client.get_system_tenant_interfaces(
+                    self.neutron_id, tenant_names=tenant_names)
+        self.metrics.count('tenant', 'fetched', len(tenants))
         return {
             'tenants': tenants,
             'system_tenant_interfaces': system_tenant_interfaces,
         }
 
-    def _get_os_resources(self):
-        projects = self._get_os_projects()
-        networks = self._get_os_networks()
-        subnets = self._get_os_subnets()
-
-        exclude_networks = self._get_exclude_networks()
-        LOG.debug("exclude_networks=%(exclude_networks)s",
-                  {'exclude_networks': exclude_networks})
-        networks = [n for n in networks
-                    if n['id'] not in exclude_networks]
-        subnets = [s for s in subnets
-                   if s['network_id'] not in exclude_networks]
+    def _get_os_resources(self, tenant_ids=None):
+        with self.metrics.phase('keystone'):
+            projects = self._get_os_projects()
+        with self.metrics.phase('neutron_db'):
+            networks = self._get_os_networks(tenant_ids)
+            subnets = self._get_os_subnets(tenant_ids)
+
+        LOG.debug("exclude_physical_networks=%(exclude)s",
+                  {'exclude': self.exclude_physical_networks})
+
+        # The cached listing may miss projects created after it was taken.
+        with self.metrics.phase('keystone'):
+            for tenant_id in set(r['tenant_id'] for r in networks + subnets):
+                if tenant_id not in projects:
+                    name = self.project_cache.get_name(tenant_id)
+                    if name:
+                        projects[tenant_id] = name
+        self.metrics.count('project', 'fetched', len(projects))
+        self.metrics.count('network', 'fetched', len(networks))
+        self.metrics.count('subnet', 'fetched', len(subnets))
 
         return {
             'projects': projects,
@@ -430,23 +702,320 @@ class Synchronizer(object):
             'subnets': subnets,
         }
 
-    def synchronize(self, events=None):
-        LOG.info("Start synchronization: events=%(events)s",
-                 {'events': events})
+    def apply_events(self, events):
+        """Apply created or updated networks and subnets to BCF.
+
+        Only the tenants, segments and ip-cidrs in the events are touched.
+        Anything which fails here is repaired by the next synchronize().
+        """
+        return self._measure_cycle('incremental', self._apply_events, events)
+
+    def _measure_cycle(self, kind, func, *args):
+        with self._lock:
+            self.metrics.start_cycle()
+            success = False
+            try:
+                with self.metrics.phase('total'):
+                    ret = func(*args)
+                success = True
+                return ret
+            finally:
+                self.metrics.finish_cycle(kind, success)
+
+    def _apply_events(self, events):
+        plan = SyncPlan()
+        networks = [e['payload'] for e in events
+                    if e['event_type'] in (EVENT_NETWORK_CREATE,
+                                           EVENT_NETWORK_UPDATE)]
+        subnets = [e['payload'] for e in events
+                   if e['event_type'] in (EVENT_SUBNET_CREATE,
+                                          EVENT_SUBNET_UPDATE)]
 
-        self.rest_client.renew_session()
-
-        bcf = self._get_bcf_resources()
+        if len(networks) > 0:
+            LOG.info("Adding networks by events: %(networks)s",
+                     {'networks': networks})
+        if len(subnets) > 0:
+            LOG.info("Adding subnets by events: %(subnets)s",
+                     {'subnets': subnets})
+        for n in networks:
+            plan.create_network(n)
+        for s in subnets:
+            plan.add_subnet(s)
+        return self.apply_plan(plan).get('added', {})
+
+    def _resolve_scope(self, projects, tenants):
+        """Return the ids of projects and names of BCF tenants in scope.
+
+        projects are names or ids of projects, and tenants are names of
+        BCF tenants. A BCF tenant whose project no longer exists is still
+        in scope, so that it can be cleaned up.
+        """
+        def _resolve(os_projects):
+            tenant_ids = set()
+            tenant_names = set(tenants or [])
+            found = set()
+            for tenant_id, name in os_projects.items():
+                if not name:
+                    continue
+                tenant_name = name + '.' + self.neutron_id
+                found.update(projects.intersection([tenant_id, name]))
+                if (tenant_id in projects or name in projects or
+                        tenant_name in tenant_names):
+                    tenant_ids.add(tenant_id)
+                    tenant_names.add(tenant_name)
+            return tenant_ids, tenant_names, found
+
+        projects = set(projects or [])
+        with self.metrics.phase('keystone'):
+            tenant_ids, tenant_names, found = _resolve(
+                self._get_os_projects())
+            # The cached listing may miss new projects. A BCF tenant may
+            # belong to a deleted project, which isn't a reason to fetch
+            # all projects again.
+            if found != projects:
+                self.project_cache.invalidate()
+                tenant_ids, tenant_names, found = _resolve(
+                    self._get_os_projects())
+        return tenant_ids, tenant_names
+
+    def _filter_scope(self, os, bcf, tenant_ids, tenant_names, segments):
+        """Restrict the snapshots to the given tenants and segments.
+
+        tenant_ids and tenant_names are None when all tenants are in scope,
+        and segments are names of networks. BCF tenants out of the scope
+        are never touched.
+        """
+        networks = [n for n in os['networks']
+                    if (tenant_ids is None or n['tenant_id'] in tenant_ids) and
+                    (not segments or n['name'] in segments)]
+        network_ids = set(n['id'] for n in networks)
+        os = dict(os, networks=networks,
+                  subnets=[s for s in os['subnets']
+                           if s['network_id'] in network_ids])
+
+        all_segments = self._build_bcf_index(bcf)['segments']
+        tenants = []
+        for t in bcf['tenants']:
+            if tenant_names is not None and t['name'] not in tenant_names:
+                continue
+            if segments and self._has_logical_router(t):
+                router = dict(t['logical-router'])
+                router['segment-interface'] = [
+                    si for si in router['segment-interface']
+                    if si['segment'] in segments]
+                t = dict(t, **{'logical-router': router})
+            tenants.append(t)
+        bcf = dict(bcf, tenants=tenants, all_segments=all_segments)
+        return os, bcf
+
+    def plan(self, events=None, projects=None, segments=None, tenants=None):
+        """Compare OpenStack with BCF and return a SyncPlan.
+
+        Nothing is written to BCF. If events is not None, only networks
+        and subnets deleted by the events are deleted from BCF.
+
+        projects (names or ids), tenants (names of BCF tenants) and
+        segments (names of networks) restrict the plan. With projects or
+        tenants, only those tenants are fetched from BCF and the Neutron
+        DB instead of all of them.
+        """
+        if not (projects or tenants or segments) and \
+                self.fingerprints is not None:
+            return self._plan_changes(events)
+
+        tenant_ids = tenant_names = None
+        if projects or tenants:
+            tenant_ids, tenant_names = self._resolve_scope(projects, tenants)
+            LOG.debug("synchronization scope: tenants=%(tenants)s",
+                      {'tenants': sorted(tenant_names)})
+
+        bcf = self._get_bcf_resources(tenant_names)
+        self._learn_tenant_objects(bcf, tenant_names)
+        os = self._get_os_resources(tenant_ids)
+        if tenant_names is not None or segments:
+            os, bcf = self._filter_scope(os, bcf, tenant_ids, tenant_names,
+                                         segments)
+
+        plan = SyncPlan()
+        self._plan_add_resources(os, bcf, plan)
+        self._plan_delete_resources(bcf, os, events, plan)
+        return plan
+
+    def _plan_changes(self, events):
+        """Plan a synchronization of tenants which may have changed.
+
+        Tenants whose fingerprint in OpenStack differs from the last
+        reconciled one, and tenants of events, are fetched from BCF. All
+        tenants are fetched once per full_interval. Then tenants whose
+        fingerprint in BCF equals the one in OpenStack are not compared.
+        The fingerprints to be recorded after the plan is applied are set
+        to plan.fingerprints.
+        """
         os = self._get_os_resources()
+        os_fingerprints = self._get_os_fingerprints(os)
+        full = (time.time() - self.reconciled_at >= self.full_interval)
+
+        tenant_names = None
+        if not full:
+            tenant_names = set(
+                t for t in set(os_fingerprints) | set(self.fingerprints)
+                if os_fingerprints.get(t) != self.fingerprints.get(t))
+            tenant_names.update(e['payload']['project_name']
+                                for e in events or [])
+            self.metrics.count('tenant', 'changed', len(tenant_names))
+            if not tenant_names:
+                LOG.debug("No tenant changed since the last synchronization")
+                return SyncPlan()
+
+        bcf = self._get_bcf_resources(tenant_names)
+        self._learn_tenant_objects(bcf, tenant_names)
+        bcf_fingerprints = self._get_bcf_fingerprints(bcf)
+        if tenant_names is None:
+            tenant_names = set(t['name'] for t in bcf['tenants']) | \
+                set(os_fingerprints)
+        unchanged = set(t for t in tenant_names
+                        if t in bcf_fingerprints and
+                        bcf_fingerprints[t] == os_fingerprints.get(t))
+        tenant_names -= unchanged
+        self.metrics.count('tenant', 'unchanged', len(unchanged))
+
+        tenant_ids = set(
+            tenant_id for tenant_id, name in os['projects'].items()
+            if name and name + '.' + self.neutron_id in tenant_names)
+        os, bcf = self._filter_scope(os, bcf, tenant_ids, tenant_names, None)
+
+        plan = SyncPlan()
+        self._plan_add_resources(os, bcf, plan)
+        self._plan_delete_resources(bcf, os, events, plan)
+        plan.fingerprints = dict(
+            (t, os_fingerprints.get(t)) for t in tenant_names | unchanged)
+        plan.full = full
+        return plan
+
+    def _record_fingerprints(self, plan, failures):
+        """Remember tenants reconciled by an applied plan."""
+        if self.fingerprints is None or plan.fingerprints is None:
+            return
+        failed = set(o['resource']['project_name'] for o, e in failures)
+        if plan.full:
+            self.fingerprints.clear()
+            if not failed:
+                self.reconciled_at = time.time()
+        for t, fingerprint in plan.fingerprints.items():
+            if t in failed or fingerprint is None:
+                self.fingerprints.pop(t, None)
+            else:
+                self.fingerprints[t] = fingerprint
 
+    def apply_plan(self, plan, checkpoint=None):
+        """Apply a SyncPlan to BCF and return the applied resources.
+
+        In dry run mode nothing is written and the whole plan is returned.
+        If a Checkpoint is given, the progress is recorded in it until the
+        plan is applied without retriable errors.
+        """
+        if self.dry_run:
+            return plan.result()
+        if not plan.operations:
+            self._record_fingerprints(plan, [])
+            return plan.result()
+
+        executor = self._get_executor(plan)
+        on_applied = None
+        if checkpoint:
+            try:
+                checkpoint.begin(plan)
+                on_applied = checkpoint.applied
+            except (IOError, OSError) as e:
+                LOG.warning("The progress isn't recorded because %(path)s "
+                            "can't be written: %(e)s",
+                            {'path': checkpoint.path, 'e': e})
+                checkpoint = None
+        try:
+            with self.metrics.phase('apply'):
+                applied = executor.execute(plan, on_applied)
+        finally:
+            for o, e in executor.failures:
+                self.metrics.count(o['op'].split('_', 1)[1], 'failed', 1)
+            if checkpoint:
+                checkpoint.close()
+        if checkpoint:
+            checkpoint.finish()
+        self._record_fingerprints(plan, executor.failures)
+        for o in applied:
+            # network, subnet or tenant
+            kind = o['op'].split('_', 1)[1]
+            stage = 'deleted' if o['op'] in sync_plan.DELETE_OPERATIONS \
+                else 'added'
+            self.metrics.count(kind, stage, 1)
+        return plan.result(applied)
+
+    def synchronize_events(self, events):
+        """Synchronize only the tenants of the events.
+
+        This costs a few requests per tenant instead of fetching every
+        tenant, so it's suitable to apply delete events soon.
+        """
+        tenants = set(e['payload']['project_name'] for e in events)
+        if not tenants:
+            return {}
+        return self._measure_cycle('events', self._synchronize, events,
+                                   None, None, tenants)
+
+    def has_checkpoint(self):
+        return bool(self.checkpoint) and self.checkpoint.exists()
+
+    def resume(self):
+        """Finish a full synchronization which was interrupted.
+
+        Only the tenants of its remaining operations are fetched and
+        compared again, so operations which became unnecessary meanwhile
+        are dropped. None is returned if there's nothing to resume.
+        """
+        with self._lock:
+            return self._resume()
+
+    def _resume(self):
+        state = self.checkpoint.load() if self.checkpoint else None
+        if state is None:
+            if self.checkpoint:
+                self.checkpoint.finish()
+            return None
+
+        plan, applied = state
+        remaining = [o for o in plan.operations if o['id'] not in applied]
+        tenants = set(o['resource']['project_name'] for o in remaining)
+        LOG.info("Resuming a synchronization: %(remaining)d of %(count)d "
+                 "operations remain in %(tenants)d tenants",
+                 {'remaining': len(remaining), 'count': len(plan),
+                  'tenants': len(tenants)})
         ret = {}
-        added = self._add_resources(os, bcf)
-        deleted = self._delete_resources(bcf, os, events)
+        if tenants:
+            # Deletions are still limited to the planned ones.
+            events = [{'event_type': o['op'], 'payload': o['resource']}
+                      for o in remaining
+                      if o['op'] in (sync_plan.OP_DELETE_SUBNET,
+                                     sync_plan.OP_DELETE_NETWORK)]
+            ret = self.synchronize(events=events, tenants=tenants)
+        self.checkpoint.finish()
+        return ret
+
+    def synchronize(self, events=None, projects=None, segments=None,
+                    tenants=None):
+        kind = 'scoped' if (projects or segments or tenants) else 'full'
+        return self._measure_cycle(kind, self._synchronize, events,
+                                   projects, segments, tenants)
+
+    def _synchronize(self, events, projects, segments, tenants):
+        LOG.info("Start synchronization: events=%(events)s",
+                 {'events': events})
 
-        if len(added) > 0:
-            ret['added'] = added
-        if len(deleted) > 0:
-            ret['deleted'] = deleted
+        # Only the full synchronization is large enough to be resumed.
+        checkpoint = None
+        if not (projects or segments or tenants):
+            checkpoint = self.checkpoint
+        ret = self.apply_plan(self.plan(events, projects, segments, tenants),
+                              checkpoint)
         if ret:
             LOG.info("Finished synchronization%(dry_run)s: "
                      "synchronized resources: %(resource)s.",
@@ -456,4 +1025,6 @@ class Synchronizer(object):
             LOG.info("Finished synchronization%(dry_run)s: "
                      "Already synchronized.",
                      {'dry_run': '(dry run mode)' if self.dry_run else ''})
+        LOG.debug("synchronization phases(sec): %(phases)s",
+                  {'phases': self.metrics.phases})
         return ret
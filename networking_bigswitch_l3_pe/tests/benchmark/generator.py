@@ -0,0 +1,146 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Synthetic OpenStack and BCF snapshots for benchmarks.
+
+A snapshot of `scale` networks has scale / 10 projects and 1.5 subnets
+per network. The BCF snapshot is derived from the OpenStack one with
+some drift:
+
+ * missing: ratio of networks and subnets which are not in BCF
+ * changed: ratio of subnets whose gateway in BCF is different
+ * orphans: ratio of extra segments (with an ip-subnet) only in BCF
+"""
+
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_DELETE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_DELETE
+import random
+
+SUBNETS_PER_NETWORK = 1.5
+NETWORKS_PER_PROJECT = 10
+
+
+def _cidr(i):
+    return '%d.%d.%d.0/24' % (10 + i // 65536, i // 256 % 256, i % 256)
+
+
+def _tenant_name(os, tenant_id, neutron_id):
+    return os['projects'][tenant_id] + '.' + neutron_id
+
+
+def generate_os(scale, seed=0):
+    rand = random.Random(seed)
+    n_projects = max(1, scale // NETWORKS_PER_PROJECT)
+    projects = dict(('project-%d' % i, 'project%d' % i)
+                    for i in range(n_projects))
+
+    networks = []
+    for i in range(scale):
+        networks.append({
+            'id': 'network-%d' % i,
+            'name': 'net%d' % i,
+            'tenant_id': 'project-%d' % rand.randrange(n_projects),
+        })
+
+    subnets = []
+    for i in range(int(scale * SUBNETS_PER_NETWORK)):
+        network = networks[i % scale]
+        cidr = _cidr(i)
+        subnets.append({
+            'id': 'subnet-%d' % i,
+            'network_id': network['id'],
+            'tenant_id': network['tenant_id'],
+            'cidr': cidr,
+            'gateway_ip': cidr.split('/')[0][:-1] + '1',
+        })
+
+    return {
+        'projects': projects,
+        'networks': networks,
+        'subnets': subnets,
+    }
+
+
+def generate_bcf(os, neutron_id, missing=0.0, changed=0.0, orphans=0.0,
+                 seed=0):
+    rand = random.Random(seed)
+    tenants = {}
+    segments = {}
+
+    def _segment(tenant_name, segment_name):
+        if tenant_name not in tenants:
+            tenants[tenant_name] = {
+                'name': tenant_name,
+                'logical-router': {
+                    'tenant-interface': [{'remote-tenant': 'system'}],
+                    'segment-interface': [],
+                },
+            }
+        key = (tenant_name, segment_name)
+        if key not in segments:
+            segments[key] = {'segment': segment_name, 'ip-subnet': []}
+            tenants[tenant_name]['logical-router'][
+                'segment-interface'].append(segments[key])
+        return segments[key]
+
+    networks = {}
+    for n in os['networks']:
+        networks[n['id']] = n
+        if rand.random() < missing:
+            continue
+        _segment(_tenant_name(os, n['tenant_id'], neutron_id), n['name'])
+
+    for s in os['subnets']:
+        if rand.random() < missing:
+            continue
+        network = networks[s['network_id']]
+        tenant_name = _tenant_name(os, s['tenant_id'], neutron_id)
+        if (tenant_name, network['name']) not in segments:
+            continue
+        mask = s['cidr'].split('/')[1]
+        gateway_ip = s['gateway_ip']
+        if rand.random() < changed:
+            gateway_ip = gateway_ip[:-1] + '254'
+        _segment(tenant_name, network['name'])['ip-subnet'].append(
+            {'ip-cidr': gateway_ip + '/' + mask})
+
+    orphan_networks = []
+    orphan_subnets = []
+    tenant_names = sorted(tenants) or [
+        _tenant_name(os, t, neutron_id) for t in sorted(os['projects'])]
+    for i in range(int(len(os['networks']) * orphans)):
+        tenant_name = rand.choice(tenant_names)
+        segment_name = 'orphan%d' % i
+        ip_cidr = '172.%d.%d.%d/24' % (16 + i // 65536 % 16, i // 256 % 256,
+                                       i % 256)
+        _segment(tenant_name, segment_name)['ip-subnet'].append(
+            {'ip-cidr': ip_cidr})
+        orphan_networks.append({'project_name': tenant_name,
+                                'segment_name': segment_name})
+        orphan_subnets.append({'project_name': tenant_name,
+                               'segment_name': segment_name,
+                               'current_gateway_ip': ip_cidr})
+
+    bcf = {
+        'tenants': list(tenants.values()),
+        'system_tenant_interfaces': [],
+    }
+    return bcf, orphan_networks, orphan_subnets
+
+
+def generate_events(orphan_networks, orphan_subnets):
+    return ([{'event_type': EVENT_NETWORK_DELETE, 'payload': n}
+             for n in orphan_networks] +
+            [{'event_type': EVENT_SUBNET_DELETE, 'payload': s}
+             for s in orphan_subnets])
@@ -0,0 +1,153 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Throughput and latency of RestClient and Synchronizer.
+
+Requests are sent to FakeBCFController on localhost, which adds the
+given latency and errors. Each result is printed as one JSON object per
+line:
+
+    $ python -m networking_bigswitch_l3_pe.tests.benchmark.rest \\
+        --calls 1000 --concurrency 8 --latency 0.005
+"""
+
+import argparse
+import eventlet
+import json
+import logging
+import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib.rate_limiter import RateLimiter
+from networking_bigswitch_l3_pe.lib.rest_client import RestClient
+from networking_bigswitch_l3_pe.tests.benchmark import generator
+from networking_bigswitch_l3_pe.tests.benchmark import run
+from networking_bigswitch_l3_pe.tests.fake_bcf import FakeBCFController
+import sys
+import time
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_rest_client(controller, args):
+    client = RestClient(controller.api_url, 'admin', 'password',
+                        pool_size=args.concurrency)
+    latencies = []
+    errors = [0]
+
+    def _call(i):
+        start = time.time()
+        try:
+            client.create_net('project%d.neutron' % (i % 100), 'net%d' % i)
+        except Exception:
+            errors[0] += 1
+        latencies.append(time.time() - start)
+
+    connections = controller.connections
+    requests = len(controller.requests)
+    pool = eventlet.GreenPool(args.concurrency)
+    start = time.time()
+    for i in range(args.calls):
+        pool.spawn_n(_call, i)
+    pool.waitall()
+    duration = time.time() - start
+
+    return {
+        'benchmark': 'rest_client.create_net',
+        'calls': args.calls,
+        'concurrency': args.concurrency,
+        'controller_latency': args.latency,
+        'error_rate': args.error_rate,
+        'duration': duration,
+        'throughput': args.calls / duration,
+        'p50': _percentile(latencies, 0.5),
+        'p90': _percentile(latencies, 0.9),
+        'p99': _percentile(latencies, 0.99),
+        'max': max(latencies),
+        'errors': errors[0],
+        'requests': len(controller.requests) - requests,
+        'connections': controller.connections - connections,
+    }
+
+
+def bench_synchronize(controller, args):
+    os = generator.generate_os(args.scale, seed=args.seed)
+    sync = run.make_synchronizer(os, {'tenants': []})
+    sync.rest_client = RestClient(controller.api_url, 'admin', 'password',
+                                  pool_size=args.concurrency)
+    sync.sync_workers = args.concurrency
+    sync.rate_limiter = RateLimiter(rate=1e9, max_rate=1e9, burst=1e9)
+    sync.checkpoint = None
+    # Measure full synchronizations, which are skipped without changes.
+    sync.fingerprints = None
+
+    connections = controller.connections
+    requests = len(controller.requests)
+    start = time.time()
+    error = None
+    try:
+        sync.synchronize(events=[])
+    except Exception as e:
+        error = str(e)
+    duration = time.time() - start
+
+    return {
+        'benchmark': 'synchronize',
+        'scale': args.scale,
+        'concurrency': args.concurrency,
+        'controller_latency': args.latency,
+        'error_rate': args.error_rate,
+        'duration': duration,
+        'error': error,
+        'requests': len(controller.requests) - requests,
+        'connections': controller.connections - connections,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark REST calls to a fake BCF Controller')
+    parser.add_argument('-n', '--calls', type=int, default=1000)
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='seconds added to every request')
+    parser.add_argument('-e', '--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-rate', type=int, default=None,
+                        help='requests per second the controller accepts')
+    parser.add_argument('-s', '--scale', type=int, default=1000,
+                        help='number of networks for synchronize()')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    # The fake controller and the clients run in green threads.
+    eventlet.monkey_patch()
+    logging.getLogger('networking_bigswitch_l3_pe').setLevel(logging.ERROR)
+    networking_bigswitch_l3_pe.lib.config.register_config()
+
+    for bench in (bench_rest_client, bench_synchronize):
+        controller = FakeBCFController(
+            neutron_id=run.NEUTRON_ID, latency=args.latency,
+            error_rate=args.error_rate, max_rate=args.max_rate)
+        controller.start()
+        try:
+            result = bench(controller, args)
+        finally:
+            controller.stop()
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks of the synchronization pipeline at synthetic scale.
+
+Keystone, the Neutron DB and BCF Controller are stubbed, so only the
+time spent in the synchronizer itself is measured. Each result is
+printed as one JSON object per line:
+
+    $ python -m networking_bigswitch_l3_pe.tests.benchmark.run \\
+        --scales 100,1000 --missing 0.05 --orphans 0.05
+"""
+
+import argparse
+import copy
+import json
+import logging
+import mock
+import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib.rate_limiter import RateLimiter
+from networking_bigswitch_l3_pe.lib.synchronizer import Synchronizer
+from networking_bigswitch_l3_pe.tests.benchmark import generator
+import sys
+import time
+
+NEUTRON_ID = 'neutron'
+DEFAULT_SCALES = '100,1000,10000,50000'
+
+
+def make_synchronizer(os, bcf):
+    with mock.patch('networking_bigswitch_l3_pe.lib.synchronizer.'
+                    'RestClient'), \
+            mock.patch('networking_bigswitch_l3_pe.lib.synchronizer.'
+                       'KeystoneClient'):
+        sync = Synchronizer('http://127.0.0.1/', 'admin', 'password',
+                            NEUTRON_ID, [])
+
+    rest_client = sync.rest_client
+    for method in ('create_net', 'create_subnet', 'update_subnet',
+                   'delete_net', 'delete_subnet',
+                   'delete_system_tenant_interface'):
+        getattr(rest_client, method).return_value = True
+    rest_client.get_tenants.side_effect = \
+        lambda neutron_id, tenant_names=None: copy.deepcopy(bcf['tenants'])
+    rest_client.get_system_tenant_interfaces.return_value = []
+
+    sync.project_cache = mock.Mock()
+    sync.project_cache.get_projects.side_effect = \
+        lambda: dict(os['projects'])
+    sync._get_os_networks = \
+        lambda tenant_ids=None: copy.deepcopy(os['networks'])
+    sync._get_os_subnets = \
+        lambda tenant_ids=None: copy.deepcopy(os['subnets'])
+    # Don't measure the throttling of writes.
+    sync.rate_limiter = RateLimiter(rate=1e9, max_rate=1e9, burst=1e9)
+    sync.checkpoint = None
+    # Measure full synchronizations, which are skipped without changes.
+    sync.fingerprints = None
+    return sync
+
+
+def _measure(func, prepare, repeat):
+    durations = []
+    for i in range(repeat):
+        args = prepare()
+        start = time.time()
+        func(*args)
+        durations.append(time.time() - start)
+    return durations
+
+
+def run_scale(scale, args):
+    os = generator.generate_os(scale, seed=args.seed)
+    bcf, orphan_networks, orphan_subnets = generator.generate_bcf(
+        os, NEUTRON_ID, missing=args.missing, changed=args.changed,
+        orphans=args.orphans, seed=args.seed)
+    events = generator.generate_events(orphan_networks, orphan_subnets)
+    resources = orphan_subnets + orphan_networks
+    sync = make_synchronizer(os, bcf)
+
+    def _snapshots():
+        return copy.deepcopy(os), copy.deepcopy(bcf)
+
+    benchmarks = [
+        ('add_resources', sync._add_resources, _snapshots),
+        ('delete_resources',
+         lambda o, b: sync._delete_resources(b, o, events), _snapshots),
+        ('filter_by_events', sync._filter_by_events,
+         lambda: (events, resources)),
+        ('synchronize', lambda: sync.synchronize(events=events),
+         lambda: ()),
+    ]
+
+    results = []
+    for name, func, prepare in benchmarks:
+        durations = _measure(func, prepare, args.repeat)
+        result = {
+            'benchmark': name,
+            'scale': scale,
+            'objects': {
+                'projects': len(os['projects']),
+                'networks': len(os['networks']),
+                'subnets': len(os['subnets']),
+                'bcf_tenants': len(bcf['tenants']),
+                'events': len(events),
+            },
+            'drift': {
+                'missing': args.missing,
+                'changed': args.changed,
+                'orphans': args.orphans,
+            },
+            'repeat': args.repeat,
+            'min': min(durations),
+            'mean': sum(durations) / len(durations),
+            'max': max(durations),
+        }
+        if name == 'synchronize':
+            # phases of the last run
+            result['phases'] = dict(sync.metrics.phases)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='benchmark the synchronization with BCF')
+    parser.add_argument('-s', '--scales', default=DEFAULT_SCALES,
+                        help='comma separated numbers of networks')
+    parser.add_argument('--missing', type=float, default=0.01)
+    parser.add_argument('--changed', type=float, default=0.01)
+    parser.add_argument('--orphans', type=float, default=0.01)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default=None,
+                        help='write results to this file instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger('networking_bigswitch_l3_pe').setLevel(
+            logging.ERROR)
+    networking_bigswitch_l3_pe.lib.config.register_config()
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for scale in [int(s) for s in args.scales.split(',')]:
+            for result in run_scale(scale, args):
+                output.write(json.dumps(result, sort_keys=True) + '\n')
+                output.flush()
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
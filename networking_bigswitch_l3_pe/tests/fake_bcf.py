@@ -0,0 +1,412 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A fake BCF Controller on localhost for tests and load measurements.
+
+It keeps the state of the resources which RestClient uses, and can add
+latency, inject errors and limit the rate of requests:
+
+    controller = FakeBCFController(neutron_id='neutron', latency=0.01)
+    controller.start()
+    client = RestClient(controller.api_url, 'admin', 'password')
+    ...
+    controller.stop()
+"""
+
+import json
+import random
+import re
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse
+import ssl
+import threading
+import time
+import uuid
+
+API_PREFIX = '/api/v1'
+BCF_PREFIX = '/data/controller/applications/bcf'
+LOGIN_PATH = re.compile(r'^/auth/login$')
+SESSION_PATH = re.compile(
+    r'^/data/controller/core/aaa/session\[auth-token="(?P<session>[^"]+)"\]$')
+TENANTS_PATH = re.compile(
+    r'^/tenant\[origination="(?P<origination>[^"]+)"\]$')
+TENANT_PATH = re.compile(r'^/tenant\[name="(?P<tenant>[^"]+)"\]$')
+ROUTER_PATH = r'^/tenant\[name="(?P<tenant>[^"]+)"\]/logical-router'
+LOGICAL_ROUTER_PATH = re.compile(ROUTER_PATH + r'$')
+TENANT_IFS_PATH = re.compile(ROUTER_PATH + r'/tenant-interface$')
+TENANT_IF_PATH = re.compile(
+    ROUTER_PATH + r'/tenant-interface\[remote-tenant="(?P<remote>[^"]+)"\]$')
+STATIC_ROUTE_PATH = re.compile(
+    ROUTER_PATH + r'/static-route\[dst-ip-subnet="(?P<dst>[^"]+)"\]$')
+SEGMENT_IFS_PATH = re.compile(ROUTER_PATH + r'/segment-interface$')
+SEGMENT_IF_PATH = re.compile(
+    ROUTER_PATH + r'/segment-interface\[segment="(?P<segment>[^"]+)"\]$')
+IP_CIDR_PATH = re.compile(
+    ROUTER_PATH + r'/segment-interface\[segment="(?P<segment>[^"]+)"\]'
+    r'/ip-subnet\[ip-cidr="(?P<ip_cidr>[^"]+)"\]$')
+
+
+class FakeBCFError(Exception):
+    def __init__(self, code, message=''):
+        self.code = code
+        self.message = message
+        super(FakeBCFError, self).__init__(code, message)
+
+
+class FakeBCFState(object):
+    """Resources of the fake controller.
+
+    Tenants are kept as the same trees as BCF returns them, and created
+    implicitly by the first write under them.
+    """
+
+    def __init__(self, neutron_id):
+        self.neutron_id = neutron_id
+        self.tenants = {}
+        self.lock = threading.Lock()
+
+    def _tenant(self, name, create=False):
+        if name not in self.tenants:
+            if not create:
+                raise FakeBCFError(404, 'tenant %s is not found' % name)
+            origination = None if name == 'system' else self.neutron_id
+            self.tenants[name] = {
+                'name': name,
+                'origination': origination,
+                'logical-router': {},
+            }
+        return self.tenants[name]
+
+    def _router_list(self, tenant, key, create=False):
+        router = self._tenant(tenant, create)['logical-router']
+        if create:
+            return router.setdefault(key, [])
+        return router.get(key, [])
+
+    def _find(self, items, key, value):
+        return next((i for i in items if i.get(key) == value), None)
+
+    def _put(self, items, key, value, data):
+        item = self._find(items, key, value)
+        if item is None:
+            item = {key: value}
+            items.append(item)
+        item.update(data)
+        return item
+
+    def _delete(self, items, key, value):
+        item = self._find(items, key, value)
+        if item is None:
+            raise FakeBCFError(404, '%s=%s is not found' % (key, value))
+        items.remove(item)
+
+    def patch_logical_router(self, tenant, data):
+        """Merge the lists of a logical router into the existing ones."""
+        keys = [('tenant-interface', 'remote-tenant'),
+                ('static-route', 'dst-ip-subnet'),
+                ('segment-interface', 'segment')]
+        for key, name in keys:
+            for item in data.get(key, []):
+                item = dict(item)
+                subnets = item.pop('ip-subnet', [])
+                merged = self._put(self._router_list(tenant, key, True),
+                                   name, item[name], item)
+                for subnet in subnets:
+                    self._put(merged.setdefault('ip-subnet', []),
+                              'ip-cidr', subnet['ip-cidr'], subnet)
+
+    def get_tenants(self, origination):
+        return [t for t in self.tenants.values()
+                if t['origination'] == origination]
+
+    def get_tenant(self, name):
+        return [self.tenants[name]] if name in self.tenants else []
+
+    def get_tenant_interfaces(self, tenant):
+        if tenant not in self.tenants:
+            return []
+        return self._router_list(tenant, 'tenant-interface')
+
+    def get_tenant_interface(self, tenant, remote):
+        item = self._find(self.get_tenant_interfaces(tenant),
+                          'remote-tenant', remote)
+        return [item] if item else []
+
+    def put_tenant_interface(self, tenant, remote, data):
+        self._put(self._router_list(tenant, 'tenant-interface', True),
+                  'remote-tenant', remote, data)
+
+    def delete_tenant_interface(self, tenant, remote):
+        self._delete(self._router_list(tenant, 'tenant-interface'),
+                     'remote-tenant', remote)
+
+    def put_static_route(self, tenant, dst, data):
+        self._put(self._router_list(tenant, 'static-route', True),
+                  'dst-ip-subnet', dst, data)
+
+    def delete_static_route(self, tenant, dst):
+        self._delete(self._router_list(tenant, 'static-route'),
+                     'dst-ip-subnet', dst)
+
+    def get_segment_interfaces(self, tenant):
+        if tenant not in self.tenants:
+            return []
+        return self._router_list(tenant, 'segment-interface')
+
+    def put_segment_interface(self, tenant, segment, data):
+        self._put(self._router_list(tenant, 'segment-interface', True),
+                  'segment', segment, data)
+
+    def delete_segment_interface(self, tenant, segment):
+        self._delete(self._router_list(tenant, 'segment-interface'),
+                     'segment', segment)
+
+    def _segment_interface(self, tenant, segment):
+        si = self._find(self._router_list(tenant, 'segment-interface'),
+                        'segment', segment)
+        if si is None:
+            raise FakeBCFError(404, 'segment %s is not found' % segment)
+        return si
+
+    def put_ip_cidr(self, tenant, segment, ip_cidr, data):
+        si = self._segment_interface(tenant, segment)
+        self._put(si.setdefault('ip-subnet', []), 'ip-cidr', ip_cidr, data)
+
+    def delete_ip_cidr(self, tenant, segment, ip_cidr):
+        si = self._segment_interface(tenant, segment)
+        self._delete(si.get('ip-subnet', []), 'ip-cidr', ip_cidr)
+
+
+class FakeBCFRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.controller.connected()
+
+    def _send(self, code, body=None):
+        data = json.dumps(body) if body is not None else ''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, verb):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else ''
+        path = parse.unquote(parse.urlparse(self.path).path)
+        try:
+            code, body = self.server.controller.handle(
+                verb, path, data, self.headers.get('Cookie') or '')
+        except FakeBCFError as e:
+            code, body = e.code, {'description': e.message}
+        self._send(code, body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeBCFServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeBCFController(object):
+    """HTTP(S) server which behaves like BCF Controller.
+
+    latency: seconds added to every request
+    error_rate: ratio of requests which fail with error_code
+    max_rate: requests per second above which 429 is returned
+    certfile: serves HTTPS with this certificate (and key) if given
+    patch_router: whether a PATCH of a logical router is accepted
+    """
+
+    def __init__(self, neutron_id='neutron', username='admin',
+                 password='password', latency=0, error_rate=0,
+                 error_code=500, max_rate=None, certfile=None, keyfile=None,
+                 patch_router=True):
+        self.state = FakeBCFState(neutron_id)
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.max_rate = max_rate
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.patch_router = patch_router
+        self.sessions = set()
+        self.requests = []
+        self.connections = 0
+        self.failures = []
+        self._rate_window = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address
+        scheme = 'https' if self.certfile else 'http'
+        return '%s://%s:%d%s' % (scheme, host, port, API_PREFIX)
+
+    def start(self):
+        self._server = FakeBCFServer(('127.0.0.1', 0), FakeBCFRequestHandler)
+        self._server.controller = self
+        if self.certfile:
+            self._server.socket = ssl.wrap_socket(
+                self._server.socket, certfile=self.certfile,
+                keyfile=self.keyfile, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def connected(self):
+        with self.state.lock:
+            self.connections += 1
+
+    def fail_next(self, count=1, code=500):
+        """Fail the next count requests (except login) with code."""
+        with self.state.lock:
+            self.failures.extend([code] * count)
+
+    def expire_sessions(self):
+        with self.state.lock:
+            self.sessions.clear()
+
+    def _check_rate(self, now):
+        if not self.max_rate:
+            return
+        self._rate_window = [t for t in self._rate_window if now - t < 1.0]
+        if len(self._rate_window) >= self.max_rate:
+            raise FakeBCFError(429, 'too many requests')
+        self._rate_window.append(now)
+
+    def _check_session(self, cookie):
+        session = None
+        for c in cookie.split(';'):
+            name, _, value = c.strip().partition('=')
+            if name == 'session_cookie':
+                session = value
+        if session not in self.sessions:
+            raise FakeBCFError(401, 'session is not valid')
+
+    def handle(self, verb, path, data, cookie):
+        if self.latency:
+            time.sleep(self.latency)
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        body = json.loads(data) if data else {}
+
+        with self.state.lock:
+            self.requests.append((verb, path))
+            self._check_rate(time.time())
+            if LOGIN_PATH.match(path) and verb == 'POST':
+                return self._login(body)
+            self._check_session(cookie)
+            if self.failures:
+                raise FakeBCFError(self.failures.pop(0), 'injected error')
+            if self.error_rate and random.random() < self.error_rate:
+                raise FakeBCFError(self.error_code, 'injected error')
+
+            m = SESSION_PATH.match(path)
+            if m and verb == 'DELETE':
+                self.sessions.discard(m.group('session'))
+                return 204, None
+            if not path.startswith(BCF_PREFIX):
+                raise FakeBCFError(404, 'unknown path %s' % path)
+            return self._handle_bcf(verb, path[len(BCF_PREFIX):], body)
+
+    def _login(self, body):
+        if (body.get('user') != self.username or
+                body.get('password') != self.password):
+            raise FakeBCFError(401, 'authentication failed')
+        session = uuid.uuid4().hex
+        self.sessions.add(session)
+        return 200, {'success': True, 'session_cookie': session}
+
+    def _handle_bcf(self, verb, path, body):
+        state = self.state
+        router_handlers = {}
+        if self.patch_router:
+            router_handlers['PATCH'] = lambda m: state.patch_logical_router(
+                m['tenant'], body)
+        routes = [
+            (TENANTS_PATH, {
+                'GET': lambda m: state.get_tenants(m['origination'])}),
+            (TENANT_PATH, {
+                'GET': lambda m: state.get_tenant(m['tenant'])}),
+            (LOGICAL_ROUTER_PATH, router_handlers),
+            (TENANT_IFS_PATH, {
+                'GET': lambda m: state.get_tenant_interfaces(m['tenant'])}),
+            (TENANT_IF_PATH, {
+                'GET': lambda m: state.get_tenant_interface(
+                    m['tenant'], m['remote']),
+                'PUT': lambda m: state.put_tenant_interface(
+                    m['tenant'], m['remote'], body),
+                'DELETE': lambda m: state.delete_tenant_interface(
+                    m['tenant'], m['remote'])}),
+            (STATIC_ROUTE_PATH, {
+                'PUT': lambda m: state.put_static_route(
+                    m['tenant'], m['dst'], body),
+                'DELETE': lambda m: state.delete_static_route(
+                    m['tenant'], m['dst'])}),
+            (SEGMENT_IFS_PATH, {
+                'GET': lambda m: state.get_segment_interfaces(m['tenant'])}),
+            (SEGMENT_IF_PATH, {
+                'PUT': lambda m: state.put_segment_interface(
+                    m['tenant'], m['segment'], body),
+                'DELETE': lambda m: state.delete_segment_interface(
+                    m['tenant'], m['segment'])}),
+            (IP_CIDR_PATH, {
+                'PUT': lambda m: state.put_ip_cidr(
+                    m['tenant'], m['segment'], m['ip_cidr'], body),
+                'DELETE': lambda m: state.delete_ip_cidr(
+                    m['tenant'], m['segment'], m['ip_cidr'])}),
+        ]
+        for pattern, handlers in routes:
+            m = pattern.match(path)
+            if not m:
+                continue
+            if verb not in handlers:
+                raise FakeBCFError(405, '%s is not allowed' % verb)
+            ret = handlers[verb](m.groupdict())
+            if verb == 'GET':
+                return 200, ret
+            return 204, None
+        raise FakeBCFError(404, 'unknown path %s' % path)
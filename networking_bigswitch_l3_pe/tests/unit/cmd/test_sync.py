@@ -0,0 +1,98 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import patch
+from networking_bigswitch_l3_pe.cmd import sync as sync_cmd
+from networking_bigswitch_l3_pe.lib.metrics import Metrics
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+from neutron.tests import base
+import os
+import shutil
+from six import StringIO
+import tempfile
+
+
+class SyncCommandTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SyncCommandTestCase, self).setUp()
+        patcher = patch.object(sync_cmd, 'cfg')
+        conf = patcher.start().CONF
+        conf.RESTPROXY.server_auth = 'admin:password'
+        self.addCleanup(patcher.stop)
+
+        patcher = patch.object(sync_cmd, 'Synchronizer')
+        self.sync = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.sync.metrics = Metrics()
+        self.plan = SyncPlan()
+        self.plan.create_network({'project_name': 'project1.neutron',
+                                  'segment_name': 'net1'})
+        self.sync.plan.return_value = self.plan
+        self.sync.apply_plan.side_effect = lambda plan: plan.result()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _run(self, argv):
+        with patch.object(sync_cmd, 'print_statistics'):
+            return sync_cmd.run(sync_cmd.parse_args(argv))
+
+    def test_parse_args(self):
+        args = sync_cmd.parse_args(['-p', 'p1', '-p', 'p2', '-s', 'net1'])
+        self.assertEqual(['p1', 'p2'], args.project)
+        self.assertEqual(['net1'], args.segment)
+        self.assertFalse(args.execute)
+        self.assertRaises(SystemExit, sync_cmd.parse_args,
+                          ['--load-plan', 'plan.json', '-p', 'p1'])
+        self.assertRaises(SystemExit, sync_cmd.parse_args,
+                          ['--trigger', '-x'])
+
+    def test_trigger(self):
+        with patch.object(sync_cmd, 'EventNotifier') as notifier:
+            self.assertIsNone(self._run(['--trigger']))
+        notifier.return_value.request_sync.assert_called_once_with()
+        self.assertFalse(self.sync.plan.called)
+
+    def test_run_with_scope(self):
+        ret = self._run(['-p', 'project1', '-s', 'net1', '-x'])
+        self.sync.plan.assert_called_once_with(projects=['project1'],
+                                               segments=['net1'], tenants=[])
+        self.assertEqual(self.plan.result(), ret)
+        self.assertIsNone(self.sync.metrics.sink)
+        self.assertIn('total', self.sync.metrics.phases)
+
+    def test_save_and_load_plan(self):
+        path = os.path.join(self.tmpdir, 'plan.json')
+        self._run(['--save-plan', path])
+
+        self.sync.plan.reset_mock()
+        self._run(['--load-plan', path, '-x'])
+        self.assertFalse(self.sync.plan.called)
+        plan = self.sync.apply_plan.call_args[0][0]
+        self.assertEqual(self.plan.operations, plan.operations)
+
+    def test_print_statistics(self):
+        metrics = Metrics()
+        with metrics.phase('bcf_fetch'):
+            metrics.count('tenant', 'fetched', 2)
+        metrics.observe_rest('GET', '/tenant[name="t1"]', 200, 0.5)
+        metrics.observe_rest('GET', '/tenant[name="t2"]', 404, 1.5)
+        out = StringIO()
+        sync_cmd.print_statistics(metrics, out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('  tenant   fetched              2', lines)
+        self.assertIn('GET    /tenant[name]', lines[-2])
+        self.assertTrue(lines[-2].endswith('2     1.000     2.000'))
+        self.assertTrue(lines[-1].endswith('error(404): 1'))
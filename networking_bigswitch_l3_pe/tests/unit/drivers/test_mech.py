@@ -0,0 +1,241 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+from networking_bigswitch_l3_pe.drivers import mech
+from networking_bigswitch_l3_pe.lib.coordination import LocalLockBackend
+from networking_bigswitch_l3_pe.lib.event import DELETE_EVENTS
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_CREATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_DELETE
+from networking_bigswitch_l3_pe.lib.event import EVENT_NETWORK_UPDATE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_DELETE
+from networking_bigswitch_l3_pe.lib.event import EVENT_SUBNET_UPDATE
+from networking_bigswitch_l3_pe.lib.event import INCREMENTAL_EVENTS
+from neutron.tests import base
+
+
+class _Stop(BaseException):
+    """Break out of a loop of the driver, which catches every Exception."""
+
+
+def _network(name='net1', tenant_id='p1'):
+    return {'id': 'n1', 'name': name, 'tenant_id': tenant_id}
+
+
+def _subnet(gateway_ip='10.0.1.1', cidr='10.0.1.0/24'):
+    return {'id': 's1', 'network_id': 'n1', 'tenant_id': 'p1',
+            'gateway_ip': gateway_ip, 'cidr': cidr}
+
+
+class MechanismDriverTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MechanismDriverTestCase, self).setUp()
+        mocks = {}
+        for target in ('bigswitch_config', 'cfg', 'eventlet',
+                       'db_base_plugin_v2', 'EventNotifier', 'EventWatcher',
+                       'get_lock_backend', 'KeystoneClient', 'LeaderElector',
+                       'ProjectNameCache', 'SyncScheduler', 'Synchronizer'):
+            patcher = patch.object(mech, target)
+            mocks[target] = patcher.start()
+            self.addCleanup(patcher.stop)
+        conf = mocks['cfg'].CONF
+        conf.RESTPROXY.server_auth = 'admin:password'
+        conf.RESTPROXY.neutron_id = 'neutron'
+        conf.networking_bigswitch_l3_pe.exclude_physical_networks = \
+            ['physnet2']
+        self.elector = mocks['LeaderElector'].return_value
+        self.elector.ttl = 30
+        self.elector.is_leader = True
+        self.project_cache = mocks['ProjectNameCache'].return_value
+        self.project_cache.get_name.side_effect = \
+            lambda tenant_id: {'p1': 'project1'}.get(tenant_id)
+        self.eventlet = mocks['eventlet']
+
+    def _setup_driver(self):
+        driver = mech.BCFPhysicalEditionMechanismDriver()
+        self.notifier = driver.notifier
+        self.watcher = driver.watcher
+        self.scheduler = driver.scheduler
+        self.sync = driver.sync
+        return driver
+
+    def _notified(self):
+        return [(args[1], args[2])
+                for args, kwargs in self.notifier.notify.call_args_list]
+
+    def test_init(self):
+        driver = self._setup_driver()
+        self.assertEqual(4, self.eventlet.spawn.call_count)
+        self.assertIs(self.scheduler.trigger, driver.watcher.on_sync_request)
+        self.assertTrue(self.sync.checkpoint)
+
+    def test_no_checkpoint_with_local_backend(self):
+        self.elector.backend = LocalLockBackend()
+        self._setup_driver()
+        self.assertIsNone(self.sync.checkpoint)
+
+    def test_create_network_postcommit(self):
+        driver = self._setup_driver()
+        driver.create_network_postcommit(Mock(current=_network(),
+                                              network_segments=[]))
+        self.assertEqual([(EVENT_NETWORK_CREATE,
+                           {'project_name': 'project1.neutron',
+                            'segment_name': 'net1'})], self._notified())
+
+        # excluded
+        driver.create_network_postcommit(Mock(
+            current=_network(),
+            network_segments=[{'physical_network': 'physnet2'}]))
+        self.assertEqual(1, self.notifier.notify.call_count)
+
+    def test_hook_error_is_logged(self):
+        driver = self._setup_driver()
+        # The project isn't found, which is repaired by the synchronization.
+        driver.create_network_postcommit(Mock(
+            current=_network(tenant_id='p9'), network_segments=[]))
+        self.assertFalse(self.notifier.notify.called)
+
+    def test_update_network_postcommit(self):
+        driver = self._setup_driver()
+        driver.update_network_postcommit(Mock(
+            original=_network(), current=_network(), network_segments=[]))
+        self.assertFalse(self.notifier.notify.called)
+
+        driver.update_network_postcommit(Mock(
+            original=_network(), current=_network(name='net2'),
+            network_segments=[]))
+        self.assertEqual([
+            (EVENT_NETWORK_DELETE, {'project_name': 'project1.neutron',
+                                    'segment_name': 'net1'}),
+            (EVENT_NETWORK_UPDATE, {'project_name': 'project1.neutron',
+                                    'segment_name': 'net2'}),
+        ], self._notified())
+
+    def test_update_subnet_postcommit(self):
+        driver = self._setup_driver()
+        network = Mock(current=_network(), network_segments=[])
+        driver.update_subnet_postcommit(Mock(
+            original=_subnet(gateway_ip='10.0.1.254'), current=_subnet(),
+            network=network))
+        driver.update_subnet_postcommit(Mock(
+            original=_subnet(), current=_subnet(gateway_ip=None),
+            network=network))
+        self.assertEqual([
+            (EVENT_SUBNET_UPDATE, {'project_name': 'project1.neutron',
+                                   'segment_name': 'net1',
+                                   'original_gateway_ip': '10.0.1.254/24',
+                                   'current_gateway_ip': '10.0.1.1/24'}),
+            (EVENT_SUBNET_DELETE, {'project_name': 'project1.neutron',
+                                   'segment_name': 'net1',
+                                   'current_gateway_ip': '10.0.1.1/24'}),
+        ], self._notified())
+
+    def _run_sync_once(self, driver):
+        """Return whether the scheduler was told of a change."""
+        self.scheduler.wait.side_effect = [None, _Stop()]
+        self.assertRaises(_Stop, driver._bcf_sync)
+        return self.scheduler.done.call_args_list[0][0][0]
+
+    def test_bcf_sync(self):
+        driver = self._setup_driver()
+        self.sync.has_checkpoint.return_value = False
+        self.sync.synchronize.return_value = {}
+        events = self.watcher.pop_events.return_value
+
+        self.assertFalse(self._run_sync_once(driver))
+        self.watcher.pop_events.assert_called_once_with(
+            event_types=DELETE_EVENTS)
+        self.sync.synchronize.assert_called_once_with(events=events)
+        self.watcher.ack.assert_called_once_with(events)
+
+    def test_bcf_sync_as_follower(self):
+        driver = self._setup_driver()
+        self.elector.is_leader = False
+        self._run_sync_once(driver)
+        self.assertFalse(self.sync.synchronize.called)
+        self.assertFalse(self.watcher.pop_events.called)
+
+    def test_bcf_sync_requeue_events(self):
+        driver = self._setup_driver()
+        self.sync.has_checkpoint.return_value = False
+        self.sync.synchronize.side_effect = ValueError
+        events = self.watcher.pop_events.return_value
+
+        self.assertTrue(self._run_sync_once(driver))
+        self.watcher.requeue.assert_called_once_with(events)
+        self.assertFalse(self.watcher.ack.called)
+
+    def test_bcf_sync_resume(self):
+        driver = self._setup_driver()
+        self.sync.has_checkpoint.return_value = True
+        # Every planned operation was applied before it was interrupted.
+        self.sync.resume.return_value = {}
+
+        self.assertTrue(self._run_sync_once(driver))
+        self.assertFalse(self.sync.synchronize.called)
+
+    def test_bcf_sync_stale_checkpoint(self):
+        driver = self._setup_driver()
+        self.sync.has_checkpoint.return_value = True
+        self.sync.resume.return_value = None
+        self.sync.synchronize.return_value = {'added': {}}
+
+        self.assertTrue(self._run_sync_once(driver))
+        self.assertTrue(self.sync.synchronize.called)
+
+    def _run_apply_events_once(self, driver, incremental, deletes):
+        self.eventlet.sleep.side_effect = [None, _Stop()]
+        self.watcher.pop_events.side_effect = \
+            lambda event_types: incremental \
+            if event_types == INCREMENTAL_EVENTS else deletes
+        self.assertRaises(_Stop, driver._bcf_apply_events)
+
+    def test_bcf_apply_events(self):
+        driver = self._setup_driver()
+        incremental = [{'event_type': EVENT_NETWORK_CREATE}]
+        deletes = [{'event_type': EVENT_NETWORK_DELETE}]
+
+        self._run_apply_events_once(driver, incremental, deletes)
+        self.watcher.flush.assert_called_once_with()
+        self.sync.apply_events.assert_called_once_with(incremental)
+        self.sync.synchronize_events.assert_called_once_with(deletes)
+        self.assertEqual([((incremental,),), ((deletes,),)],
+                         self.watcher.ack.call_args_list)
+        self.assertFalse(self.scheduler.notify.called)
+
+    def test_bcf_apply_events_with_errors(self):
+        driver = self._setup_driver()
+        incremental = [{'event_type': EVENT_NETWORK_CREATE}]
+        deletes = [{'event_type': EVENT_NETWORK_DELETE}]
+        self.sync.apply_events.side_effect = ValueError
+
+        # The full synchronization adds them.
+        self._run_apply_events_once(driver, incremental, deletes)
+        self.watcher.ack.assert_called_once_with(incremental)
+        self.assertFalse(self.sync.synchronize_events.called)
+        self.assertEqual(1, self.scheduler.notify.call_count)
+
+        self.sync.apply_events.side_effect = None
+        self.sync.synchronize_events.side_effect = ValueError
+        self._run_apply_events_once(driver, [], deletes)
+        self.watcher.requeue.assert_called_once_with(deletes)
+        self.assertEqual(2, self.scheduler.notify.call_count)
+
+    def test_bcf_apply_events_as_follower(self):
+        driver = self._setup_driver()
+        self.elector.is_leader = False
+        self._run_apply_events_once(driver, [], [])
+        self.assertFalse(self.watcher.pop_events.called)
@@ -0,0 +1,61 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import patch
+from networking_bigswitch_l3_pe.lib.checkpoint import Checkpoint
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+from neutron.tests import base
+import os
+import shutil
+import tempfile
+
+
+class CheckpointTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(CheckpointTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.checkpoint = Checkpoint(os.path.join(self.tmpdir, 'ckpt'),
+                                     max_age=60)
+        self.addCleanup(self.checkpoint.close)
+        self.plan = SyncPlan()
+        self.plan.create_network({'project_name': 't1',
+                                  'segment_name': 'n1'})
+        self.plan.create_network({'project_name': 't2',
+                                  'segment_name': 'n2'})
+
+    def test_load(self):
+        self.assertIsNone(self.checkpoint.load())
+        self.checkpoint.begin(self.plan)
+        self.checkpoint.applied(self.plan.operations[1])
+        with open(self.checkpoint.path, 'a') as f:
+            f.write('{"appl')
+
+        plan, applied = self.checkpoint.load()
+        self.assertEqual(self.plan.operations, plan.operations)
+        self.assertEqual(set([1]), applied)
+
+        self.checkpoint.finish()
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_discard_old_or_broken(self):
+        self.checkpoint.begin(self.plan)
+        with patch('time.time', return_value=os.path.getmtime(
+                self.checkpoint.path) + 61):
+            self.assertIsNone(self.checkpoint.load())
+
+        with open(self.checkpoint.path, 'w') as f:
+            f.write('{"created_at": 0, "pl')
+        self.assertIsNone(self.checkpoint.load())
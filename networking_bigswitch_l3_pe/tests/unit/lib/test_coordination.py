@@ -0,0 +1,99 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+from networking_bigswitch_l3_pe.lib.coordination import FileLockBackend
+from networking_bigswitch_l3_pe.lib.coordination import get_lock_backend
+from networking_bigswitch_l3_pe.lib.coordination import LeaderElector
+from networking_bigswitch_l3_pe.lib.coordination import LocalLockBackend
+from neutron.tests import base
+import os
+import shutil
+import tempfile
+
+
+class LockBackendTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(LockBackendTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def _test_lease(self, backend):
+        with patch('time.time', return_value=100):
+            self.assertTrue(backend.acquire('a', 30))
+            self.assertFalse(backend.acquire('b', 30))
+        with patch('time.time', return_value=120):
+            self.assertTrue(backend.acquire('a', 30))
+        with patch('time.time', return_value=149):
+            self.assertFalse(backend.acquire('b', 30))
+        with patch('time.time', return_value=150):
+            # expired
+            self.assertTrue(backend.acquire('b', 30))
+            self.assertFalse(backend.acquire('a', 30))
+            backend.release('a')
+            self.assertFalse(backend.acquire('a', 30))
+            backend.release('b')
+            self.assertTrue(backend.acquire('a', 30))
+
+    def test_file(self):
+        path = os.path.join(self.tmpdir, 'leader')
+        self._test_lease(FileLockBackend(path))
+
+    def test_local(self):
+        backend = LocalLockBackend(self.id())
+        self.addCleanup(backend.release, 'a')
+        self._test_lease(backend)
+
+    def test_get_lock_backend(self):
+        conf = Mock(coordination_backend='file',
+                    coordination_lock_file=os.path.join(self.tmpdir,
+                                                        'leader'))
+        self.assertIsInstance(get_lock_backend(conf), FileLockBackend)
+
+        conf.coordination_lock_file = os.path.join(self.tmpdir, 'no', 'dir')
+        self.assertIsInstance(get_lock_backend(conf), LocalLockBackend)
+
+
+class LeaderElectorTestCase(base.BaseTestCase):
+
+    def test_failover(self):
+        backend = LocalLockBackend(self.id())
+        e1 = LeaderElector(backend, owner='e1', ttl=30)
+        e2 = LeaderElector(backend, owner='e2', ttl=30)
+        self.addCleanup(e1.release)
+        self.addCleanup(e2.release)
+
+        with patch('time.time', return_value=100):
+            self.assertTrue(e1.heartbeat())
+            self.assertFalse(e2.heartbeat())
+        with patch('time.time', return_value=131):
+            # e1 stopped renewing its lease
+            self.assertFalse(e1.is_leader)
+            self.assertTrue(e2.heartbeat())
+            self.assertFalse(e1.heartbeat())
+
+    def test_backend_error(self):
+        backend = Mock()
+        backend.acquire.return_value = True
+        elector = LeaderElector(backend, ttl=30)
+        with patch('time.time', return_value=100):
+            self.assertTrue(elector.heartbeat())
+        backend.acquire.side_effect = IOError()
+        with patch('time.time', return_value=120):
+            # until the lease expires
+            self.assertTrue(elector.heartbeat())
+        with patch('time.time', return_value=130):
+            self.assertFalse(elector.heartbeat())
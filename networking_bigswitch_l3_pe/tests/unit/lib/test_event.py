@@ -0,0 +1,211 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+from networking_bigswitch_l3_pe.lib import event
+from networking_bigswitch_l3_pe.lib.event import EventQueue
+from networking_bigswitch_l3_pe.lib.event import EventWatcher
+from networking_bigswitch_l3_pe.lib.event_journal import EventJournal
+from neutron.tests import base
+import os
+import shutil
+import tempfile
+
+
+def _event(event_type, segment_name, gateway_ip=None):
+    payload = {'project_name': 'project1.neutron',
+               'segment_name': segment_name}
+    if gateway_ip:
+        payload['current_gateway_ip'] = gateway_ip
+    return {'event_type': event_type, 'payload': payload}
+
+
+class EventQueueTestCase(base.BaseTestCase):
+
+    def test_pop_in_received_order(self):
+        queue = EventQueue()
+        events = [_event('create_network', 'net1'),
+                  _event('delete_network', 'net2'),
+                  _event('create_subnet', 'net1', '10.0.1.1/24'),
+                  _event('delete_subnet', 'net2', '10.0.2.1/24')]
+        queue.extend(events)
+        self.assertEqual(events, list(queue))
+
+        self.assertEqual([events[1], events[3]],
+                         queue.pop(event.DELETE_EVENTS))
+        self.assertEqual(2, len(queue))
+        self.assertEqual([events[0], events[2]], queue.pop())
+        self.assertEqual([], queue.pop())
+        self.assertEqual(0, len(queue))
+
+    def test_coalesce(self):
+        queue = EventQueue()
+        self.assertTrue(queue.append(_event('delete_network', 'net1')))
+        self.assertFalse(queue.append(_event('delete_network', 'net1')))
+        self.assertTrue(queue.append(_event('create_network', 'net1')))
+        self.assertTrue(queue.append(
+            _event('delete_subnet', 'net1', '10.0.1.1/24')))
+        self.assertFalse(queue.append(
+            _event('delete_subnet', 'net1', '10.0.1.1/24')))
+        self.assertEqual(3, len(queue))
+        self.assertEqual(2, queue.coalesced)
+
+    def test_drop_oldest(self):
+        queue = EventQueue(capacity=2)
+        events = [_event('create_network', 'net1'),
+                  _event('delete_network', 'net2'),
+                  _event('create_network', 'net3')]
+        queue.extend(events)
+        self.assertEqual(events[1:], queue.pop())
+        self.assertEqual(1, queue.dropped)
+
+    def test_drop_newest(self):
+        queue = EventQueue(capacity=2, overflow=event.OVERFLOW_DROP_NEWEST)
+        events = [_event('create_network', 'net1'),
+                  _event('delete_network', 'net2')]
+        queue.extend(events)
+        self.assertFalse(queue.append(_event('create_network', 'net3')))
+        self.assertEqual(events, queue.pop())
+        self.assertEqual(1, queue.dropped)
+
+    def test_invalid_overflow(self):
+        self.assertRaises(ValueError, EventQueue, overflow='block')
+
+    def test_payload_key(self):
+        e = _event('delete_subnet', 'net1', '10.0.1.1/24')
+        self.assertEqual(event.payload_key(dict(e['payload'])),
+                         event.payload_key(e['payload']))
+        self.assertNotEqual(
+            event.payload_key(_event('delete_network', 'net1')['payload']),
+            event.payload_key(e['payload']))
+
+
+class EventWatcherTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(EventWatcherTestCase, self).setUp()
+        patcher = patch.object(event, 'oslo_messaging')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'journal')
+
+    def _watcher(self):
+        journal = EventJournal(self.path)
+        self.addCleanup(journal.close)
+        return EventWatcher(journal=journal)
+
+    def test_forward_to_leader(self):
+        notifier = Mock()
+        watcher = EventWatcher(notifier=notifier)
+        e1 = _event('delete_network', 'net1')
+        watcher.receive(e1)
+        notifier.forward.assert_called_once_with(e1)
+        self.assertEqual(0, len(watcher.events))
+
+        journal = EventJournal(self.path)
+        self.addCleanup(journal.close)
+        watcher.start_leading(journal)
+        self.assertTrue(watcher.leader_server.start.called)
+        e2 = _event('delete_network', 'net2')
+        e3 = _event('delete_network', 'net3')
+        watcher.receive(e2)
+        watcher.receive(e3)
+        self.assertEqual([e2], watcher.pop_events()[:1])
+
+        notifier.reset_mock()
+        watcher.stop_leading()
+        self.assertEqual([((e2,),), ((e3,),)],
+                         notifier.forward.call_args_list)
+        self.assertIsNone(watcher.journal)
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_forward_journal(self):
+        leader = self._watcher()
+        events = [_event('delete_network', 'net1'),
+                  _event('delete_network', 'net2')]
+        for e in events:
+            leader.receive(e)
+        # crashed
+        leader.journal.close()
+
+        notifier = Mock()
+        follower = EventWatcher(notifier=notifier)
+        follower.forward_journal(EventJournal(self.path))
+        self.assertEqual([((e,),) for e in events],
+                         notifier.forward.call_args_list)
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_replay_unacked_events(self):
+        watcher = self._watcher()
+        events = [_event('delete_network', 'net1'),
+                  _event('delete_network', 'net2'),
+                  _event('create_network', 'net3')]
+        for e in events:
+            watcher.receive(e)
+        watcher.receive(events[0])
+
+        self.assertEqual(events[:2], watcher.pop_events(event.DELETE_EVENTS))
+        watcher.ack(events[:1])
+        watcher.requeue(events[1:2])
+        watcher.flush()
+        watcher.journal.close()
+
+        watcher = self._watcher()
+        self.assertEqual(events[1:], list(watcher.events))
+
+    def test_ack_only_popped_record(self):
+        watcher = self._watcher()
+        e = _event('delete_network', 'net1')
+        watcher.receive(e)
+        popped = watcher.pop_events()
+        # deleted again while the first one is applied
+        watcher.receive(_event('delete_network', 'net1'))
+        watcher.ack(popped)
+        watcher.journal.close()
+
+        watcher = self._watcher()
+        self.assertEqual([e], list(watcher.events))
+
+    def test_requeue_received_again(self):
+        watcher = self._watcher()
+        e = _event('delete_network', 'net1')
+        watcher.receive(e)
+        popped = watcher.pop_events()
+        watcher.receive(_event('delete_network', 'net1'))
+        watcher.requeue(popped)
+        self.assertEqual([e], list(watcher.events))
+        watcher.ack(watcher.pop_events())
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_truncate_when_all_acked(self):
+        watcher = self._watcher()
+        e = _event('delete_network', 'net1')
+        watcher.receive(e)
+        watcher.ack(watcher.pop_events())
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_request_sync(self):
+        notifier = Mock()
+        watcher = EventWatcher(notifier=notifier)
+        watcher.on_sync_request = Mock()
+        watcher.request_sync()
+        notifier.request_sync.assert_called_once_with()
+
+        watcher.start_leading()
+        watcher.request_sync()
+        watcher.on_sync_request.assert_called_once_with()
+        self.assertEqual(1, notifier.request_sync.call_count)
@@ -0,0 +1,95 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import patch
+from networking_bigswitch_l3_pe.lib.event_journal import EventJournal
+from neutron.tests import base
+import os
+import shutil
+import tempfile
+import time
+
+
+def _event(segment_name):
+    return {'event_type': 'delete_network',
+            'payload': {'project_name': 'project1.neutron',
+                        'segment_name': segment_name}}
+
+
+class EventJournalTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(EventJournalTestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'journal')
+
+    def _journal(self, **kwargs):
+        journal = EventJournal(self.path, **kwargs)
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_replay(self):
+        journal = self._journal()
+        self.assertEqual(1, journal.append(_event('net1')))
+        self.assertEqual(2, journal.append(_event('net2')))
+        self.assertEqual(3, journal.append(_event('net1')))
+        journal.ack([1])
+        journal.close()
+
+        with open(self.path, 'a') as f:
+            f.write('{"id": 4, "event": {"event_type": "delete_')
+        journal = self._journal()
+        self.assertEqual([(2, _event('net2')), (3, _event('net1'))],
+                         journal.replay())
+        # ids aren't reused
+        self.assertEqual(4, journal.append(_event('net3')))
+
+    def test_batch_fsync(self):
+        journal = self._journal(sync_interval=60)
+        with patch('os.fsync') as fsync:
+            journal.append(_event('net1'))
+            journal.append(_event('net2'))
+            self.assertFalse(fsync.called)
+            journal.sync()
+            self.assertEqual(1, fsync.call_count)
+            journal.sync()
+            self.assertEqual(1, fsync.call_count)
+
+    def test_fsync_by_timer(self):
+        journal = self._journal(sync_interval=0.01)
+        with patch('os.fsync') as fsync:
+            journal.append(_event('net1'))
+            for i in range(100):
+                if fsync.called:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(1, fsync.call_count)
+
+    def test_compact(self):
+        journal = self._journal(max_size=150)
+        journal.append(_event('net1'))
+        self.assertFalse(journal.needs_compaction())
+        record_id = journal.append(_event('net2'))
+        self.assertTrue(journal.needs_compaction())
+
+        journal.compact([(record_id, _event('net2'))])
+        self.assertFalse(journal.needs_compaction())
+        journal.append(_event('net3'))
+        self.assertEqual([(2, _event('net2')), (3, _event('net3'))],
+                         journal.replay())
+
+    def test_lock(self):
+        self._journal()
+        self.assertRaises(IOError, EventJournal, self.path)
@@ -0,0 +1,72 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+from networking_bigswitch_l3_pe.lib.keystone_client import ProjectNameCache
+from neutron.tests import base
+
+
+@patch('networking_bigswitch_l3_pe.lib.keystone_client.time')
+class ProjectNameCacheTestCase(base.BaseTestCase):
+
+    def _setup_cache(self, max_size=10):
+        client = Mock()
+        client.get_projects.return_value = {'p1': 'project1',
+                                            'p2': 'project2'}
+        client.get_project_name.side_effect = \
+            lambda i: {'p1': 'project1', 'p3': 'project3'}.get(i)
+        return ProjectNameCache(client, ttl=300, max_size=max_size)
+
+    def test_get_projects(self, mock_time):
+        mock_time.time.return_value = 100.0
+        cache = self._setup_cache()
+
+        self.assertEqual({'p1': 'project1', 'p2': 'project2'},
+                         cache.get_projects())
+        self.assertEqual({'p1': 'project1', 'p2': 'project2'},
+                         cache.get_projects())
+        self.assertEqual(1, cache.keystone_client.get_projects.call_count)
+
+        mock_time.time.return_value = 401.0
+        cache.get_projects()
+        self.assertEqual(2, cache.keystone_client.get_projects.call_count)
+
+    def test_get_name(self, mock_time):
+        mock_time.time.return_value = 100.0
+        cache = self._setup_cache()
+
+        cache.get_projects()
+        self.assertEqual('project2', cache.get_name('p2'))
+        self.assertEqual('project3', cache.get_name('p3'))
+        self.assertEqual('project3', cache.get_name('p3'))
+        self.assertEqual(1, cache.keystone_client.get_project_name.call_count)
+
+    def test_get_name_of_unknown_project(self, mock_time):
+        mock_time.time.return_value = 100.0
+        cache = self._setup_cache()
+
+        cache.get_projects()
+        mock_time.time.return_value = 500.0
+        self.assertIsNone(cache.get_name('p2'))
+        self.assertNotIn('p2', cache.names)
+        self.assertIsNone(cache.listed_at)
+
+    def test_bounded_size(self, mock_time):
+        mock_time.time.return_value = 100.0
+        cache = self._setup_cache(max_size=1)
+
+        cache.get_projects()
+        self.assertEqual(1, len(cache.names))
+        self.assertIsNone(cache.listed_at)
@@ -0,0 +1,131 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from networking_bigswitch_l3_pe.lib import metrics
+from neutron.tests import base
+import os
+import shutil
+import tempfile
+import threading
+
+
+class MetricsTestCase(base.BaseTestCase):
+
+    def _metrics(self, sink=None):
+        m = metrics.Metrics(sink)
+        m.start_cycle()
+        with m.phase('bcf_fetch'):
+            pass
+        m.count('network', 'fetched', 3)
+        m.observe_rest('GET', '/tenant[name="t1"]/logical-router', 200, 0.02)
+        m.observe_rest('GET', '/tenant[name="t2"]/logical-router', 500, 2.0)
+        m.observe_rest('PUT', '/tenant[name="t1"]', None, 0.1)
+        return m
+
+    def test_path_template(self):
+        self.assertEqual(
+            '/tenant[name]/logical-router/segment-interface[segment]',
+            metrics.path_template('/tenant[name="t1"]/logical-router'
+                                  '/segment-interface[segment="n-1"]'))
+
+    def test_observe_rest(self):
+        m = self._metrics()
+        h = m.rest_latency[('GET', '/tenant[name]/logical-router')]
+        self.assertEqual(2, h.count)
+        self.assertEqual(
+            {('GET', '/tenant[name]/logical-router', '500'): 1,
+             ('PUT', '/tenant[name]', 'none'): 1}, m.rest_errors)
+
+    def test_finish_cycle_ignores_sink_error(self):
+        sink = Mock()
+        sink.emit.side_effect = IOError()
+        m = self._metrics(sink)
+        m.finish_cycle('full', True)
+        self.assertEqual({('full', 'success'): 1}, m.syncs)
+        self.assertIn('full', m.last_success)
+
+    def test_cycles_per_kind(self):
+        m = self._metrics()
+        m.finish_cycle('full', True)
+        m.start_cycle()
+        with m.phase('apply'):
+            pass
+        m.finish_cycle('incremental', False)
+
+        self.assertEqual({('network', 'fetched'): 3},
+                         m.cycles['full']['objects'])
+        self.assertEqual(['bcf_fetch'], list(m.cycles['full']['phases']))
+        self.assertEqual(['apply'], list(m.cycles['incremental']['phases']))
+        self.assertEqual(['full'], list(m.last_success))
+
+    def test_cycles_per_thread(self):
+        m = self._metrics()
+
+        def _other_cycle():
+            m.start_cycle()
+            m.count('subnet', 'fetched', 1)
+            m.finish_cycle('incremental', True)
+        t = threading.Thread(target=_other_cycle)
+        t.start()
+        t.join()
+
+        self.assertEqual({('network', 'fetched'): 3}, m.objects)
+        self.assertEqual({('subnet', 'fetched'): 1},
+                         m.cycles['incremental']['objects'])
+
+    def test_prometheus_textfile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'sync.prom')
+        m = self._metrics(metrics.PrometheusTextfileSink(path))
+        m.finish_cycle('full', False)
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('bcf_l3_pe_sync_total{kind="full",result="failure"} 1',
+                      lines)
+        self.assertIn('bcf_l3_pe_sync_objects{kind="full",object="network",'
+                      'stage="fetched"} 3', lines)
+        self.assertTrue([l for l in lines if l.startswith(
+            'bcf_l3_pe_sync_phase_seconds{kind="full",phase="bcf_fetch"}')])
+        self.assertIn('bcf_l3_pe_rest_request_seconds_bucket{'
+                      'le="0.025",path="/tenant[name]/logical-router",'
+                      'verb="GET"} 1', lines)
+        self.assertIn('bcf_l3_pe_rest_request_seconds_count{'
+                      'path="/tenant[name]/logical-router",verb="GET"} 2',
+                      lines)
+        self.assertIn('bcf_l3_pe_rest_errors_total{code="500",'
+                      'path="/tenant[name]/logical-router",verb="GET"} 1',
+                      lines)
+        self.assertEqual(['sync.prom'], os.listdir(tmpdir))
+
+    def test_statsd_sends_deltas(self):
+        sink = metrics.StatsdSink()
+        m = self._metrics()
+        m.finish_cycle('full', True)
+        lines = sink.render(m)
+        self.assertIn('bcf_l3_pe.rest.GET.tenant_name_logical-router.'
+                      'requests:2|c', lines)
+        self.assertIn('bcf_l3_pe.rest.GET.tenant_name_logical-router.'
+                      'latency:1010|ms', lines)
+        self.assertIn('bcf_l3_pe.sync.full.objects.network.fetched:3|g',
+                      lines)
+
+        m.observe_rest('GET', '/tenant[name="t3"]/logical-router', 200, 0.01)
+        lines = sink.render(m)
+        self.assertIn('bcf_l3_pe.rest.GET.tenant_name_logical-router.'
+                      'requests:1|c', lines)
+        self.assertFalse([l for l in lines if 'errors' in l])
+        self.assertFalse([l for l in lines if '.sync.' in l])
@@ -0,0 +1,60 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import patch
+from networking_bigswitch_l3_pe.lib.rate_limiter import RateLimiter
+from neutron.tests import base
+
+
+@patch('networking_bigswitch_l3_pe.lib.rate_limiter.time')
+class RateLimiterTestCase(base.BaseTestCase):
+
+    def test_acquire_within_burst(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(rate=2.0, burst=3)
+
+        for i in range(3):
+            limiter.acquire()
+        self.assertFalse(mock_time.sleep.called)
+
+    def test_acquire_over_burst(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(rate=2.0, burst=1)
+
+        limiter.acquire()
+        limiter.acquire()
+        mock_time.sleep.assert_called_once_with(0.5)
+        limiter.acquire()
+        mock_time.sleep.assert_called_with(1.0)
+
+    def test_refill(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(rate=2.0, burst=1)
+
+        limiter.acquire()
+        mock_time.time.return_value = 100.5
+        limiter.acquire()
+        self.assertFalse(mock_time.sleep.called)
+
+    def test_adapt_rate(self, mock_time):
+        mock_time.time.return_value = 100.0
+        limiter = RateLimiter(rate=2.0, min_rate=1.0, max_rate=2.1,
+                              latency_target=1.0)
+
+        limiter.success(0.1)
+        self.assertEqual(2.1, limiter.rate)
+        limiter.success(2.0)
+        self.assertAlmostEqual(1.68, limiter.rate)
+        limiter.failure()
+        self.assertEqual(1.0, limiter.rate)
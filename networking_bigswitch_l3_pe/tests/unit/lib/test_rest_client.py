@@ -12,12 +12,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
 from mock import Mock
 from mock import patch
 import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib import rest_client
 from networking_bigswitch_l3_pe.lib.rest_client import BCFRestError
+from networking_bigswitch_l3_pe.lib.rest_client import compact_tenant
+from networking_bigswitch_l3_pe.lib.rest_client import iter_json_array
 from networking_bigswitch_l3_pe.lib.rest_client import RestClient
+from networking_bigswitch_l3_pe.tests.fake_bcf import FakeBCFController
 from neutron.tests import base
+import six
 
 
 class RestClientTestCase(base.BaseTestCase):
@@ -28,71 +34,330 @@ class RestClientTestCase(base.BaseTestCase):
 
     def _setup_mock(self, code, responses):
         ret = Mock()
-        ret.code = code
-        ret.read.side_effect = ['{"session_cookie": "dummy"}'] + responses
+        response = ret.getresponse.return_value
+        response.status = code
+        response.will_close = False
+        response.read.side_effect = ['{"session_cookie": "dummy"}'] + responses
         return ret
 
     def _setup_rest_client(self):
         return RestClient('http://127.0.0.1/', 'admin', 'password')
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_get_segment_interface(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200, ['[]'])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_get_segment_interface(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, ['[]'])
         client = self._setup_rest_client()
 
         ret = client._get_segment_interface('tenant_test')
         self.assertEqual([], ret)
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_create_net(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200,
-                                                     ['[]', '[]', '[]', '[]'])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_create_net(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200,
+                                                  ['[]', '[]', '[]', '[]'])
         client = self._setup_rest_client()
 
         ret = client.create_net('tenant_test', 'net_test')
         self.assertTrue(ret)
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_create_net_with_wrong_code(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200, [])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_create_net_with_wrong_code(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, [])
         client = self._setup_rest_client()
 
-        mock_urlopen.return_value.code = 400
-        mock_urlopen.return_value.read.side_effect = ['[]']
+        response = mock_conn.return_value.getresponse.return_value
+        response.status = 400
+        response.read.side_effect = ['[]']
         self.assertRaises(BCFRestError,
                           client.create_net, 'tenant_test', 'net_test')
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_create_subnet(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200, ['[]'])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_create_subnet(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, ['[]'])
         client = self._setup_rest_client()
 
         ret = client.create_subnet('tenant_test',
                                    'net_test', '192.168.0.254/24')
         self.assertTrue(ret)
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_delete_subnet(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200, ['[]'])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_delete_subnet(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, ['[]'])
         client = self._setup_rest_client()
 
         ret = client.delete_subnet('tenant_test',
                                    'net_test', '192.168.0.254/24')
         self.assertTrue(ret)
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_delete_net(self, mock_urlopen):
-        mock_urlopen.return_value =\
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_delete_net(self, mock_conn):
+        mock_conn.return_value =\
             self._setup_mock(200, ['[]', '[]', '[]', '[]', '[]'])
         client = self._setup_rest_client()
 
         ret = client.delete_net('tenant_test', 'net_test')
         self.assertTrue(ret)
 
-    @patch('networking_bigswitch_l3_pe.lib.rest_client.urllib2.urlopen')
-    def test_delete_net_when_other_net_remain(self, mock_urlopen):
-        mock_urlopen.return_value = self._setup_mock(200, ['[]', '[{}]'])
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_delete_net_when_other_net_remain(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, ['[]', '[{}]'])
         client = self._setup_rest_client()
 
         ret = client.delete_net('tenant_test', 'net_test')
         self.assertTrue(ret)
+
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_reuse_connection(self, mock_conn):
+        mock_conn.return_value = self._setup_mock(200, ['[]', '[]'])
+        client = self._setup_rest_client()
+
+        client.create_subnet('tenant_test', 'net_test', '192.168.0.254/24')
+        client.delete_subnet('tenant_test', 'net_test', '192.168.0.254/24')
+        self.assertEqual(1, mock_conn.call_count)
+        self.assertEqual(3, mock_conn.return_value.request.call_count)
+
+    def _setup_response(self, code, result):
+        ret = Mock()
+        ret.status = code
+        ret.will_close = False
+        ret.read.return_value = result
+        return ret
+
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_renew_session_when_rejected(self, mock_conn):
+        login = '{"session_cookie": "dummy"}'
+        mock_conn.return_value.getresponse.side_effect = [
+            self._setup_response(200, login),
+            self._setup_response(401, '{}'),
+            self._setup_response(200, login),
+            self._setup_response(200, '[]'),
+        ]
+        client = self._setup_rest_client()
+
+        ret = client._get_segment_interface('tenant_test')
+        self.assertEqual([], ret)
+        self.assertEqual(4, mock_conn.return_value.request.call_count)
+
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_renew_session_only_once(self, mock_conn):
+        login = '{"session_cookie": "dummy"}'
+        mock_conn.return_value.getresponse.side_effect = [
+            self._setup_response(200, login),
+            self._setup_response(403, '{}'),
+            self._setup_response(200, login),
+            self._setup_response(403, '{}'),
+        ]
+        client = self._setup_rest_client()
+
+        self.assertRaises(BCFRestError,
+                          client._get_segment_interface, 'tenant_test')
+
+    def test_iter_json_array(self):
+        tenants = [{'name': 't%d' % i, 'logical-router': {
+            'segment-interface': [{'segment': u'net\u3042', 'ip-subnet': [
+                {'ip-cidr': '10.0.%d.1/24' % i}]}]}} for i in range(20)]
+        body = json.dumps(tenants, indent=2)
+        for chunk_size in (1, 7, 64, 65536):
+            ret = list(iter_json_array(six.BytesIO(body), chunk_size))
+            self.assertEqual(tenants, ret)
+
+        self.assertEqual([], list(iter_json_array(six.BytesIO(' [ ] '))))
+        self.assertEqual([12, 3], list(iter_json_array(six.BytesIO('[12,3]'),
+                                                       1)))
+        self.assertRaises(ValueError, list,
+                          iter_json_array(six.BytesIO('[{"a": 1}, {"b"'), 4))
+        self.assertRaises(ValueError, list,
+                          iter_json_array(six.BytesIO('{"a": 1}')))
+
+    def test_compact_tenant(self):
+        tenant = {
+            'name': 't1',
+            'origination': 'neutron',
+            'logical-router': {
+                'tenant-interface': [{'remote-tenant': 'system',
+                                      'shutdown': False}],
+                'segment-interface': [
+                    {'segment': 'net1', 'ip-subnet': [
+                        {'ip-cidr': '10.0.0.1/24', 'private': False}]},
+                    {'segment': 'net2'},
+                ],
+                'static-route': [{'dst-ip-subnet': '0.0.0.0/0'}],
+            },
+        }
+        self.assertEqual({
+            'name': 't1',
+            'logical-router': {
+                'tenant-interface': [{'remote-tenant': 'system'}],
+                'segment-interface': [
+                    {'segment': 'net1', 'ip-subnet': [
+                        {'ip-cidr': '10.0.0.1/24'}]},
+                    {'segment': 'net2'},
+                ],
+                'static-route': [{'dst-ip-subnet': '0.0.0.0/0'}],
+            },
+        }, compact_tenant(tenant))
+        self.assertEqual({'name': 't2'}, compact_tenant({'name': 't2'}))
+
+    @patch('networking_bigswitch_l3_pe.lib.connection_pool.ConnectionPool.'
+           '_new_connection')
+    def test_get_tenants(self, mock_conn):
+        body = six.BytesIO(json.dumps([{'name': 't1', 'origination': 'n'}]))
+        tenants = self._setup_response(200, None)
+        tenants.read.side_effect = body.read
+        mock_conn.return_value.getresponse.side_effect = [
+            self._setup_response(200, '{"session_cookie": "dummy"}'),
+            tenants,
+        ]
+        client = self._setup_rest_client()
+
+        self.assertEqual([{'name': 't1'}], client.get_tenants('n'))
+
+
+class RestClientFakeBCFTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(RestClientFakeBCFTestCase, self).setUp()
+        networking_bigswitch_l3_pe.lib.config.register_config()
+        self.controller = FakeBCFController(neutron_id='neutron')
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        self.client = RestClient(self.controller.api_url, 'admin', 'password')
+
+    def test_create_and_delete_net(self):
+        self.client.create_net('t1.neutron', 'net1')
+        self.client.create_subnet('t1.neutron', 'net1', '10.0.0.1/24')
+        self.client.update_subnet('t1.neutron', 'net1',
+                                  '10.0.0.1/24', '10.0.1.1/24')
+
+        tenants = self.client.get_tenants('neutron')
+        self.assertEqual(['t1.neutron'], [t['name'] for t in tenants])
+        self.assertEqual(
+            [{'segment': 'net1', 'ip-subnet': [{'ip-cidr': '10.0.1.1/24'}]}],
+            tenants[0]['logical-router']['segment-interface'])
+        self.assertEqual(
+            [{'remote-tenant': 't1.neutron'}],
+            self.client.get_system_tenant_interfaces('neutron'))
+
+        self.client.delete_subnet('t1.neutron', 'net1', '10.0.1.1/24')
+        self.client.delete_net('t1.neutron', 'net1')
+        tenants = self.client.get_tenants('neutron')
+        self.assertEqual({'tenant-interface': [], 'segment-interface': [],
+                          'static-route': []},
+                         tenants[0]['logical-router'])
+        self.assertEqual([],
+                         self.client.get_system_tenant_interfaces('neutron'))
+
+    def test_create_net_with_existing_tenant_objects(self):
+        self.client.create_net('t1.neutron', 'net1')
+        del self.controller.requests[:]
+
+        self.client.create_net('t1.neutron', 'net2',
+                               existing=rest_client.TENANT_OBJECTS)
+        self.assertEqual(
+            [('PUT', rest_client.SEGMENT_IF_PATH.format(
+                tenant='t1.neutron', segment='net2'))],
+            self.controller.requests)
+
+        self.client.create_net('t1.neutron', 'net3',
+                               existing=[rest_client.STATIC_ROUTE])
+        self.assertEqual(4, len(self.controller.requests))
+
+    def test_create_net_in_bulk(self):
+        self.client.bulk = True
+        self.client.create_net('t1.neutron', 'net1',
+                               ip_cidrs=['10.0.0.1/24', '10.0.1.1/24'])
+        self.client.create_net('t1.neutron', 'net2',
+                               existing=rest_client.TENANT_OBJECTS)
+
+        self.assertEqual(
+            ['PUT', 'PATCH', 'PATCH'],
+            [verb for verb, path in self.controller.requests
+             if path.startswith(rest_client.BASE_PATH)])
+        router = self.client.get_tenants('neutron')[0]['logical-router']
+        self.assertEqual([{'remote-tenant': 'system'}],
+                         router['tenant-interface'])
+        self.assertEqual([rest_client.DEFAULT_ROUTE],
+                         [r['dst-ip-subnet'] for r in router['static-route']])
+        self.assertEqual(
+            [{'segment': 'net1', 'ip-subnet': [{'ip-cidr': '10.0.0.1/24'},
+                                               {'ip-cidr': '10.0.1.1/24'}]},
+             {'segment': 'net2'}],
+            router['segment-interface'])
+
+    def test_create_net_in_bulk_rejected(self):
+        self.controller.patch_router = False
+        self.client.bulk = True
+        self.client.create_net('t1.neutron', 'net1',
+                               ip_cidrs=['10.0.0.1/24'])
+        self.assertFalse(self.client.bulk)
+        router = self.client.get_tenants('neutron')[0]['logical-router']
+        self.assertEqual(
+            [{'segment': 'net1', 'ip-subnet': [{'ip-cidr': '10.0.0.1/24'}]}],
+            router['segment-interface'])
+
+        del self.controller.requests[:]
+        self.client.create_net('t1.neutron', 'net2',
+                               existing=rest_client.TENANT_OBJECTS)
+        self.assertEqual(['PUT'], [verb for verb, path
+                                   in self.controller.requests])
+
+    def test_get_tenants_by_name(self):
+        self.client.create_net('t1.neutron', 'net1')
+        self.client.create_net('t2.neutron', 'net2')
+        self.client.create_net('t3.other', 'net3')
+        self.controller.state.tenants['t3.other']['origination'] = 'other'
+        del self.controller.requests[:]
+
+        tenants = self.client.get_tenants(
+            'neutron', tenant_names=['t2.neutron', 't3.other', 't4.neutron'])
+        self.assertEqual(['t2.neutron'], [t['name'] for t in tenants])
+        self.assertEqual(
+            [{'remote-tenant': 't2.neutron'}],
+            self.client.get_system_tenant_interfaces(
+                'neutron', tenant_names=['t2.neutron', 't4.neutron']))
+        self.assertFalse([r for r in self.controller.requests
+                          if 'origination' in r[1] or
+                          r[1].endswith('/tenant-interface')])
+
+    def test_reuse_connection(self):
+        for i in range(10):
+            self.client.create_net('t1.neutron', 'net%d' % i)
+        self.assertEqual(1, self.controller.connections)
+
+    def test_reuse_connection_after_partial_read(self):
+        self.client.create_net('t1.neutron', 'net1')
+        self.client.create_net('t2.neutron', 'net2')
+        code, ret = self.client.rest_call(
+            rest_client.TENANTS_PATH.format(neutron_id='neutron'),
+            json.dumps({}), reader=lambda r: r.read(1))
+        self.assertEqual('[', ret)
+        self.client.create_net('t3.neutron', 'net3')
+        self.assertEqual(1, self.controller.connections)
+
+    def test_renew_expired_session(self):
+        self.controller.expire_sessions()
+        self.client.create_net('t1.neutron', 'net1')
+        self.assertEqual(2, len([r for r in self.controller.requests
+                                 if r[1] == '/auth/login']))
+
+    def test_injected_error(self):
+        self.controller.fail_next(1, code=503)
+        e = self.assertRaises(BCFRestError,
+                              self.client.create_net, 't1.neutron', 'net1')
+        self.assertEqual(503, e.code)
+
+    def test_rate_limited(self):
+        self.controller.max_rate = 3
+        e = self.assertRaises(BCFRestError,
+                              self.client.create_net, 't1.neutron', 'net1')
+        self.assertEqual(429, e.code)
@@ -0,0 +1,87 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+from networking_bigswitch_l3_pe.lib.exceptions import BCFRestError
+from networking_bigswitch_l3_pe.lib.exceptions import CircuitOpen
+from networking_bigswitch_l3_pe.lib import retry
+from neutron.tests import base
+import socket
+
+
+def _rest_error(code):
+    return BCFRestError(code=code, result='', method='PUT', url='', data='')
+
+
+class RetryPolicyTestCase(base.BaseTestCase):
+
+    def test_is_transient(self):
+        self.assertTrue(retry.is_transient(_rest_error(503)))
+        self.assertTrue(retry.is_transient(_rest_error(None)))
+        self.assertTrue(retry.is_transient(socket.error()))
+        self.assertFalse(retry.is_transient(_rest_error(400)))
+        self.assertFalse(retry.is_transient(ValueError()))
+
+    @patch('time.sleep')
+    def test_backoff(self, sleep):
+        func = Mock(side_effect=[_rest_error(503), socket.error(),
+                                 'ok'])
+        policy = retry.RetryPolicy(retries=3, base_delay=1.0, max_delay=1.5)
+        self.assertEqual('ok', policy.call(func, 'a'))
+        func.assert_called_with('a')
+        self.assertEqual(2, sleep.call_count)
+        self.assertTrue(sleep.call_args_list[0][0][0] <= 1.0)
+        self.assertTrue(sleep.call_args_list[1][0][0] <= 1.5)
+
+    @patch('time.sleep')
+    def test_give_up(self, sleep):
+        policy = retry.RetryPolicy(retries=2)
+        func = Mock(side_effect=_rest_error(502))
+        self.assertRaises(BCFRestError, policy.call, func)
+        self.assertEqual(3, func.call_count)
+
+        func = Mock(side_effect=_rest_error(404))
+        self.assertRaises(BCFRestError, policy.call, func)
+        self.assertEqual(1, func.call_count)
+
+        func = Mock(side_effect=CircuitOpen(until='now'))
+        self.assertRaises(CircuitOpen, policy.call, func)
+        self.assertEqual(1, func.call_count)
+
+
+class CircuitBreakerTestCase(base.BaseTestCase):
+
+    def test_open_and_close(self):
+        breaker = retry.CircuitBreaker(threshold=2, reset_timeout=60)
+        with patch('time.time', return_value=100):
+            breaker.before()
+            breaker.failure()
+            breaker.before()
+            breaker.failure()
+            self.assertTrue(breaker.is_open)
+            self.assertRaises(CircuitOpen, breaker.before)
+
+        with patch('time.time', return_value=160):
+            # one trial
+            breaker.before()
+            self.assertRaises(CircuitOpen, breaker.before)
+            breaker.failure()
+            self.assertRaises(CircuitOpen, breaker.before)
+
+        with patch('time.time', return_value=220):
+            breaker.before()
+            breaker.success()
+            self.assertFalse(breaker.is_open)
+            breaker.before()
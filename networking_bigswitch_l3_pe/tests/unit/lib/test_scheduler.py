@@ -0,0 +1,86 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+from mock import patch
+from networking_bigswitch_l3_pe.lib.scheduler import SyncScheduler
+from neutron.tests import base
+
+
+class SyncSchedulerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SyncSchedulerTestCase, self).setUp()
+        self.now = 1000.0
+        patcher = patch('time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(SyncScheduler, '_sleep',
+                               side_effect=self._sleep)
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _sleep(self, wakeup, seconds):
+        self.now += seconds
+
+    def test_backoff(self):
+        scheduler = SyncScheduler(min_interval=600, max_interval=2000,
+                                  jitter=0)
+        scheduler.wait()
+        self.assertEqual(1600, self.now)
+        scheduler.done(False)
+        self.assertEqual(1200, scheduler.interval)
+        scheduler.done(False)
+        self.assertEqual(2000, scheduler.interval)
+        scheduler.done(True)
+        self.assertEqual(600, scheduler.interval)
+
+    def test_jitter(self):
+        scheduler = SyncScheduler(min_interval=600, jitter=0.1)
+        for i in range(10):
+            scheduler.done(True)
+            self.assertTrue(
+                self.now + 600 <= scheduler.deadline <= self.now + 660)
+
+    def test_notify_and_trigger(self):
+        scheduler = SyncScheduler(min_interval=600, debounce=10, jitter=0)
+        scheduler.notify()
+        self.now += 5
+        # doesn't postpone it
+        scheduler.notify()
+        scheduler.wait()
+        self.assertEqual(1010, self.now)
+
+        scheduler.done(True)
+        scheduler.trigger()
+        scheduler.wait()
+        self.assertEqual(1010, self.now)
+
+
+class SyncSchedulerWakeupTestCase(base.BaseTestCase):
+
+    def _test_wakeup(self, func):
+        scheduler = SyncScheduler(min_interval=600, debounce=0, jitter=0)
+        waiter = eventlet.spawn(scheduler.wait)
+        # let it sleep
+        eventlet.sleep(0)
+        func(scheduler)
+        with eventlet.Timeout(1):
+            waiter.wait()
+
+    def test_trigger_wakes_up(self):
+        self._test_wakeup(SyncScheduler.trigger)
+
+    def test_notify_wakes_up(self):
+        self._test_wakeup(SyncScheduler.notify)
@@ -0,0 +1,134 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from networking_bigswitch_l3_pe.lib.exceptions import CircuitOpen
+from networking_bigswitch_l3_pe.lib.exceptions import InvalidSyncPlan
+from networking_bigswitch_l3_pe.lib import sync_plan
+from networking_bigswitch_l3_pe.lib.sync_plan import PlanExecutor
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+from neutron.tests import base
+
+
+def _plan():
+    plan = SyncPlan()
+    plan.create_network({'project_name': 't1', 'segment_name': 'n1'})
+    plan.add_subnet({'project_name': 't1', 'segment_name': 'n1',
+                     'current_gateway_ip': '10.0.1.1/24'})
+    plan.add_subnet({'project_name': 't2', 'segment_name': 'n2',
+                     'original_gateway_ip': '10.0.9.1/24',
+                     'current_gateway_ip': '10.0.2.1/24'})
+    plan.delete_subnet({'project_name': 't3', 'segment_name': 'n3',
+                        'current_gateway_ip': '10.0.3.1/24'})
+    plan.delete_network({'project_name': 't3', 'segment_name': 'n3'})
+    return plan
+
+
+class SyncPlanTestCase(base.BaseTestCase):
+
+    def test_operations(self):
+        plan = _plan()
+        self.assertEqual(
+            [(sync_plan.OP_CREATE_NETWORK, []),
+             (sync_plan.OP_CREATE_SUBNET, [0]),
+             (sync_plan.OP_UPDATE_SUBNET, []),
+             (sync_plan.OP_DELETE_SUBNET, []),
+             (sync_plan.OP_DELETE_NETWORK, [3])],
+            [(o['op'], o['depends_on']) for o in plan.operations])
+
+    def test_delete_tenant(self):
+        plan = _plan()
+        plan.delete_network({'project_name': 't3', 'segment_name': 'n4'})
+        op = plan.delete_tenant({'project_name': 't3'})
+        self.assertEqual([4, 5], op['depends_on'])
+        self.assertEqual(2, len(plan.result()['deleted']['networks']))
+
+    def test_result(self):
+        ret = _plan().result()
+        self.assertEqual(['n1'], [n['segment_name']
+                                  for n in ret['added']['network']])
+        self.assertEqual(2, len(ret['added']['subnet']))
+        self.assertEqual(1, len(ret['deleted']['subnets']))
+        self.assertEqual(1, len(ret['deleted']['networks']))
+        self.assertEqual({}, _plan().result([]))
+
+    def test_json(self):
+        plan = _plan()
+        loaded = SyncPlan.from_json(plan.to_json())
+        self.assertEqual(plan.operations, loaded.operations)
+
+    def test_invalid_json(self):
+        data = _plan().to_dict()
+        data['operations'][1]['depends_on'] = [4]
+        self.assertRaises(InvalidSyncPlan, SyncPlan.from_dict, data)
+        data['operations'][1]['op'] = 'delete_fabric'
+        self.assertRaises(InvalidSyncPlan, SyncPlan.from_dict, data)
+        self.assertRaises(InvalidSyncPlan, SyncPlan.from_dict,
+                          {'version': 0, 'operations': []})
+
+
+class PlanExecutorTestCase(base.BaseTestCase):
+
+    def _handlers(self, **kwargs):
+        handlers = dict((op, Mock(return_value=True))
+                        for op in sync_plan.OPERATIONS)
+        handlers.update(kwargs)
+        return handlers
+
+    def test_execute(self):
+        plan = _plan()
+        handlers = self._handlers()
+        applied = PlanExecutor(handlers).execute(plan)
+        self.assertEqual(plan.operations, applied)
+        handlers[sync_plan.OP_UPDATE_SUBNET].assert_called_once_with(
+            plan.operations[2]['resource'])
+
+    def test_skip_when_dependency_is_not_applied(self):
+        plan = _plan()
+        handlers = self._handlers(
+            create_network=Mock(return_value=False))
+        applied = PlanExecutor(handlers).execute(plan)
+        self.assertEqual([2, 3, 4], [o['id'] for o in applied])
+        self.assertFalse(handlers[sync_plan.OP_CREATE_SUBNET].called)
+
+    def test_error_stops_tenant(self):
+        plan = _plan()
+        handlers = self._handlers(delete_subnet=Mock(side_effect=ValueError))
+        self.assertRaises(ValueError, PlanExecutor(handlers).execute, plan)
+        self.assertFalse(handlers[sync_plan.OP_DELETE_NETWORK].called)
+        self.assertTrue(handlers[sync_plan.OP_UPDATE_SUBNET].called)
+
+    def test_skip_and_report_error(self):
+        plan = _plan()
+        handlers = self._handlers(
+            create_network=Mock(side_effect=[ValueError, True]))
+        plan.create_network({'project_name': 't1', 'segment_name': 'n4'})
+        executor = PlanExecutor(handlers,
+                                is_retriable=lambda e: False)
+        applied = executor.execute(plan)
+        self.assertEqual([2, 3, 4, 5], [o['id'] for o in applied])
+        self.assertEqual([0], [o['id'] for o, e in executor.failures])
+
+    def test_abort_on_fatal_error(self):
+        plan = _plan()
+        handlers = self._handlers(
+            create_network=Mock(side_effect=CircuitOpen(until='now')),
+            update_subnet=Mock(side_effect=ValueError))
+        executor = PlanExecutor(handlers, workers=1,
+                                is_fatal=lambda e: isinstance(e, CircuitOpen))
+        self.assertRaises(CircuitOpen, executor.execute, plan)
+        self.assertEqual([0], [o['id'] for o, e in executor.failures])
+        for op in (sync_plan.OP_UPDATE_SUBNET, sync_plan.OP_DELETE_SUBNET,
+                   sync_plan.OP_DELETE_NETWORK):
+            self.assertFalse(handlers[op].called)
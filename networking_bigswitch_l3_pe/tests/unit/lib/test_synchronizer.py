@@ -0,0 +1,646 @@
+# Copyright 2016 DeNA Co., Ltd.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from mock import Mock
+from mock import patch
+import networking_bigswitch_l3_pe.lib.config
+from networking_bigswitch_l3_pe.lib.checkpoint import Checkpoint
+from networking_bigswitch_l3_pe.lib import rest_client
+from networking_bigswitch_l3_pe.lib import retry
+from networking_bigswitch_l3_pe.lib.exceptions import BCFRestError
+from networking_bigswitch_l3_pe.lib.exceptions import CircuitOpen
+from networking_bigswitch_l3_pe.lib.rate_limiter import RateLimiter
+from networking_bigswitch_l3_pe.lib.sync_plan import SyncPlan
+from networking_bigswitch_l3_pe.lib.synchronizer import Synchronizer
+from networking_bigswitch_l3_pe.tests.fake_bcf import FakeBCFController
+from neutron import context as ncontext
+from neutron.db import models_v2
+from neutron.plugins.ml2 import models
+from neutron.tests import base
+from neutron.tests.unit import testlib_api
+import os
+import shutil
+import tempfile
+import threading
+
+
+def _rest_error(code):
+    return BCFRestError(code=code, result='', method='PUT', url='', data='')
+
+
+def _raise(e):
+    raise e
+
+
+def _os_snapshot():
+    return {
+        'projects': {'p1': 'project1', 'p2': 'project2'},
+        'networks': [
+            {'id': 'n1', 'name': 'net1', 'tenant_id': 'p1'},
+            {'id': 'n2', 'name': 'net2', 'tenant_id': 'p1'},
+            {'id': 'n3', 'name': 'net3', 'tenant_id': 'p2'},
+        ],
+        'subnets': [
+            {'id': 's1', 'network_id': 'n1', 'tenant_id': 'p1',
+             'cidr': '10.0.1.0/24', 'gateway_ip': '10.0.1.1'},
+            {'id': 's2', 'network_id': 'n2', 'tenant_id': 'p1',
+             'cidr': '10.0.2.0/24', 'gateway_ip': '10.0.2.1'},
+            {'id': 's3', 'network_id': 'n3', 'tenant_id': 'p2',
+             'cidr': '10.0.3.0/24', 'gateway_ip': '10.0.3.1'},
+        ],
+    }
+
+
+def _stub_os(sync, os):
+    """Serve the OpenStack snapshot os instead of Keystone and the DB."""
+    def _filter(resources, tenant_ids):
+        return [dict(r) for r in resources
+                if tenant_ids is None or r['tenant_id'] in tenant_ids]
+
+    sync.project_cache = Mock()
+    sync.project_cache.get_projects.side_effect = \
+        lambda: dict(os['projects'])
+    sync.project_cache.get_name.return_value = None
+    sync._get_os_networks = \
+        lambda tenant_ids=None: _filter(os['networks'], tenant_ids)
+    sync._get_os_subnets = \
+        lambda tenant_ids=None: _filter(os['subnets'], tenant_ids)
+
+
+class SynchronizerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SynchronizerTestCase, self).setUp()
+        networking_bigswitch_l3_pe.lib.config.register_config()
+        for target in ('RestClient', 'KeystoneClient'):
+            patcher = patch('networking_bigswitch_l3_pe.lib.synchronizer.' +
+                            target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _setup_synchronizer(self, dry_run=True):
+        sync = Synchronizer('http://127.0.0.1/', 'admin', 'password',
+                            'neutron', [], dry_run=dry_run)
+        sync.checkpoint = None
+        return sync
+
+    def _os(self):
+        return _os_snapshot()
+
+    def _tenant(self, name, segments):
+        return {
+            'name': name,
+            'logical-router': {
+                'tenant-interface': [{'remote-tenant': 'system'}],
+                'segment-interface': [
+                    {'segment': segment,
+                     'ip-subnet': [{'ip-cidr': c} for c in cidrs]}
+                    for segment, cidrs in segments],
+            },
+        }
+
+    def _bcf(self, tenants):
+        return {'tenants': tenants, 'system_tenant_interfaces': []}
+
+    def test_add_resources_when_synchronized(self):
+        sync = self._setup_synchronizer()
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net1', ['10.0.1.1/24']),
+                                              ('net2', ['10.0.2.1/24'])]),
+            self._tenant('project2.neutron', [('net3', ['10.0.3.1/24'])]),
+        ])
+
+        self.assertEqual({}, sync._add_resources(self._os(), bcf))
+
+    def test_add_resources(self):
+        sync = self._setup_synchronizer()
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net1', ['10.0.9.1/24'])]),
+        ])
+
+        ret = sync._add_resources(self._os(), bcf)
+        self.assertEqual([
+            {'project_name': 'project1.neutron', 'segment_name': 'net2'},
+            {'project_name': 'project2.neutron', 'segment_name': 'net3'},
+        ], ret['network'])
+        self.assertEqual([
+            {'project_name': 'project1.neutron', 'segment_name': 'net1',
+             'original_gateway_ip': '10.0.9.1/24',
+             'current_gateway_ip': '10.0.1.1/24'},
+            {'project_name': 'project1.neutron', 'segment_name': 'net2',
+             'current_gateway_ip': '10.0.2.1/24'},
+            {'project_name': 'project2.neutron', 'segment_name': 'net3',
+             'current_gateway_ip': '10.0.3.1/24'},
+        ], ret['subnet'])
+
+    def test_add_resources_keeps_cidr_of_other_subnet(self):
+        sync = self._setup_synchronizer()
+        os = self._os()
+        os['subnets'].append(
+            {'id': 's4', 'network_id': 'n1', 'tenant_id': 'p1',
+             'cidr': '10.0.4.0/24', 'gateway_ip': '10.0.4.1'})
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net1', ['10.0.4.1/24'])]),
+        ])
+
+        ret = sync._add_resources(os, bcf)
+        self.assertIn({'project_name': 'project1.neutron',
+                       'segment_name': 'net1',
+                       'current_gateway_ip': '10.0.1.1/24'}, ret['subnet'])
+
+    def test_delete_resources(self):
+        sync = self._setup_synchronizer()
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net1', ['10.0.1.1/24']),
+                                              ('net9', ['10.0.9.1/24'])]),
+        ])
+
+        ret = sync._delete_resources(bcf, self._os(), None)
+        self.assertEqual([
+            {'project_name': 'project1.neutron', 'segment_name': 'net9',
+             'current_gateway_ip': '10.0.9.1/24'},
+        ], ret['subnets'])
+        self.assertEqual([
+            {'project_name': 'project1.neutron', 'segment_name': 'net9'},
+        ], ret['networks'])
+
+    def test_add_resources_in_order_of_tenant(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        calls = []
+        sync.rest_client.create_net.side_effect = \
+            lambda t, s, e, c: calls.append(('net', t, s)) or True
+        sync.rest_client.create_subnet.side_effect = \
+            lambda t, s, c: calls.append(('subnet', t, s)) or True
+
+        ret = sync._add_resources(self._os(), self._bcf([]))
+        self.assertEqual(3, len(ret['network']))
+        self.assertEqual(3, len(ret['subnet']))
+        for kind, tenant, segment in calls:
+            if kind == 'subnet':
+                self.assertIn(('net', tenant, segment),
+                              calls[:calls.index((kind, tenant, segment))])
+
+    def test_delete_tenant_with_last_network(self):
+        sync = self._setup_synchronizer()
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net1', ['10.0.1.1/24']),
+                                              ('net9', ['10.0.9.1/24'])]),
+            self._tenant('project3.neutron', [('net8', ['10.0.8.1/24'])]),
+        ])
+
+        plan = SyncPlan()
+        sync._plan_delete_resources(bcf, self._os(), None, plan)
+        self.assertEqual(
+            [('delete_tenant', {'project_name': 'project3.neutron'})],
+            [(o['op'], o['resource']) for o in plan.operations
+             if o['op'] == 'delete_tenant'])
+
+    def test_delete_resources_with_error(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.rest_client.delete_subnet.side_effect = ValueError()
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net9', ['10.0.9.1/24'])]),
+        ])
+
+        # skipped and reported
+        self.assertEqual({}, sync._delete_resources(bcf, self._os(), None))
+        self.assertFalse(sync.rest_client.delete_net.called)
+        self.assertEqual(1, sync.metrics.objects[('subnet', 'failed')])
+
+    def test_retry_transient_error(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.retry.base_delay = 0
+        sync.rate_limiter = RateLimiter(rate=1000, burst=1000)
+        sync.rest_client.delete_subnet.side_effect = [
+            _rest_error(503), True]
+        sync.rest_client.delete_net.side_effect = _rest_error(503)
+        bcf = self._bcf([
+            self._tenant('project1.neutron', [('net9', ['10.0.9.1/24'])]),
+        ])
+
+        self.assertRaises(BCFRestError,
+                          sync._delete_resources, bcf, self._os(), None)
+        self.assertEqual(2, sync.rest_client.delete_subnet.call_count)
+        self.assertEqual(sync.retry.retries + 1,
+                         sync.rest_client.delete_net.call_count)
+
+    def test_rate_with_permanent_error(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.retry.retries = 0
+        sync.rate_limiter = RateLimiter(rate=10, burst=1000)
+        self.assertRaises(BCFRestError, sync._rest_write,
+                          Mock(side_effect=_rest_error(404)))
+        self.assertLessEqual(10, sync.rate_limiter.rate)
+        self.assertRaises(BCFRestError, sync._rest_write,
+                          Mock(side_effect=_rest_error(503)))
+        self.assertGreater(10, sync.rate_limiter.rate)
+
+    def test_breaker_trial_with_permanent_error(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.retry.retries = 0
+        sync.rate_limiter = RateLimiter(rate=1000, burst=1000)
+        sync.breaker = retry.CircuitBreaker(threshold=1, reset_timeout=60)
+        func = Mock(side_effect=[_rest_error(503), _rest_error(404), True])
+
+        with patch('time.time', return_value=100):
+            self.assertRaises(BCFRestError, sync._rest_write, func)
+            self.assertTrue(sync.breaker.is_open)
+        with patch('time.time', return_value=160):
+            # The trial reached the controller, so writes are resumed.
+            self.assertRaises(BCFRestError, sync._rest_write, func)
+            self.assertFalse(sync.breaker.is_open)
+            self.assertTrue(sync._rest_write(func))
+
+    def test_plan_and_apply_plan(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.rest_client.get_tenants.return_value = [
+            self._tenant('project1.neutron', [('net1', ['10.0.1.1/24']),
+                                              ('net9', ['10.0.9.1/24'])]),
+        ]
+        sync.rest_client.get_system_tenant_interfaces.return_value = []
+        _stub_os(sync, self._os())
+
+        plan = sync.plan(events=None)
+        self.assertEqual(
+            ['create_network', 'create_network', 'create_subnet',
+             'create_subnet', 'delete_subnet', 'delete_network'],
+            [o['op'] for o in plan.operations])
+        self.assertFalse(sync.rest_client.create_net.called)
+
+        ret = sync.apply_plan(SyncPlan.from_json(plan.to_json()))
+        self.assertEqual(plan.result(), ret)
+        self.assertEqual(2, sync.rest_client.create_net.call_count)
+        sync.rest_client.delete_net.assert_called_once_with(
+            'project1.neutron', 'net9', False)
+
+    def test_abort_plan_while_paused(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        sync.retry.retries = 0
+        sync.rate_limiter = RateLimiter(rate=1000, burst=1000)
+        sync.breaker = retry.CircuitBreaker(threshold=1, reset_timeout=60)
+        sync.sync_workers = 1
+        sync.rest_client.get_tenants.return_value = []
+        sync.rest_client.get_system_tenant_interfaces.return_value = []
+        sync.rest_client.create_net.side_effect = _rest_error(503)
+        _stub_os(sync, self._os())
+
+        plan = sync.plan(events=None)
+        self.assertRaises(CircuitOpen, sync.apply_plan, plan)
+        # paused after the first one, and the rest isn't tried
+        self.assertEqual(1, sync.rest_client.create_net.call_count)
+        self.assertFalse(sync.rest_client.create_subnet.called)
+
+    def test_cycles_run_one_at_a_time(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        started = threading.Event()
+        release = threading.Event()
+
+        def _synchronize(*args):
+            started.set()
+            release.wait()
+            return {}
+
+        sync._synchronize = Mock(side_effect=_synchronize)
+        sync._apply_events = Mock(return_value={})
+        full = threading.Thread(target=sync.synchronize)
+        full.start()
+        started.wait()
+        incremental = threading.Thread(target=sync.apply_events, args=([],))
+        incremental.start()
+        incremental.join(0.2)
+        self.assertFalse(sync._apply_events.called)
+
+        release.set()
+        full.join()
+        incremental.join()
+        self.assertTrue(sync._apply_events.called)
+
+    def test_plan_with_scope(self):
+        sync = self._setup_synchronizer()
+        sync.rest_client.get_tenants.return_value = [
+            self._tenant('project1.neutron', [('net1', ['10.0.1.1/24']),
+                                              ('net8', ['10.0.8.1/24'])]),
+            self._tenant('project2.neutron', [('net9', ['10.0.9.1/24'])]),
+        ]
+        sync.rest_client.get_system_tenant_interfaces.return_value = []
+        _stub_os(sync, self._os())
+
+        plan = sync.plan(projects=['p1'])
+        self.assertEqual(
+            [('create_network', 'net2'), ('create_subnet', 'net2'),
+             ('delete_subnet', 'net8'), ('delete_network', 'net8')],
+            [(o['op'], o['resource']['segment_name'])
+             for o in plan.operations])
+
+        plan = sync.plan(projects=['project1', 'project2'],
+                         segments=['net1', 'net3'])
+        self.assertEqual(
+            [('create_network', 'net3'), ('create_subnet', 'net3')],
+            [(o['op'], o['resource']['segment_name'])
+             for o in plan.operations])
+        self.assertFalse(sync.project_cache.invalidate.called)
+
+    def test_resolve_scope(self):
+        sync = self._setup_synchronizer()
+        _stub_os(sync, self._os())
+
+        # the project of a BCF tenant may have been deleted
+        self.assertEqual(
+            (set(['p1']), set(['project1.neutron', 'project9.neutron'])),
+            sync._resolve_scope(None, ['project1.neutron',
+                                       'project9.neutron']))
+        self.assertFalse(sync.project_cache.invalidate.called)
+
+        # a project may be missing in the cached listing
+        self.assertEqual((set(['p1']), set(['project1.neutron'])),
+                         sync._resolve_scope(['p1', 'p9'], None))
+        sync.project_cache.invalidate.assert_called_once_with()
+
+    def test_apply_events(self):
+        sync = self._setup_synchronizer(dry_run=False)
+        network = {'project_name': 'project1.neutron', 'segment_name': 'net1'}
+        subnet = {'project_name': 'project1.neutron', 'segment_name': 'net1',
+                  'original_gateway_ip': '10.0.9.1/24',
+                  'current_gateway_ip': '10.0.1.1/24'}
+
+        ret = sync.apply_events([
+            {'event_type': 'create_network', 'payload': network},
+            {'event_type': 'update_subnet', 'payload': subnet},
+        ])
+        self.assertEqual({'network': [network], 'subnet': [subnet]}, ret)
+        sync.rest_client.create_net.assert_called_once_with(
+            'project1.neutron', 'net1', frozenset(), ())
+        sync.rest_client.update_subnet.assert_called_once_with(
+            'project1.neutron', 'net1', '10.0.9.1/24', '10.0.1.1/24')
+        self.assertFalse(sync.rest_client.get_tenants.called)
+
+
+class SynchronizerFakeBCFTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SynchronizerFakeBCFTestCase, self).setUp()
+        networking_bigswitch_l3_pe.lib.config.register_config()
+        patcher = patch('networking_bigswitch_l3_pe.lib.synchronizer.'
+                        'KeystoneClient')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.controller = FakeBCFController(neutron_id='neutron')
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+        self.os = _os_snapshot()
+        self.sync = Synchronizer(self.controller.api_url, 'admin',
+                                 'password', 'neutron', [], dry_run=False)
+        self.sync.rate_limiter = RateLimiter(rate=1000, burst=1000)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.sync.checkpoint = Checkpoint(os.path.join(tmpdir, 'ckpt'))
+        _stub_os(self.sync, self.os)
+
+    def _segments(self):
+        return sorted(
+            (t['name'], si['segment'],
+             tuple(i['ip-cidr'] for i in si.get('ip-subnet', [])))
+            for t in self.controller.state.get_tenants('neutron')
+            for si in t['logical-router'].get('segment-interface', []))
+
+    def test_synchronize(self):
+        self.sync.synchronize(events=[])
+        self.assertEqual([
+            ('project1.neutron', 'net1', ('10.0.1.1/24',)),
+            ('project1.neutron', 'net2', ('10.0.2.1/24',)),
+            ('project2.neutron', 'net3', ('10.0.3.1/24',)),
+        ], self._segments())
+        self.assertEqual({}, self.sync.synchronize(events=[]))
+
+        self.os['networks'].pop(2)
+        self.os['subnets'].pop(2)
+        self.sync.synchronize(events=[
+            {'event_type': 'delete_subnet',
+             'payload': {'project_name': 'project2.neutron',
+                         'segment_name': 'net3',
+                         'current_gateway_ip': '10.0.3.1/24'}},
+            {'event_type': 'delete_network',
+             'payload': {'project_name': 'project2.neutron',
+                         'segment_name': 'net3'}},
+        ])
+        self.assertEqual([
+            ('project1.neutron', 'net1', ('10.0.1.1/24',)),
+            ('project1.neutron', 'net2', ('10.0.2.1/24',)),
+        ], self._segments())
+        self.assertNotIn({'remote-tenant': 'project2.neutron'},
+                         self.controller.state.get_tenant_interfaces('system'))
+
+    def test_synchronize_events(self):
+        self.sync.synchronize(events=[])
+        full = self.sync.metrics.cycles['full']
+        self.os['networks'].pop(2)
+        self.os['subnets'].pop(2)
+        del self.controller.requests[:]
+
+        ret = self.sync.synchronize_events([
+            {'event_type': 'delete_network',
+             'payload': {'project_name': 'project2.neutron',
+                         'segment_name': 'net3'}},
+        ])
+        self.assertEqual(
+            {'deleted': {'networks': [{'project_name': 'project2.neutron',
+                                       'segment_name': 'net3'}]}}, ret)
+        gets = [path for verb, path in self.controller.requests
+                if verb == 'GET']
+        self.assertTrue(gets)
+        self.assertTrue(all('project2.neutron' in path for path in gets))
+        # the tenant is torn down once without listing its segments
+        self.assertFalse([path for path in gets
+                          if path.endswith('/segment-interface')])
+        deletes = [path[len(rest_client.BASE_PATH):]
+                   for verb, path in self.controller.requests
+                   if verb == 'DELETE']
+        self.assertEqual(1, len([path for path in deletes if path.endswith(
+            '/tenant-interface[remote-tenant="project2.neutron"]')]))
+        self.assertNotIn({'remote-tenant': 'project2.neutron'},
+                         self.controller.state.get_tenant_interfaces('system'))
+        # recorded apart from the full synchronization
+        self.assertIs(full, self.sync.metrics.cycles['full'])
+        self.assertIn('events', self.sync.metrics.cycles)
+
+    def test_resume(self):
+        self.sync.synchronize(events=[])
+        self.os['networks'].append(
+            {'id': 'n4', 'name': 'net4', 'tenant_id': 'p1'})
+        self.os['networks'].append(
+            {'id': 'n5', 'name': 'net5', 'tenant_id': 'p2'})
+        create_net = self.sync.rest_client.create_net
+        self.sync.rest_client.create_net = Mock(return_value=True)
+        self.sync.rest_client.create_net.side_effect = \
+            lambda t, s, e, c: create_net(t, s, e, c) if s != 'net5' else \
+            _raise(_rest_error(503))
+        self.sync.retry.retries = 0
+
+        self.assertRaises(BCFRestError, self.sync.synchronize, events=[])
+        self.assertTrue(self.sync.has_checkpoint())
+        plan, applied = self.sync.checkpoint.load()
+        self.assertEqual(['net4'], [plan.operations[i]['resource']
+                                    ['segment_name'] for i in applied])
+
+        self.sync.rest_client.create_net.side_effect = create_net
+        del self.controller.requests[:]
+        ret = self.sync.resume()
+        self.assertEqual(
+            {'added': {'network': [{'project_name': 'project2.neutron',
+                                    'segment_name': 'net5'}]}}, ret)
+        self.assertFalse(self.sync.has_checkpoint())
+        self.assertTrue(all('project2.neutron' in path
+                            for verb, path in self.controller.requests))
+        self.assertIsNone(self.sync.resume())
+
+    def test_fingerprints(self):
+        self.sync.synchronize(events=[])
+        del self.controller.requests[:]
+
+        # nothing changed
+        self.assertEqual({}, self.sync.synchronize(events=[]))
+        self.assertEqual([], self.controller.requests)
+
+        self.os['subnets'][2]['gateway_ip'] = '10.0.3.254'
+        self.sync.synchronize(events=[])
+        self.assertTrue(self.controller.requests)
+        self.assertTrue(all('project2.neutron' in path
+                            for verb, path in self.controller.requests))
+        self.assertIn(('project2.neutron', 'net3', ('10.0.3.254/24',)),
+                      self._segments())
+
+        # changed on BCF, which is repaired by the full synchronization
+        self.controller.state.delete_segment_interface(
+            'project1.neutron', 'net1')
+        self.assertEqual({}, self.sync.synchronize(events=[]))
+        self.sync.reconciled_at -= self.sync.full_interval
+        ret = self.sync.synchronize(events=[])
+        self.assertEqual([{'project_name': 'project1.neutron',
+                           'segment_name': 'net1'}], ret['added']['network'])
+
+    def test_skip_existing_tenant_objects(self):
+        self.sync.synchronize(events=[])
+        self.os['networks'].append(
+            {'id': 'n4', 'name': 'net4', 'tenant_id': 'p1'})
+        del self.controller.requests[:]
+
+        self.sync.synchronize(events=[])
+        self.assertEqual(
+            ['/tenant[name="project1.neutron"]/logical-router'
+             '/segment-interface[segment="net4"]'],
+            [path[len(rest_client.BASE_PATH):]
+             for verb, path in self.controller.requests if verb == 'PUT'])
+
+        # learned from the creation of net4
+        self.sync.apply_events([
+            {'event_type': 'create_network',
+             'payload': {'project_name': 'project1.neutron',
+                         'segment_name': 'net5'}},
+        ])
+        self.assertEqual(2, len([r for r in self.controller.requests
+                                 if r[0] == 'PUT']))
+
+    def test_forget_tenant_objects_of_deleted_network(self):
+        self.sync.synchronize(events=[])
+        self.os['networks'].pop(0)
+        self.os['subnets'].pop(0)
+        self.sync.synchronize(events=[
+            {'event_type': 'delete_network',
+             'payload': {'project_name': 'project1.neutron',
+                         'segment_name': 'net1'}},
+        ])
+        # torn down by another process behind us
+        self.controller.state.delete_tenant_interface('system',
+                                                      'project1.neutron')
+        del self.controller.requests[:]
+
+        self.sync.apply_events([
+            {'event_type': 'create_network',
+             'payload': {'project_name': 'project1.neutron',
+                         'segment_name': 'net1'}},
+        ])
+        self.assertIn({'remote-tenant': 'project1.neutron'},
+                      self.controller.state.get_tenant_interfaces('system'))
+
+    def test_bulk_provisioning(self):
+        self.sync.bulk_provisioning = True
+        self.sync.rest_client.bulk = True
+        ret = self.sync.synchronize(events=[])
+        self.assertEqual(3, len(ret['added']['subnet']))
+        self.assertEqual([
+            ('project1.neutron', 'net1', ('10.0.1.1/24',)),
+            ('project1.neutron', 'net2', ('10.0.2.1/24',)),
+            ('project2.neutron', 'net3', ('10.0.3.1/24',)),
+        ], self._segments())
+        writes = [verb for verb, path in self.controller.requests
+                  if verb != 'GET' and path.startswith(rest_client.BASE_PATH)]
+        # a system tenant-interface per tenant and a PATCH per network
+        self.assertEqual(['PATCH'] * 3 + ['PUT'] * 2, sorted(writes))
+
+
+class SynchronizerDBTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(SynchronizerDBTestCase, self).setUp()
+        networking_bigswitch_l3_pe.lib.config.register_config()
+        for target in ('RestClient', 'KeystoneClient'):
+            patcher = patch('networking_bigswitch_l3_pe.lib.synchronizer.' +
+                            target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sync = Synchronizer('http://127.0.0.1/', 'admin', 'password',
+                                 'neutron', ['physnet2'])
+
+        ctx = ncontext.get_admin_context()
+        with ctx.session.begin(subtransactions=True):
+            # n1 on physnet1, n2 on physnet2 and n3 without a segment
+            for i, tenant_id, physnet in ((1, 'p1', 'physnet1'),
+                                          (2, 'p1', 'physnet2'),
+                                          (3, 'p2', None)):
+                ctx.session.add(models_v2.Network(
+                    id='n%d' % i, name='net%d' % i, tenant_id=tenant_id,
+                    status='ACTIVE', admin_state_up=True))
+                ctx.session.add(models_v2.Subnet(
+                    id='s%d' % i, network_id='n%d' % i, tenant_id=tenant_id,
+                    ip_version=4, cidr='10.0.%d.0/24' % i,
+                    gateway_ip='10.0.%d.1' % i, enable_dhcp=False))
+                if physnet:
+                    ctx.session.add(models.NetworkSegment(
+                        id='seg%d' % i, network_id='n%d' % i,
+                        network_type='vlan', physical_network=physnet,
+                        segmentation_id=100 + i))
+
+    def test_get_os_networks(self):
+        self.assertEqual(
+            [{'id': 'n1', 'name': 'net1', 'tenant_id': 'p1'},
+             {'id': 'n3', 'name': 'net3', 'tenant_id': 'p2'}],
+            sorted(self.sync._get_os_networks(), key=lambda n: n['id']))
+        self.assertEqual(
+            [{'id': 'n1', 'name': 'net1', 'tenant_id': 'p1'}],
+            self.sync._get_os_networks(tenant_ids=['p1']))
+
+        self.sync.exclude_physical_networks = []
+        self.assertEqual(['n1', 'n2', 'n3'], sorted(
+            n['id'] for n in self.sync._get_os_networks()))
+
+    def test_get_os_subnets(self):
+        self.assertEqual(
+            [{'id': 's1', 'network_id': 'n1', 'tenant_id': 'p1',
+              'cidr': '10.0.1.0/24', 'gateway_ip': '10.0.1.1'},
+             {'id': 's3', 'network_id': 'n3', 'tenant_id': 'p2',
+              'cidr': '10.0.3.0/24', 'gateway_ip': '10.0.3.1'}],
+            sorted(self.sync._get_os_subnets(), key=lambda s: s['id']))
+        self.assertEqual(['s3'], [
+            s['id'] for s in self.sync._get_os_subnets(tenant_ids=['p2'])])